@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+JSON encoders of API responses.
+
+Encoder is chosen by API_JSON_ENCODER setting. With "auto" ujson
+is used if it's installed and standard json otherwise: with compact
+separators json uses its C encoder, which outruns simplejson.
+Every encoder is called as encode(data, pretty=False) and returns
+compact JSON string, or JSON indented by 4 spaces if pretty is set.
+"""
+
+import json
+import threading
+
+from nailgun.logger import logger
+from nailgun.settings import settings
+
+
+def _json_encoder(module):
+    def encode(data, pretty=False):
+        if pretty:
+            return module.dumps(data, indent=4)
+        return module.dumps(data, separators=(',', ':'))
+    return encode
+
+
+def _load_ujson():
+    import ujson
+
+    def encode(data, pretty=False):
+        return ujson.dumps(data, indent=4 if pretty else 0)
+    return encode
+
+
+def _load_simplejson():
+    import simplejson
+    return _json_encoder(simplejson)
+
+
+def _load_json():
+    return _json_encoder(json)
+
+
+loaders = (
+    ('ujson', _load_ujson),
+    ('simplejson', _load_simplejson),
+    ('json', _load_json),
+)
+# encoders in order of preference for "auto"
+auto = ('ujson', 'json')
+
+_lock = threading.Lock()
+_encoder = None
+
+
+def load_encoder(name):
+    """
+    Returns encode function of given library.
+
+    :param name: "auto" or name of JSON library.
+    :returns: Tuple of library name and encode function.
+    :raises: ImportError if library isn't installed,
+        ValueError if it isn't supported.
+    """
+    if name == 'auto':
+        for lib, loader in loaders:
+            if lib not in auto:
+                continue
+            try:
+                return lib, loader()
+            except ImportError:
+                continue
+    for lib, loader in loaders:
+        if lib == name:
+            return lib, loader()
+    raise ValueError("Unknown JSON encoder: {0}".format(name))
+
+
+def get_encoder():
+    """
+    Returns encode function which is configured by settings.
+    If configured library can't be loaded, standard json is used.
+    """
+    global _encoder
+    if _encoder is not None:
+        return _encoder
+    with _lock:
+        if _encoder is None:
+            name = settings.API_JSON_ENCODER
+            try:
+                lib, encoder = load_encoder(name)
+            except (ImportError, ValueError) as exc:
+                logger.warning(
+                    u"Can't use JSON encoder {0}: {1}".format(name, exc)
+                )
+                lib, encoder = load_encoder('json')
+            logger.debug(u"Using %s to encode API responses", lib)
+            _encoder = encoder
+        return _encoder
+
+
+def encode(data, pretty=False):
+    return get_encoder()(data, pretty=pretty)
@@ -15,6 +15,7 @@
 #    under the License.
 
 import json
+import zlib
 
 import sqlalchemy.types as types
 
@@ -32,3 +33,22 @@ class JSON(types.TypeDecorator):
         if value is not None:
             value = json.loads(value)
         return value
+
+
+class CompressedJSON(types.TypeDecorator):
+    """
+    JSON compressed with zlib, for big values which are
+    written once and rarely read.
+    """
+
+    impl = types.LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            value = zlib.compress(json.dumps(value))
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            value = json.loads(zlib.decompress(value))
+        return value
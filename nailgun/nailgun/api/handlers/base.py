@@ -14,17 +14,31 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
+import re
 import uuid
+import hashlib
+from gzip import GzipFile
+from functools import wraps
+from operator import attrgetter
+from StringIO import StringIO
 from wsgiref.handlers import format_date_time
 from datetime import datetime
 
 import web
 import netaddr
+from sqlalchemy import Enum
+from sqlalchemy import Boolean
+from sqlalchemy import Integer
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import subqueryload
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.orm.properties import RelationshipProperty
 
 import nailgun.rpc as rpc
 from nailgun.db import db
 from nailgun import notifier
+from nailgun.stats import counters, gauges
+from nailgun.table_versions import table_versions
 from nailgun.settings import settings
 from nailgun.errors import errors
 from nailgun.logger import logger
@@ -34,6 +48,7 @@ from nailgun.api.models import Node
 from nailgun.api.models import Network
 from nailgun.api.models import Vlan
 from nailgun.api.models import Task
+from nailgun.api import encoders
 from nailgun.api.validators.base import BasicValidator
 
 
@@ -59,27 +74,244 @@ def forbid_client_caching(handler):
 
 
 def content_json(func):
+    @wraps(func)
     def json_header(*args, **kwargs):
         web.header('Content-Type', 'application/json')
         data = func(*args, **kwargs)
-        return build_json_response(data)
+        # responses are measured as "api_<Handler>.<METHOD>"
+        name = 'api_{0}.{1}'.format(
+            args[0].__class__.__name__ if args else '', func.__name__
+        )
+        with counters.timer(name + '_encode'):
+            body = build_json_response(data)
+        if isinstance(body, str):
+            counters.incr(name + '_bytes', len(body))
+            body = gzip_response(body)
+            counters.incr(name + '_sent_bytes', len(body))
+        return body
     return json_header
 
 
+def etag(*tables):
+    """
+    Decorator of GET method which sends weak ETag built from
+    versions of given tables and URL of request. If client sends
+    it back in If-None-Match, 304 Not Modified is returned and
+    method isn't called at all. It should be applied on top of
+    content_json, because 304 response has no content type.
+
+    :param tables: Names of tables which response is built from.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            tag = 'W/"{0}"'.format(hashlib.md5(
+                table_versions.tag(tables, web.ctx.fullpath)
+            ).hexdigest())
+            web.header('ETag', tag)
+            if etag_matches(tag, web.ctx.env.get('HTTP_IF_NONE_MATCH')):
+                counters.incr('api_{0}.{1}_not_modified'.format(
+                    args[0].__class__.__name__ if args else '',
+                    func.__name__
+                ))
+                raise web.notmodified()
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_response_counter = re.compile(
+    r'^api_(\w+\.[A-Z]+)_(encode_calls|encode_seconds|bytes|sent_bytes'
+    r'|not_modified)$'
+)
+
+
+def api_responses():
+    """
+    Returns counters of content_json and etag grouped by endpoint
+    "<Handler>.<METHOD>": number and time of encodings, bytes of
+    JSON, bytes sent after gzip and number of 304 responses.
+    """
+    result = {}
+    for name, value in counters.snapshot().iteritems():
+        match = _response_counter.match(name)
+        if match:
+            result.setdefault(match.group(1), {})[match.group(2)] = value
+    return result
+
+
+gauges.register('api_responses', api_responses)
+
+
+def etag_matches(tag, if_none_match):
+    if not if_none_match:
+        return False
+    for value in if_none_match.split(','):
+        value = value.strip()
+        if value == '*' or value == tag or 'W/' + value == tag:
+            return True
+    return False
+
+
+def pretty_requested():
+    pretty = web.input(_method='get', pretty=None).pretty
+    return pretty not in (None, '', '0', 'false')
+
+
 def build_json_response(data):
     web.header('Content-Type', 'application/json')
     if type(data) in (dict, list):
-        return json.dumps(data, indent=4)
+        return encoders.encode(data, pretty=pretty_requested())
     return data
 
 
+def parse_bool(value):
+    if value.lower() in ('1', 'true'):
+        return True
+    if value.lower() in ('0', 'false'):
+        return False
+    raise ValueError("Invalid boolean value: {0}".format(value))
+
+
+def parse_number(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise ValueError("Invalid number: {0}".format(value))
+    return number
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Checks if gzip is acceptable according to
+    value of Accept-Encoding request header.
+    """
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def gzip_response(body):
+    """
+    Compresses response body if it's big enough
+    and client accepts gzip content-encoding.
+    """
+    min_size = settings.API_GZIP_MIN_SIZE
+    if not min_size or len(body) < min_size:
+        return body
+    web.header('Vary', 'Accept-Encoding')
+    if not accepts_gzip(web.ctx.env.get('HTTP_ACCEPT_ENCODING', '')):
+        return body
+    buf = StringIO()
+    with GzipFile(fileobj=buf, mode='wb',
+                  compresslevel=settings.API_GZIP_LEVEL) as gz:
+        gz.write(body)
+    web.header('Content-Encoding', 'gzip')
+    return buf.getvalue()
+
+
 handlers = {}
 
+# compiled serializers by (model, fields)
+serializers = {}
+
+
+def _attribute_kind(model, name):
+    impl = getattr(getattr(model, name, None), 'impl', None)
+    return impl.__class__.__name__ if impl is not None else None
+
+
+def _related_handler_name(model, name):
+    return getattr(model, name).property.mapper.class_.__name__
+
+
+def _field_serializer(model, name):
+    get = attrgetter(name)
+    kind = _attribute_kind(model, name)
+    if kind == 'ScalarObjectAttributeImpl':
+        def serialize(instance, json_data):
+            value = get(instance)
+            json_data[name] = value.id if value is not None else None
+    elif kind == 'CollectionAttributeImpl':
+        def serialize(instance, json_data):
+            json_data[name] = [v.id for v in get(instance)]
+    else:
+        def serialize(instance, json_data):
+            json_data[name] = get(instance)
+    return serialize
+
+
+def _nested_serializer(model, name, subfields):
+    get = attrgetter(name)
+    kind = _attribute_kind(model, name)
+    if kind == 'ScalarObjectAttributeImpl':
+        handler_name = _related_handler_name(model, name)
+
+        def serialize(instance, json_data):
+            value = get(instance)
+            if value is not None:
+                json_data[name] = handlers[handler_name].render(
+                    value, fields=subfields
+                )
+    elif kind == 'CollectionAttributeImpl':
+        handler_name = _related_handler_name(model, name)
+
+        def serialize(instance, json_data):
+            render = handlers[handler_name].render
+            json_data[name] = [
+                render(v, fields=subfields) for v in get(instance)
+            ]
+    else:
+        def serialize(instance, json_data):
+            pass
+    return serialize
+
+
+def compile_fields(model, fields):
+    """
+    Turns fields declaration into list of functions which
+    copy values of fields from instance of model to dict.
+    Kind of every field is looked up only here, so rendering
+    doesn't need to inspect model for every instance.
+
+    :param model: Model class.
+    :param fields: Fields declaration like in JSONHandler.fields.
+    :returns: List of serialize(instance, json_data) functions.
+    """
+    key = (model, tuple(fields))
+    if key not in serializers:
+        # backrefs are added to models only when mappers are configured
+        configure_mappers()
+        compiled = []
+        for field in fields:
+            if isinstance(field, (tuple,)):
+                subfields = None if field[1] == '*' else field[1:]
+                compiled.append(
+                    _nested_serializer(model, field[0], subfields)
+                )
+            else:
+                compiled.append(_field_serializer(model, field))
+        serializers[key] = compiled
+    return serializers[key]
+
 
 class HandlerRegistrator(type):
     def __init__(cls, name, bases, dct):
         super(HandlerRegistrator, cls).__init__(name, bases, dct)
         if hasattr(cls, 'model'):
+            if cls.fields:
+                compile_fields(cls.model, cls.fields)
             key = cls.model.__name__
             if key in handlers:
                 logger.warning("Handler for %s already registered" % key)
@@ -92,6 +324,11 @@ class JSONHandler(object):
     validator = BasicValidator
 
     fields = []
+    # relationships which are used by render() besides fields
+    eager_fields = ()
+    # columns by which collection handler filters objects
+    # with query parameters like ?status=ready,error&online=1
+    filters = ()
 
     def checked_data(self, validate_method=None):
         try:
@@ -138,51 +375,162 @@ class JSONHandler(object):
                 getattr(logger, log_get[0])(log_get[1])
         return obj
 
+    def render_query(self, handler, query, limit=None):
+        """
+        Renders objects of collection query according
+        to query parameters of request:
+
+        - <filter>=value[,value...] for every column in self.filters;
+        - limit=N and offset=N, or after=<id> to get objects with
+          bigger ids than given one; objects are ordered by id then
+          and total number of them is sent in X-Total-Count header;
+        - fields=a[,b...] to get only given fields of handler.fields,
+          only their columns are selected from database then.
+
+        :param handler: Handler which renders objects.
+        :param query: Query of handler model.
+        :param limit: Number of objects if limit isn't requested.
+        :returns: List of rendered objects.
+        :raises: web.badrequest on invalid parameters.
+        """
+        params = web.input(
+            _method='get', limit=None, offset=None, after=None, fields=None
+        )
+        model = handler.model
+        try:
+            for name in self.filters:
+                if params.get(name):
+                    query = query.filter(
+                        self.filter_condition(model, name, params[name])
+                    )
+            paging = [
+                parse_number(params[name]) if params[name] else None
+                for name in ('limit', 'offset', 'after')
+            ]
+            columns = None
+            if params.fields:
+                columns = handler.field_columns(params.fields.split(','))
+        except ValueError as exc:
+            raise web.badrequest(message=str(exc))
+
+        limit_param, offset, after = paging
+        if any(p is not None for p in paging):
+            web.header('X-Total-Count', str(query.count()))
+            query = query.order_by(model.id)
+            if after is not None:
+                query = query.filter(model.id > after)
+            if offset:
+                query = query.offset(offset)
+        if limit_param is not None:
+            limit = limit_param
+        if limit is not None:
+            query = query.limit(limit)
+
+        if columns is not None:
+            names = [name for name, column in columns]
+            query = query.with_entities(*[c for name, c in columns])
+            return [dict(zip(names, row)) for row in query]
+        return handler.render_collection(handler.eager_load(query).all())
+
+    @classmethod
+    def filter_condition(cls, model, name, value):
+        column = getattr(model, name)
+        column_type = column.property.columns[0].type
+        if isinstance(column_type, Boolean):
+            convert = parse_bool
+        elif isinstance(column_type, Integer):
+            convert = parse_number
+        else:
+            convert = unicode
+        values = [convert(v) for v in value.split(',')]
+        for v in values:
+            if isinstance(column_type, Enum) and v not in column_type.enums:
+                raise ValueError("Invalid {0}: {1}".format(name, v))
+        return column.in_(values)
+
+    @classmethod
+    def field_columns(cls, names):
+        """
+        Returns columns of model which hold given fields.
+        Related object is selected as its foreign key.
+
+        :param names: Names of fields from cls.fields.
+        :returns: List of (name, column) tuples.
+        :raises: ValueError if field can't be selected.
+        """
+        columns = []
+        for name in names:
+            if name not in cls.fields:
+                raise ValueError("Unknown field: {0}".format(name))
+            attr = getattr(cls.model, name)
+            prop = attr.property
+            if isinstance(prop, RelationshipProperty):
+                if prop.uselist:
+                    raise ValueError(
+                        "Field can't be selected: {0}".format(name)
+                    )
+                attr = prop.local_remote_pairs[0][0]
+            columns.append((name, attr))
+        return columns
+
+    @classmethod
+    def eager_load(cls, query, fields=None):
+        """
+        Adds loader options for every relationship which is used
+        by render(), so rendering all objects of query doesn't
+        lazy-load them one by one. Scalar relationships are
+        joined, collections are loaded with one more query each.
+
+        :param query: Query of handler model.
+        :param fields: Fields to render, cls.fields by default.
+        :returns: Query with loader options.
+        """
+        use_fields = tuple(fields or cls.fields) + tuple(cls.eager_fields)
+        options = [
+            subqueryload(path) if uselist else joinedload(path)
+            for path, uselist in cls._eager_paths(cls.model, use_fields)
+        ]
+        return query.options(*options) if options else query
+
+    @classmethod
+    def _eager_paths(cls, model, fields, prefix='', seen=()):
+        seen = seen + (model,)
+        for field in fields:
+            if isinstance(field, (tuple,)):
+                name, subfields = field[0], field[1:]
+            else:
+                name, subfields = field, None
+            prop = getattr(getattr(model, name, None), 'property', None)
+            if not isinstance(prop, RelationshipProperty):
+                continue
+            path = prefix + name
+            yield path, prop.uselist
+
+            related = prop.mapper.class_
+            handler = handlers.get(related.__name__)
+            if subfields is None or handler is None or related in seen:
+                continue
+            if subfields == ('*',):
+                subfields = handler.fields
+            subfields = tuple(subfields) + tuple(handler.eager_fields)
+            for sub in cls._eager_paths(related, subfields,
+                                        path + '.', seen):
+                yield sub
+
+    @classmethod
+    def render_collection(cls, instances):
+        """
+        Renders list of objects, handlers can override it
+        to fetch data for all objects at once.
+        """
+        return map(cls.render, instances)
+
     @classmethod
     def render(cls, instance, fields=None):
         json_data = {}
         use_fields = fields if fields else cls.fields
         if not use_fields:
             raise ValueError("No fields for serialize")
-        for field in use_fields:
-            if isinstance(field, (tuple,)):
-                if field[1] == '*':
-                    subfields = None
-                else:
-                    subfields = field[1:]
-
-                value = getattr(instance, field[0])
-                rel = getattr(
-                    instance.__class__, field[0]).impl.__class__.__name__
-                if value is None:
-                    pass
-                elif rel == 'ScalarObjectAttributeImpl':
-                    handler = handlers[value.__class__.__name__]
-                    json_data[field[0]] = handler.render(
-                        value, fields=subfields
-                    )
-                elif rel == 'CollectionAttributeImpl':
-                    if not value:
-                        json_data[field[0]] = []
-                    else:
-                        handler = handlers[value[0].__class__.__name__]
-                        json_data[field[0]] = [
-                            handler.render(v, fields=subfields) for v in value
-                        ]
-            else:
-                value = getattr(instance, field)
-                if value is None:
-                    json_data[field] = value
-                else:
-                    f = getattr(instance.__class__, field)
-                    if hasattr(f, "impl"):
-                        rel = f.impl.__class__.__name__
-                        if rel == 'ScalarObjectAttributeImpl':
-                            json_data[field] = value.id
-                        elif rel == 'CollectionAttributeImpl':
-                            json_data[field] = [v.id for v in value]
-                        else:
-                            json_data[field] = value
-                    else:
-                        json_data[field] = value
+        for serialize in compile_fields(instance.__class__, use_fields):
+            serialize(instance, json_data)
         return json_data
@@ -14,7 +14,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import traceback
 import web
 import netaddr
@@ -33,6 +32,7 @@ from nailgun.api.validators.cluster import ClusterValidator
 from nailgun.api.validators.cluster import AttributesValidator
 from nailgun.network.manager import NetworkManager
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import build_json_response
 from nailgun.api.handlers.node import NodeHandler
 from nailgun.api.handlers.tasks import TaskHandler
 from nailgun.task.helpers import TaskHelper
@@ -49,6 +49,7 @@ class ClusterHandler(JSONHandler):
         "status",
         ("release", "*")
     )
+    eager_fields = ("changes",)
     model = Cluster
     validator = ClusterValidator
 
@@ -131,9 +132,8 @@ class ClusterCollectionHandler(JSONHandler):
 
     @content_json
     def GET(self):
-        return map(
-            ClusterHandler.render,
-            db().query(Cluster).all()
+        return ClusterHandler.render_collection(
+            ClusterHandler.eager_load(db().query(Cluster)).all()
         )
 
     @content_json
@@ -175,9 +175,8 @@ class ClusterCollectionHandler(JSONHandler):
                     )
                     netmanager.assign_networks_to_main_interface(node.id)
 
-            raise web.webapi.created(json.dumps(
-                ClusterHandler.render(cluster),
-                indent=4
+            raise web.webapi.created(build_json_response(
+                ClusterHandler.render(cluster)
             ))
         except (
             errors.OutOfVLANs,
@@ -215,9 +214,11 @@ class ClusterChangesHandler(JSONHandler):
         if check_task.status == 'error':
             return TaskHandler.render(check_task)
 
+        # cProfile stats of deployment can be requested with ?cprofile=1
+        cprofile = web.input(cprofile=None).cprofile in ('1', 'true')
         try:
             task_manager = DeploymentTaskManager(cluster_id=cluster.id)
-            task = task_manager.execute()
+            task = task_manager.execute(cprofile=cprofile)
         except Exception as exc:
             logger.warn(u'ClusterChangesHandler: error while execution'
                         ' deploy task: {0}'.format(str(exc)))
@@ -14,7 +14,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import traceback
 from datetime import datetime
 
@@ -38,6 +37,8 @@ from nailgun.network.manager import NetworkManager
 from nailgun.volumes.manager import VolumeManager
 from nailgun.api.models import Node, NodeAttributes
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import build_json_response
+from nailgun.api.handlers.base import etag
 from nailgun.api.handlers.base import HandlerRegistrator
 
 
@@ -50,17 +51,34 @@ class NodeHandler(JSONHandler):
     validator = NodeValidator
 
     @classmethod
-    def render(cls, instance, fields=None):
+    def render(cls, instance, fields=None, network_data=None):
         json_data = None
         try:
             json_data = JSONHandler.render(instance, fields=cls.fields)
-            network_manager = NetworkManager()
-            json_data['network_data'] = network_manager.get_node_networks(
-                instance.id)
+            if network_data is None:
+                network_data = NetworkManager().get_node_networks(
+                    instance.id)
+            json_data['network_data'] = network_data
         except:
             logger.error(traceback.format_exc())
         return json_data
 
+    @classmethod
+    def render_collection(cls, instances):
+        instances = list(instances)
+        try:
+            networks = NetworkManager().get_nodes_networks(
+                [n.id for n in instances]
+            )
+        except errors.CanNotFindInterface:
+            # some node has no interface for its network,
+            # render nodes one by one to skip only broken ones
+            return map(cls.render, instances)
+        return [
+            cls.render(n, network_data=networks.get(n.id, []))
+            for n in instances
+        ]
+
     @content_json
     def GET(self, node_id):
         node = self.get_object_or_404(Node, node_id)
@@ -121,19 +139,20 @@ class NodeHandler(JSONHandler):
 class NodeCollectionHandler(JSONHandler):
 
     validator = NodeValidator
+    filters = ('status', 'role', 'online',
+               'pending_addition', 'pending_deletion')
 
+    @etag('nodes', 'clusters', 'ip_addrs', 'networks', 'network_groups',
+          'net_assignments', 'node_nic_interfaces')
     @content_json
     def GET(self):
         user_data = web.input(cluster_id=None)
+        query = db().query(Node).order_by(Node.id)
         if user_data.cluster_id == '':
-            nodes = db().query(Node).filter_by(
-                cluster_id=None).all()
+            query = query.filter_by(cluster_id=None)
         elif user_data.cluster_id:
-            nodes = db().query(Node).filter_by(
-                cluster_id=user_data.cluster_id).all()
-        else:
-            nodes = db().query(Node).all()
-        return map(NodeHandler.render, nodes)
+            query = query.filter_by(cluster_id=user_data.cluster_id)
+        return self.render_query(NodeHandler, query)
 
     @content_json
     def POST(self):
@@ -214,9 +233,8 @@ class NodeCollectionHandler(JSONHandler):
             (cores, ram, hd_size),
             node_id=node.id
         )
-        raise web.webapi.created(json.dumps(
-            NodeHandler.render(node),
-            indent=4
+        raise web.webapi.created(build_json_response(
+            NodeHandler.render(node)
         ))
 
     @content_json
@@ -621,4 +639,5 @@ class NodesAllocationStatsHandler(object):
         total_nodes = \
             db().query(Node).count()
         return {'total': total_nodes,
-                'unallocated': unallocated_nodes}
+                'unallocated': unallocated_nodes,
+                'admin_ips_left': NetworkManager().get_admin_ips_left()}
@@ -23,6 +23,7 @@ from nailgun.db import db
 from nailgun.api.models import Notification
 from nailgun.api.validators.notification import NotificationValidator
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import etag
 
 
 class NotificationHandler(JSONHandler):
@@ -72,23 +73,18 @@ class NotificationHandler(JSONHandler):
 class NotificationCollectionHandler(JSONHandler):
 
     validator = NotificationValidator
+    filters = ('status', 'topic')
 
+    @etag('notifications')
     @content_json
     def GET(self):
         user_data = web.input(cluster_id=None)
-        query = db().query(Notification)
+        query = db().query(Notification).order_by(Notification.id)
         if user_data.cluster_id:
             query = query.filter_by(cluster_id=user_data.cluster_id)
-        # Temporarly limit notifications number to prevent bloating UI by
-        # lots of old notifications. Normally, this should be done by querying
-        # separately unread notifications for notifier and use pagination for
-        # list of all notifications
-        query = query.limit(1000)
-        notifications = query.all()
-        return map(
-            NotificationHandler.render,
-            notifications
-        )
+        # Unless limit is requested, notifications number is limited
+        # to prevent bloating UI by lots of old notifications
+        return self.render_query(NotificationHandler, query, limit=1000)
 
     @content_json
     def PUT(self):
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import web
+
+from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.stats import counters, gauges
+
+
+class StatsHandler(JSONHandler):
+    """
+    Counters of this nailgun process since it was started,
+    e.g. nics_check_ins_changed and nics_check_ins_noop are
+    numbers of NIC check-ins of agents which changed interfaces
+    and which changed nothing, and current values of gauges,
+    e.g. rpc_consumer with queue depth and handler latency of
+    RPC consumer and api_responses with encoding time and sizes
+    of responses before and after gzip by endpoint.
+    ?prefix=<name> returns only counters and gauges which names
+    start with it.
+    """
+
+    @content_json
+    def GET(self):
+        prefix = web.input(prefix='').prefix
+        return {
+            "counters": dict(
+                (name, value)
+                for name, value in counters.snapshot().iteritems()
+                if name.startswith(prefix)
+            ),
+            "gauges": dict(
+                (name, value)
+                for name, value in gauges.collect().iteritems()
+                if name.startswith(prefix)
+            )
+        }
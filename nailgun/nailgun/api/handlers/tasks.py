@@ -21,6 +21,7 @@ import web
 from nailgun.db import db
 from nailgun.api.models import Task
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import etag
 
 
 class TaskHandler(JSONHandler):
@@ -36,6 +37,7 @@ class TaskHandler(JSONHandler):
     )
     model = Task
 
+    @etag('tasks')
     @content_json
     def GET(self, task_id):
         task = self.get_object_or_404(Task, task_id)
@@ -55,20 +57,27 @@ class TaskHandler(JSONHandler):
         )
 
 
+class TaskProfileHandler(JSONHandler):
+
+    @content_json
+    def GET(self, task_id):
+        task = self.get_object_or_404(Task, task_id)
+        if not task.profile:
+            raise web.notfound()
+        return task.profile
+
+
 class TaskCollectionHandler(JSONHandler):
 
+    filters = ('name', 'status')
+
+    @etag('tasks')
     @content_json
     def GET(self):
         user_data = web.input(cluster_id=None)
+        query = db().query(Task).order_by(Task.id)
         if user_data.cluster_id == '':
-            tasks = db().query(Task).filter_by(
-                cluster_id=None).all()
+            query = query.filter_by(cluster_id=None)
         elif user_data.cluster_id:
-            tasks = db().query(Task).filter_by(
-                cluster_id=user_data.cluster_id).all()
-        else:
-            tasks = db().query(Task).all()
-        return map(
-            TaskHandler.render,
-            tasks
-        )
+            query = query.filter_by(cluster_id=user_data.cluster_id)
+        return self.render_query(TaskHandler, query)
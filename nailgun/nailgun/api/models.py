@@ -29,13 +29,13 @@ from sqlalchemy import Column, UniqueConstraint, Table
 from sqlalchemy import Integer, String, Unicode, Text, Boolean, Float
 from sqlalchemy import ForeignKey, Enum, DateTime
 from sqlalchemy import create_engine
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, deferred
 from sqlalchemy.ext.declarative import declarative_base
 
 from nailgun.logger import logger
 from nailgun.db import db
 from nailgun.volumes.manager import VolumeManager
-from nailgun.api.fields import JSON
+from nailgun.api.fields import JSON, CompressedJSON
 from nailgun.settings import settings
 
 Base = declarative_base()
@@ -435,6 +435,7 @@ class NetworkConfiguration(object):
 
     @classmethod
     def __set_ip_ranges(cls, network_group_id, ip_ranges):
+        from nailgun.network.allocator import IPRangeIndex
         # deleting old ip ranges
         db().query(IPAddrRange).filter_by(
             network_group_id=network_group_id).delete()
@@ -446,6 +447,7 @@ class NetworkConfiguration(object):
                 network_group_id=network_group_id)
             db().add(new_ip_range)
         db().commit()
+        IPRangeIndex.invalidate(network_group_id)
 
 
 class AttributesGenerators(object):
@@ -575,7 +577,10 @@ class Task(Base):
         default='running'
     )
     progress = Column(Integer, default=0)
-    cache = Column(JSON, default={})
+    # orchestrator message of task, it's loaded only when accessed
+    cache = deferred(Column(CompressedJSON, default={}))
+    # timing of deployment phases, see nailgun.profiler
+    profile = deferred(Column(JSON))
     result = Column(JSON, default={})
     parent_id = Column(Integer, ForeignKey('tasks.id'))
     subtasks = relationship(
@@ -46,6 +46,7 @@ from nailgun.api.handlers.node import NodeNICsVerifyHandler
 
 from nailgun.api.handlers.tasks import TaskHandler
 from nailgun.api.handlers.tasks import TaskCollectionHandler
+from nailgun.api.handlers.tasks import TaskProfileHandler
 
 from nailgun.api.handlers.notifications import NotificationHandler
 from nailgun.api.handlers.notifications import NotificationCollectionHandler
@@ -57,6 +58,8 @@ from nailgun.api.handlers.logs import LogSourceByNodeCollectionHandler
 
 from nailgun.api.handlers.version import VersionHandler
 
+from nailgun.api.handlers.stats import StatsHandler
+
 from nailgun.api.handlers.plugin import PluginCollectionHandler
 from nailgun.api.handlers.plugin import PluginHandler
 
@@ -109,6 +112,8 @@ urls = (
     'TaskCollectionHandler',
     r'/tasks/(?P<task_id>\d+)/?$',
     'TaskHandler',
+    r'/tasks/(?P<task_id>\d+)/profile/?$',
+    'TaskProfileHandler',
     r'/notifications/?$',
     'NotificationCollectionHandler',
     r'/notifications/(?P<notification_id>\d+)/?$',
@@ -123,6 +128,8 @@ urls = (
     'LogSourceByNodeCollectionHandler',
     r'/version/?$',
     'VersionHandler',
+    r'/stats/?$',
+    'StatsHandler',
     r'/plugins/?$',
     'PluginCollectionHandler',
     r'/plugins/(?P<plugin_id>\d+)/?$',
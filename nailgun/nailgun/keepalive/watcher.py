@@ -25,6 +25,7 @@ from nailgun import notifier
 from nailgun.db import db
 from nailgun.settings import settings
 from nailgun.api.models import Node
+from nailgun.rpc.progress import deploy_progress
 from nailgun.logger import logger
 
 
@@ -73,6 +74,7 @@ class KeepAliveThread(threading.Thread):
         ).filter_by(
             online=True
         )
+        nodes_ids = []
         for node_db in to_update:
             notifier.notify(
                 "error",
@@ -80,5 +82,7 @@ class KeepAliveThread(threading.Thread):
                     node_db.human_readable_name),
                 node_id=node_db.id
             )
+            nodes_ids.append(node_db.id)
         to_update.update({"online": False})
         db().commit()
+        deploy_progress.nodes_changed(nodes_ids)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+from bisect import bisect_left, bisect_right
+
+from netaddr import IPAddress
+from sqlalchemy import cast, or_
+from sqlalchemy.dialects.postgresql import INET
+
+from nailgun.db import db
+from nailgun.errors import errors
+from nailgun.api.models import IPAddr, IPAddrRange
+
+
+def merge_ranges(ranges):
+    """
+    Normalizes IP ranges into sorted list of non-overlapping
+    integer (first, last) pairs. Adjacent ranges are merged too.
+
+    :param ranges: Iterable of (first, last) IP address pairs.
+    :type  ranges: iterable
+    :returns: List of (first, last) integer pairs.
+    """
+    int_ranges = sorted(
+        (int(IPAddress(first)), int(IPAddress(last)))
+        for first, last in ranges
+    )
+    merged = []
+    for first, last in int_ranges:
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def compact_ranges(ranges):
+    """
+    Converts IP ranges into merged list of ranges with
+    number of addresses in each of them.
+
+    :param ranges: Iterable of (first, last) IP address pairs.
+    :type  ranges: iterable
+    :returns: List of dicts with 'first', 'last' and 'count' keys.
+    """
+    return [
+        {
+            'first': str(IPAddress(first)),
+            'last': str(IPAddress(last)),
+            'count': last - first + 1
+        }
+        for first, last in merge_ranges(ranges)
+    ]
+
+
+def expand_ranges(ranges):
+    """
+    Lazily yields every IP address of given ranges exactly once
+    in ascending order.
+
+    :param ranges: Iterable of (first, last) IP address pairs or
+        dicts with 'first' and 'last' keys as returned by
+        compact_ranges.
+    :type  ranges: iterable
+    :returns: Generator of IP addresses as strings.
+    """
+    pairs = [
+        (r['first'], r['last']) if isinstance(r, dict) else r
+        for r in ranges
+    ]
+    for first, last in merge_ranges(pairs):
+        for ip in xrange(first, last + 1):
+            yield str(IPAddress(ip))
+
+
+class IPRangeIndex(object):
+    """
+    Membership index over IP ranges: merged integer (first, last)
+    pairs searched with bisect.
+
+    Indexes of network groups are cached for the whole process,
+    so code which changes IP ranges of network group has to call
+    IPRangeIndex.invalidate for it.
+    """
+
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, ranges):
+        """
+        :param ranges: Iterable of (first, last) IP address pairs.
+        """
+        self.ranges = merge_ranges(ranges)
+        self._firsts = [first for first, last in self.ranges]
+
+    def __contains__(self, ip_addr):
+        addr = int(IPAddress(ip_addr))
+        i = bisect_right(self._firsts, addr) - 1
+        return i >= 0 and addr <= self.ranges[i][1]
+
+    @classmethod
+    def for_network_group(cls, network_group_id):
+        """
+        Returns cached index of network group IP ranges.
+
+        :param network_group_id: NetworkGroup database ID.
+        :type  network_group_id: int
+        :returns: IPRangeIndex
+        """
+        index = cls._cache.get(network_group_id)
+        if index is None:
+            index = cls(
+                db().query(IPAddrRange.first, IPAddrRange.last).filter_by(
+                    network_group_id=network_group_id
+                )
+            )
+            with cls._lock:
+                cls._cache[network_group_id] = index
+        return index
+
+    @classmethod
+    def invalidate(cls, *network_groups_ids):
+        """
+        Drops cached indexes of given network groups
+        or all of them if no IDs are given.
+        """
+        with cls._lock:
+            if not network_groups_ids:
+                cls._cache.clear()
+            for network_group_id in network_groups_ids:
+                cls._cache.pop(network_group_id, None)
+
+
+class IPAllocator(object):
+    """
+    Allocator of free IP addresses inside given IP ranges.
+
+    Addresses which are already in use are fetched from database
+    with one query and kept as sorted integer array per range,
+    so allocating N addresses is a single walk over the gaps
+    between used addresses without any further queries.
+    Allocated addresses are remembered, so the same allocator
+    never returns an address twice.
+    """
+
+    def __init__(self, ranges, used=(), exclude=()):
+        """
+        :param ranges: Iterable of (first, last) IP address pairs.
+        :param used: Iterable of IP addresses which are already taken.
+        :param exclude: Iterable of IP addresses which shouldn't be
+            allocated (e.g. gateway).
+        """
+        self.ranges = merge_ranges(ranges)
+        taken = set(int(IPAddress(ip)) for ip in used)
+        taken.update(int(IPAddress(ip)) for ip in exclude)
+        taken = sorted(taken)
+        self._used = [
+            taken[bisect_left(taken, first):bisect_right(taken, last)]
+            for first, last in self.ranges
+        ]
+        self._allocated = 0
+        self._free = self._iter_free()
+
+    @classmethod
+    def for_network_group(cls, network_group):
+        """
+        Builds allocator over all IP ranges of network group.
+        Gateway of network group is never allocated.
+
+        :param network_group: NetworkGroup object.
+        :type  network_group: NetworkGroup
+        :returns: IPAllocator
+        """
+        ranges = [(r.first, r.last) for r in network_group.ip_ranges]
+        exclude = [network_group.gateway] if network_group.gateway else []
+        return cls(ranges, used=cls.fetch_used(ranges), exclude=exclude)
+
+    @classmethod
+    def fetch_used(cls, ranges):
+        """
+        Returns all IP addresses from database which belong
+        to given ranges. Only one query is issued.
+
+        :param ranges: Iterable of (first, last) IP address pairs.
+        :type  ranges: iterable
+        :returns: List of IP addresses as strings.
+        """
+        conditions = [
+            cast(IPAddr.ip_addr, INET).between(
+                str(IPAddress(first)),
+                str(IPAddress(last))
+            )
+            for first, last in merge_ranges(ranges)
+        ]
+        if not conditions:
+            return []
+        return [
+            ip for (ip,) in db().query(IPAddr.ip_addr).filter(
+                or_(*conditions)
+            )
+        ]
+
+    def _iter_free(self):
+        for (first, last), used in zip(self.ranges, self._used):
+            current = first
+            for ip in used:
+                for free in xrange(current, ip):
+                    yield free
+                current = ip + 1
+            for free in xrange(current, last + 1):
+                yield free
+
+    def free_count(self):
+        """
+        Returns number of IP addresses which still can be allocated.
+        """
+        total = sum(
+            last - first + 1 - len(used)
+            for (first, last), used in zip(self.ranges, self._used)
+        )
+        return total - self._allocated
+
+    def allocate(self, num=1):
+        """
+        Returns list of free IP addresses.
+
+        :param num: Number of IP addresses to allocate.
+        :type  num: int
+        :returns: List of IP addresses as strings.
+        :raises: errors.OutOfIPs
+        """
+        free_ips = []
+        if num <= 0:
+            return free_ips
+        for ip in self._free:
+            free_ips.append(str(IPAddress(ip)))
+            if len(free_ips) == num:
+                break
+        self._allocated += len(free_ips)
+        if len(free_ips) < num:
+            raise errors.OutOfIPs()
+        return free_ips
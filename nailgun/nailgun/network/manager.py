@@ -15,16 +15,21 @@
 #    under the License.
 
 import math
-from itertools import imap, ifilter, islice, chain, tee
+from itertools import islice, chain
 
-import web
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 from sqlalchemy.sql import not_
-from netaddr import IPSet, IPNetwork, IPRange, IPAddress
+from netaddr import IPNetwork
 
 from nailgun.db import db
 from nailgun.errors import errors
 from nailgun.logger import logger
 from nailgun.settings import settings
+from nailgun.stats import counters
+from nailgun import profiler
+from nailgun.network.allocator import IPAllocator, IPRangeIndex
+from nailgun.network.pools import pools_index
 from nailgun.api.models import NetworkAssignment
 from nailgun.api.models import Node, NodeNICInterface, IPAddr, Cluster, Vlan
 from nailgun.api.models import Network, NetworkGroup, IPAddrRange
@@ -47,6 +52,7 @@ class NetworkManager(object):
 
         db().add(ip_range)
         db().commit()
+        IPRangeIndex.invalidate(network_group.id)
 
     def get_admin_network_id(self, fail_if_not_found=True):
         '''
@@ -73,89 +79,70 @@ class NetworkManager(object):
         :type  cluster_id: int
         :returns: None
         :raises: errors.OutOfVLANs, errors.OutOfIPs,
-        errors.NoSuitableCIDR
+        errors.NoSuitableCIDR, errors.InvalidNetworkAccess
         '''
-        used_nets = [n.cidr for n in db().query(Network).all()]
-        used_vlans = [v.id for v in db().query(Vlan).all()]
-
         cluster_db = db().query(Cluster).get(cluster_id)
 
         networks_metadata = cluster_db.release.networks_metadata
 
-        def _free_vlans():
-            free_vlans = set(
-                range(
-                    int(settings.VLANS_RANGE_START),
-                    int(settings.VLANS_RANGE_END)
-                )
-            ) - set(used_vlans)
-            if not free_vlans or len(free_vlans) < len(networks_metadata):
-                raise errors.OutOfVLANs()
-            return sorted(list(free_vlans))
-
-        public_vlan = _free_vlans()[0]
-        used_vlans.append(public_vlan)
         for network in networks_metadata:
-            free_vlans = _free_vlans()
-            vlan_start = public_vlan if network['access'] == 'public' \
-                else free_vlans[0]
-
-            logger.debug("Found free vlan: %s", vlan_start)
-            pool = settings.NETWORK_POOLS[network['access']]
-            if not pool:
+            if not settings.NETWORK_POOLS.get(network['access']):
                 raise errors.InvalidNetworkAccess(
                     u"Invalid access '{0}' for network '{1}'".format(
                         network['access'],
                         network['name']
                     )
                 )
-            nets_free_set = IPSet(pool) -\
-                IPSet(settings.NET_EXCLUDE) -\
-                IPSet(
-                    IPRange(
-                        settings.ADMIN_NETWORK["first"],
-                        settings.ADMIN_NETWORK["last"]
-                    )
-                ) -\
-                IPSet(used_nets)
-            if not nets_free_set:
-                raise errors.OutOfIPs()
-
-            free_cidrs = sorted(list(nets_free_set._cidrs))
-            new_net = None
-            for fcidr in free_cidrs:
-                for n in fcidr.subnet(24, count=1):
-                    new_net = n
-                    break
-                if new_net:
-                    break
-            if not new_net:
-                raise errors.NoSuitableCIDR()
-
-            new_ip_range = IPAddrRange(
-                first=str(new_net[2]),
-                last=str(new_net[-2])
-            )
 
-            nw_group = NetworkGroup(
-                release=cluster_db.release.id,
-                name=network['name'],
-                access=network['access'],
-                cidr=str(new_net),
-                netmask=str(new_net.netmask),
-                gateway=str(new_net[1]),
-                cluster_id=cluster_id,
-                vlan_start=vlan_start,
-                amount=1
-            )
-            db().add(nw_group)
-            db().commit()
-            nw_group.ip_ranges.append(new_ip_range)
-            db().commit()
-            self.create_networks(nw_group)
+        # public networks share one VLAN, others get their own
+        reserved_vlans = pools_index.reserve_vlans(
+            1 + len(filter(
+                lambda n: n['access'] != 'public',
+                networks_metadata
+            ))
+        )
+        reserved_cidrs = []
+        public_vlan = reserved_vlans[0]
+        vlans = iter(reserved_vlans[1:])
+        try:
+            for network in networks_metadata:
+                vlan_start = public_vlan if network['access'] == 'public' \
+                    else next(vlans)
+                logger.debug("Found free vlan: %s", vlan_start)
+
+                new_net = pools_index.reserve_cidr(network['access'])
+                reserved_cidrs.append(new_net)
+                self._create_network_group(
+                    cluster_db, network, new_net, vlan_start
+                )
+        except Exception:
+            # cluster is deleted with its networks on failure,
+            # so everything reserved here is free again
+            pools_index.release(cidrs=reserved_cidrs, vlans=reserved_vlans)
+            raise
+
+    def _create_network_group(self, cluster_db, network, new_net, vlan_start):
+        new_ip_range = IPAddrRange(
+            first=str(new_net[2]),
+            last=str(new_net[-2])
+        )
 
-            used_vlans.append(vlan_start)
-            used_nets.append(str(new_net))
+        nw_group = NetworkGroup(
+            release=cluster_db.release.id,
+            name=network['name'],
+            access=network['access'],
+            cidr=str(new_net),
+            netmask=str(new_net.netmask),
+            gateway=str(new_net[1]),
+            cluster_id=cluster_db.id,
+            vlan_start=vlan_start,
+            amount=1
+        )
+        db().add(nw_group)
+        db().commit()
+        nw_group.ip_ranges.append(new_ip_range)
+        db().commit()
+        self.create_networks(nw_group)
 
     def create_networks(self, nw_group):
         '''
@@ -172,46 +159,62 @@ class NetworkManager(object):
                                      count=nw_group.amount))
         logger.debug("Base CIDR sliced on subnets: %s", subnets)
 
-        for net in nw_group.networks:
-            logger.debug("Deleting old network with id=%s, cidr=%s",
-                         net.id, net.cidr)
-            ips = db().query(IPAddr).filter(
-                IPAddr.network == net.id
+        with counters.timer('create_networks'):
+            old_nets = db().query(Network.id, Network.cidr).filter_by(
+                network_group_id=nw_group.id
             ).all()
-            map(db().delete, ips)
-            db().delete(net)
+            old_nets_ids = [net.id for net in old_nets]
+            if old_nets_ids:
+                logger.debug("Deleting old networks with ids=%s",
+                             old_nets_ids)
+                db().query(IPAddr).filter(
+                    IPAddr.network.in_(old_nets_ids)
+                ).delete(synchronize_session=False)
+                db().query(Network).filter(
+                    Network.id.in_(old_nets_ids)
+                ).delete(synchronize_session=False)
+            # Dmitry's hack for clearing VLANs without networks
+            released_vlans = self._delete_orphan_vlans()
+
+            vlans_ids = []
+            if nw_group.vlan_start is not None:
+                vlans_ids = range(
+                    nw_group.vlan_start,
+                    nw_group.vlan_start + nw_group.amount
+                )
+                existing_vlans = set(v for (v,) in db().query(Vlan.id).filter(
+                    Vlan.id.in_(vlans_ids)
+                ))
+                if existing_vlans:
+                    logger.warning("Intersection with existing vlan_ids: %s",
+                                   sorted(existing_vlans))
+                new_vlans = [
+                    {'id': v} for v in vlans_ids if v not in existing_vlans
+                ]
+                if new_vlans:
+                    db().execute(Vlan.__table__.insert(), new_vlans)
+
+            db().execute(Network.__table__.insert(), [
+                {
+                    'release': nw_group.release,
+                    'name': nw_group.name,
+                    'access': nw_group.access,
+                    'cidr': str(subnets[n]),
+                    'vlan_id': vlans_ids[n] if vlans_ids else None,
+                    'gateway': nw_group.gateway or None,
+                    'network_group_id': nw_group.id
+                } for n in xrange(nw_group.amount)
+            ])
             db().commit()
-        # Dmitry's hack for clearing VLANs without networks
-        self.clear_vlans()
-        db().commit()
-        nw_group.networks = []
 
-        for n in xrange(nw_group.amount):
-            vlan_id = None
-            if nw_group.vlan_start is not None:
-                vlan_db = db().query(Vlan).get(nw_group.vlan_start + n)
-                if vlan_db:
-                    logger.warning("Intersection with existing vlan_id: %s",
-                                   vlan_db.id)
-                else:
-                    vlan_db = Vlan(id=nw_group.vlan_start + n)
-                    db().add(vlan_db)
-                vlan_id = vlan_db.id
-                logger.debug("Created VLAN object, vlan_id=%s", vlan_id)
-            gateway = None
-            if nw_group.gateway:
-                gateway = nw_group.gateway
-            net_db = Network(
-                release=nw_group.release,
-                name=nw_group.name,
-                access=nw_group.access,
-                cidr=str(subnets[n]),
-                vlan_id=vlan_id,
-                gateway=gateway,
-                network_group_id=nw_group.id)
-            db().add(net_db)
-        db().commit()
+        new_cidrs = [str(net) for net in subnets[:nw_group.amount]]
+        pools_index.release(
+            cidrs=[n.cidr for n in old_nets if n.cidr not in new_cidrs],
+            vlans=[v for v in released_vlans if v not in vlans_ids]
+        )
+        pools_index.mark_used(cidrs=new_cidrs, vlans=vlans_ids)
 
+    @profiler.profiled('NetworkManager.assign_admin_ips')
     def assign_admin_ips(self, node_id, num=1):
         '''
         Method for assigning admin IP addresses to nodes.
@@ -222,33 +225,80 @@ class NetworkManager(object):
         :type  num: int
         :returns: None
         '''
-        admin_net_id = self.get_admin_network_id()
-        node_admin_ips = db().query(IPAddr).filter_by(
-            node=node_id,
-            network=admin_net_id
-        ).all()
+        self.bulk_assign_admin_ips({node_id: num})
+
+    @profiler.profiled('NetworkManager.bulk_assign_admin_ips')
+    def bulk_assign_admin_ips(self, nodes_nums):
+        '''
+        Idempotent assignment of admin IP addresses to a batch
+        of nodes. Free addresses for all nodes are reserved
+        with one scan of admin range and one commit.
+
+        :param nodes_nums: Number of IP addresses for every node id.
+        :type  nodes_nums: dict
+        :returns: Dict with list of admin IP addresses for every node id.
+        :raises: errors.AdminNetworkNotFound, errors.OutOfIPs
+        '''
+        admin_net = db().query(Network).filter_by(
+            name="fuelweb_admin"
+        ).first()
+        if not admin_net:
+            raise errors.AdminNetworkNotFound()
 
-        if not node_admin_ips or len(node_admin_ips) < num:
-            admin_net = db().query(Network).get(admin_net_id)
+        nodes_ips = dict((node_id, []) for node_id in nodes_nums)
+        if not nodes_ips:
+            return nodes_ips
+        for node_id, ip_addr in db().query(
+            IPAddr.node,
+            IPAddr.ip_addr
+        ).filter(
+            IPAddr.node.in_(nodes_ips.keys())
+        ).filter_by(
+            network=admin_net.id
+        ).order_by(IPAddr.id):
+            nodes_ips[node_id].append(ip_addr)
+
+        lacking = [
+            (node_id, num - len(nodes_ips[node_id]))
+            for node_id, num in sorted(nodes_nums.iteritems())
+            if len(nodes_ips[node_id]) < num
+        ]
+        if lacking:
             logger.debug(
-                u"Trying to assign admin ips: node=%s count=%s",
-                node_id,
-                num - len(node_admin_ips)
+                u"Trying to assign admin ips: %s",
+                ", ".join("node=%s count=%s" % l for l in lacking)
             )
-            free_ips = self.get_free_ips(
-                admin_net.network_group.id,
-                num=num - len(node_admin_ips)
-            )
-            logger.info(len(free_ips))
-            for ip in free_ips:
-                ip_db = IPAddr(
-                    node=node_id,
-                    ip_addr=ip,
-                    network=admin_net_id
-                )
-                db().add(ip_db)
+            allocator = self.get_ip_allocator(admin_net.network_group_id)
+            free_ips = iter(allocator.allocate(sum(c for n, c in lacking)))
+            new_ips = []
+            for node_id, count in lacking:
+                for ip in islice(free_ips, count):
+                    new_ips.append({
+                        'node': node_id,
+                        'ip_addr': ip,
+                        'network': admin_net.id
+                    })
+                    nodes_ips[node_id].append(ip)
+            db().execute(IPAddr.__table__.insert(), new_ips)
             db().commit()
 
+            free_count = allocator.free_count()
+            logger.info(u"Admin IP addresses left: %s", free_count)
+            counters.incr('admin_ips_leased', len(new_ips))
+        return nodes_ips
+
+    def get_admin_ips_left(self):
+        '''
+        Returns number of free IP addresses in admin network ranges.
+        '''
+        admin_net = db().query(Network).filter_by(
+            name="fuelweb_admin"
+        ).first()
+        if not admin_net:
+            return 0
+        return self.get_ip_allocator(admin_net.network_group_id).free_count()
+
+    @profiler.profiled('NetworkManager.assign_ips')
     def assign_ips(self, nodes_ids, network_name):
         """
         Idempotent assignment IP addresses to nodes.
@@ -266,11 +316,38 @@ class NetworkManager(object):
         :returns: None
         :raises: Exception, errors.AssignIPError
         """
+        self.bulk_assign_ips(nodes_ids, [network_name])
+
+    @profiler.profiled('NetworkManager.bulk_assign_ips')
+    def bulk_assign_ips(self, nodes_ids, network_names):
+        """
+        Idempotent assignment IP addresses from several
+        networks to several nodes at once.
+
+        Works the same way as assign_ips called for every
+        network name, but missing (node, network) pairs are
+        found with a few set-based queries, addresses for every
+        network are reserved in one pass over its free space
+        and all of them are stored in a single transaction.
+
+        :param node_ids: List of nodes IDs in database.
+        :type  node_ids: list
+        :param network_names: List of networks names
+        :type  network_names: list
+        :returns: None
+        :raises: Exception, errors.AssignIPError
+        """
+        if not nodes_ids:
+            return
 
-        cluster_id = db().query(Node).get(nodes_ids[0]).cluster_id
+        nodes_clusters = dict(
+            db().query(Node.id, Node.cluster_id).filter(
+                Node.id.in_(nodes_ids)
+            )
+        )
+        cluster_id = nodes_clusters.get(nodes_ids[0])
         for node_id in nodes_ids:
-            node = db().query(Node).get(node_id)
-            if node.cluster_id != cluster_id:
+            if nodes_clusters.get(node_id) != cluster_id:
                 raise Exception(
                     u"Node id='{0}' doesn't belong to cluster_id='{1}'".format(
                         node_id,
@@ -278,46 +355,70 @@ class NetworkManager(object):
                     )
                 )
 
-        network = db().query(Network).join(NetworkGroup).\
-            filter(NetworkGroup.cluster_id == cluster_id).\
-            filter_by(name=network_name).first()
-
-        if not network:
-            raise errors.AssignIPError(
-                u"Network '%s' for cluster_id=%s not found." %
-                (network_name, cluster_id)
-            )
-
-        for node_id in nodes_ids:
-            node_ips = imap(
-                lambda i: i.ip_addr,
-                self._get_ips_except_admin(
-                    node_id=node_id,
-                    network_id=network.id
+        networks = {}
+        for network in db().query(Network).join(NetworkGroup).\
+                filter(NetworkGroup.cluster_id == cluster_id).\
+                filter(Network.name.in_(network_names)).\
+                order_by(Network.id):
+            networks.setdefault(network.name, network)
+
+        for network_name in network_names:
+            if network_name not in networks:
+                raise errors.AssignIPError(
+                    u"Network '%s' for cluster_id=%s not found." %
+                    (network_name, cluster_id)
                 )
-            )
-            # check if any of node_ips in required ranges
-            for ip in node_ips:
-                if self.check_ip_belongs_to_net(ip, network):
+
+        assigned = {}
+        for node_id, network_id, ip_addr in db().query(
+            IPAddr.node,
+            IPAddr.network,
+            IPAddr.ip_addr
+        ).filter(
+            IPAddr.node.in_(nodes_ids)
+        ).filter(
+            IPAddr.network.in_([n.id for n in networks.itervalues()])
+        ):
+            assigned.setdefault((node_id, network_id), []).append(ip_addr)
+
+        for network_name in network_names:
+            network = networks[network_name]
+            # list keeps order of nodes, set is for lookups
+            nodes_without_ip = []
+            seen_nodes = set()
+            for node_id in nodes_ids:
+                # check if any of node ips in required ranges
+                if any(
+                    self.check_ip_belongs_to_net(ip, network)
+                    for ip in assigned.get((node_id, network.id), [])
+                ):
                     logger.info(
                         u"Node id='{0}' already has an IP address "
                         "inside '{1}' network.".format(
-                            node.id,
+                            node_id,
                             network.name
                         )
                     )
-                    continue
+                elif node_id not in seen_nodes:
+                    seen_nodes.add(node_id)
+                    nodes_without_ip.append(node_id)
 
-            # IP address has not been assigned, let's do it
-            free_ip = self.get_free_ips(network.network_group.id)[0]
-            ip_db = IPAddr(
-                network=network.id,
-                node=node_id,
-                ip_addr=free_ip
-            )
-            db().add(ip_db)
-            db().commit()
+            if not nodes_without_ip:
+                continue
+            # IP addresses have not been assigned, let's do it.
+            # New addresses are flushed before allocator for the
+            # next network looks for used ones, so they are never
+            # handed out twice even if networks ranges intersect.
+            free_ips = self.get_ip_allocator(
+                network.network_group_id
+            ).allocate(len(nodes_without_ip))
+            db().execute(IPAddr.__table__.insert(), [
+                {'network': network.id, 'node': node_id, 'ip_addr': free_ip}
+                for node_id, free_ip in zip(nodes_without_ip, free_ips)
+            ])
+        db().commit()
 
+    @profiler.profiled('NetworkManager.assign_vip')
     def assign_vip(self, cluster_id, network_name):
         """
         Idempotent assignment VirtualIP addresses to cluster.
@@ -378,11 +479,28 @@ class NetworkManager(object):
         """
         Removes from DB all Vlans without Networks assigned to them.
         """
-        map(
-            db().delete,
-            db().query(Vlan).filter_by(network=None)
-        )
+        vlans_ids = self._delete_orphan_vlans()
         db().commit()
+        pools_index.release(vlans=vlans_ids)
+
+    def _delete_orphan_vlans(self):
+        """
+        Deletes Vlans without Networks in current transaction.
+
+        :returns: List of deleted VLAN IDs.
+        """
+        vlans_ids = [v for (v,) in db().query(Vlan.id).filter(
+            not_(Vlan.id.in_(
+                db().query(Network.vlan_id).filter(
+                    Network.vlan_id != None
+                ).subquery()
+            ))
+        )]
+        if vlans_ids:
+            db().query(Vlan).filter(
+                Vlan.id.in_(vlans_ids)
+            ).delete(synchronize_session=False)
+        return vlans_ids
 
     @classmethod
     def _chunked_range(cls, iterable, chunksize=64):
@@ -411,45 +529,24 @@ class NetworkManager(object):
             yield chain([s.next()], s)
 
     def check_ip_belongs_to_net(self, ip_addr, network):
-        addr = IPAddress(ip_addr)
-        ipranges = imap(
-            lambda ir: IPRange(ir.first, ir.last),
-            network.network_group.ip_ranges
+        return ip_addr in IPRangeIndex.for_network_group(
+            network.network_group_id
         )
-        for r in ipranges:
-            if addr in r:
-                return True
-        return False
-
-    def _iter_free_ips(self, network_group):
-        """
-        Represents iterator over free IP addresses
-        in all ranges for given Network Group
-        """
-        for ip_addr in ifilter(
-            lambda ip: db().query(IPAddr).filter_by(
-                ip_addr=str(ip)
-            ).first() is None and not ip == network_group.gateway,
-            chain(*[
-                IPRange(ir.first, ir.last)
-                for ir in network_group.ip_ranges
-            ])
-        ):
-            yield ip_addr
+
+    def get_ip_allocator(self, network_group_id):
+        """
+        Returns IPAllocator for given Network Group. Used
+        addresses are fetched with single query, so allocator
+        can be used to reserve many addresses at once.
+        """
+        ng = db().query(NetworkGroup).get(network_group_id)
+        return IPAllocator.for_network_group(ng)
 
     def get_free_ips(self, network_group_id, num=1):
         """
         Returns list of free IP addresses for given Network Group
         """
-        ng = db().query(NetworkGroup).get(network_group_id)
-        free_ips = []
-        for ip in self._iter_free_ips(ng):
-            free_ips.append(str(ip))
-            if len(free_ips) == num:
-                break
-        if len(free_ips) < num:
-            raise errors.OutOfIPs()
-        return free_ips
+        return self.get_ip_allocator(network_group_id).allocate(num)
 
     def _get_free_ips_from_range(self, iterable, num=1):
         """
@@ -579,72 +676,145 @@ class NetworkManager(object):
         :type  node_id: int
         :returns: List of network info for node.
         """
-        node_db = db().query(Node).get(node_id)
-        cluster_db = node_db.cluster
-        if cluster_db is None:
-            # Node doesn't belong to any cluster, so it should not have nets
-            return []
-
-        ips = self._get_ips_except_admin(node_id=node_id)
-        network_data = []
-        network_ids = []
-        for i in ips:
-            net = db().query(Network).get(i.network)
-            interface = self._get_interface_by_network_name(
-                node_db.id,
-                net.name
-            )
+        return self.get_nodes_networks([node_id]).get(node_id, [])
 
-            # Get prefix from netmask instead of cidr
-            # for public network
-            if net.name == 'public':
-                network_group = db().query(NetworkGroup).get(
-                    net.network_group_id)
+    def get_nodes_networks(self, nodes_ids):
+        """
+        Method for receiving network data for a number of nodes.
+        Number of queries doesn't depend on number of nodes
+        and networks.
+
+        :param nodes_ids: List of nodes database IDs.
+        :type  nodes_ids: list
+        :returns: Dict with list of network info for every node id.
+        :raises: errors.CanNotFindInterface
+        """
+        nodes_ids = list(nodes_ids)
+        if not nodes_ids:
+            return {}
+        nodes = db().query(Node).filter(
+            Node.id.in_(nodes_ids)
+        ).options(joinedload('cluster')).all()
+        clusters_ids = set(n.cluster_id for n in nodes if n.cluster_id)
+
+        ips = db().query(IPAddr).filter(
+            IPAddr.node.in_(nodes_ids)
+        ).order_by(IPAddr.id)
+        admin_net = db().query(Network.id).filter_by(
+            name="fuelweb_admin"
+        ).first()
+        if admin_net:
+            ips = ips.filter(not_(IPAddr.network == admin_net.id))
+        ips = ips.all()
+
+        nets = {}
+        cluster_nets = dict((c, []) for c in clusters_ids)
+        nets_filters = [Network.id.in_(set(i.network for i in ips))] \
+            if ips else []
+        if clusters_ids:
+            nets_filters.append(NetworkGroup.cluster_id.in_(clusters_ids))
+        if nets_filters:
+            nets_query = db().query(Network, NetworkGroup).outerjoin(
+                (NetworkGroup, Network.network_group_id == NetworkGroup.id)
+            ).filter(or_(*nets_filters)).order_by(Network.id)
+            for net, network_group in nets_query:
+                nets[net.id] = self._network_info(net, network_group)
+                if network_group and network_group.cluster_id in cluster_nets:
+                    cluster_nets[network_group.cluster_id].append(net)
+
+        nics = {}
+        assignments = db().query(
+            NodeNICInterface.node_id,
+            NodeNICInterface.name,
+            NetworkGroup.name
+        ).join(
+            (NetworkAssignment,
+             NetworkAssignment.interface_id == NodeNICInterface.id),
+            (NetworkGroup, NetworkAssignment.network_id == NetworkGroup.id)
+        ).filter(
+            NodeNICInterface.node_id.in_(nodes_ids)
+        ).order_by(NodeNICInterface.id)
+        for node_id, nic_name, net_name in assignments:
+            nics.setdefault((node_id, net_name), nic_name)
+
+        def get_dev(node_id, net_name):
+            try:
+                return nics[(node_id, net_name)]
+            except KeyError:
+                raise errors.CanNotFindInterface()
+
+        node_ips = {}
+        for ip in ips:
+            node_ips.setdefault(ip.node, []).append(ip)
+
+        nodes_networks = {}
+        for node_db in nodes:
+            if node_db.cluster is None:
+                # Node doesn't belong to any cluster,
+                # so it should not have nets
+                nodes_networks[node_db.id] = []
+                continue
 
-                # Convert netmask to prefix
-                prefix = str(IPNetwork(
-                    '0.0.0.0/' + network_group.netmask).prefixlen)
-                netmask = network_group.netmask
-            else:
-                prefix = str(IPNetwork(net.cidr).prefixlen)
-                netmask = str(IPNetwork(net.cidr).netmask)
+            network_data = []
+            network_ids = set()
+            for ip in node_ips.get(node_db.id, []):
+                net = nets[ip.network]
+                data = net['info'].copy()
+                data['ip'] = ip.ip_addr + '/' + net['prefix']
+                data['dev'] = get_dev(node_db.id, data['name'])
+                network_data.append(data)
+                network_ids.add(ip.network)
+
+            # And now let's add networks w/o IP addresses
+            # For now, we pass information about all networks,
+            #    so these vlans will be created on every node
+            # However it will end up with errors if we precreate vlans
+            #   in VLAN mode in fixed network. We are skipping fixed nets
+            #   in Vlan mode.
+            for net in cluster_nets[node_db.cluster_id]:
+                if net.id in network_ids:
+                    continue
+                dev = get_dev(node_db.id, net.name)
+                if net.name == 'fixed' and \
+                        node_db.cluster.net_manager == 'VlanManager':
+                    continue
+                network_data.append({
+                    'name': net.name,
+                    'vlan': net.vlan_id,
+                    'dev': dev})
 
-            network_data.append({
-                'name': net.name,
-                'vlan': net.vlan_id,
-                'ip': i.ip_addr + '/' + prefix,
-                'netmask': netmask,
-                'brd': str(IPNetwork(net.cidr).broadcast),
-                'gateway': net.gateway,
-                'dev': interface.name})
-            network_ids.append(net.id)
-
-        # And now let's add networks w/o IP addresses
-        nets = db().query(Network).join(NetworkGroup).\
-            filter(NetworkGroup.cluster_id == cluster_db.id)
-        if network_ids:
-            nets = nets.filter(not_(Network.id.in_(network_ids)))
-
-        # For now, we pass information about all networks,
-        #    so these vlans will be created on every node we call this func for
-        # However it will end up with errors if we precreate vlans in VLAN mode
-        #   in fixed network. We are skipping fixed nets in Vlan mode.
-        for net in nets.order_by(Network.id).all():
-            interface = self._get_interface_by_network_name(
-                node_db.id,
-                net.name
-            )
+            network_data.append(self._get_admin_network(node_db))
+            nodes_networks[node_db.id] = network_data
 
-            if net.name == 'fixed' and cluster_db.net_manager == 'VlanManager':
-                continue
-            network_data.append({
+        return nodes_networks
+
+    @classmethod
+    def _network_info(cls, net, network_group):
+        """
+        Precomputes network attributes which are
+        the same for every node IP in this network.
+        """
+        cidr = IPNetwork(net.cidr)
+        # Get prefix from netmask instead of cidr
+        # for public network
+        if net.name == 'public':
+            # Convert netmask to prefix
+            prefix = str(IPNetwork(
+                '0.0.0.0/' + network_group.netmask).prefixlen)
+            netmask = network_group.netmask
+        else:
+            prefix = str(cidr.prefixlen)
+            netmask = str(cidr.netmask)
+        return {
+            'prefix': prefix,
+            'info': {
                 'name': net.name,
                 'vlan': net.vlan_id,
-                'dev': interface.name})
-
-        network_data.append(self._get_admin_network(node_db))
-
-        return network_data
+                'netmask': netmask,
+                'brd': str(cidr.broadcast),
+                'gateway': net.gateway
+            }
+        }
 
     def _update_attrs(self, node_data):
         node_db = db().query(Node).get(node_data['id'])
@@ -668,58 +838,87 @@ class NetworkManager(object):
         return node_db.id
 
     def update_interfaces_info(self, node_id):
+        """
+        Reconciles node NICs with interfaces from node meta.
+        NICs are loaded with one query and all changes
+        are written with one commit, nothing is written
+        if NICs are up to date.
+
+        :param node_id: Node database ID.
+        :type  node_id: int
+        :returns: True if NICs were changed.
+        """
         node = db().query(Node).get(node_id)
         if not "interfaces" in node.meta:
             raise Exception("No interfaces metadata specified for node")
 
-        for interface in node.meta["interfaces"]:
-            interface_db = db().query(NodeNICInterface).filter_by(
-                mac=interface['mac']).first()
+        interfaces = node.meta["interfaces"]
+        macs = [i['mac'] for i in interfaces]
+        interfaces_db = dict(
+            (i.mac, i) for i in db().query(NodeNICInterface).filter(
+                or_(
+                    NodeNICInterface.node_id == node.id,
+                    NodeNICInterface.mac.in_(macs)
+                )
+            ).order_by(NodeNICInterface.id)
+        )
+
+        changed = False
+        for interface in interfaces:
+            interface_db = interfaces_db.get(interface['mac'])
             if interface_db:
-                self.__update_existing_interface(interface_db.id, interface)
+                changed |= self.__set_interface_attributes(
+                    interface_db, interface)
             else:
                 self.__add_new_interface(node, interface)
+                changed = True
 
-        self.__delete_not_found_interfaces(node, node.meta["interfaces"])
+        changed |= self.__delete_not_found_interfaces(
+            node,
+            [i for i in interfaces_db.itervalues()
+             if i.node_id == node.id and i.mac not in macs]
+        )
+
+        if changed:
+            db().commit()
+            counters.incr('nics_check_ins_changed')
+        else:
+            counters.incr('nics_check_ins_noop')
+        return changed
 
     def __add_new_interface(self, node, interface_attrs):
         interface = NodeNICInterface()
         interface.node_id = node.id
         self.__set_interface_attributes(interface, interface_attrs)
         db().add(interface)
-        db().commit()
-        node.interfaces.append(interface)
-
-    def __update_existing_interface(self, interface_id, interface_attrs):
-        interface = db().query(NodeNICInterface).get(interface_id)
-        self.__set_interface_attributes(interface, interface_attrs)
-        db().commit()
 
     def __set_interface_attributes(self, interface, interface_attrs):
-        interface.name = interface_attrs["name"]
-        interface.mac = interface_attrs["mac"]
-
-        interface.current_speed = interface_attrs.get("current_speed")
-        interface.max_speed = interface_attrs.get("max_speed")
-
-    def __delete_not_found_interfaces(self, node, interfaces):
-        interfaces_mac_addresses = map(
-            lambda interface: interface['mac'], interfaces)
-
-        interfaces_to_delete = db().query(NodeNICInterface).filter(
-            NodeNICInterface.node_id == node.id).filter(
-                not_(NodeNICInterface.mac.in_(
-                    interfaces_mac_addresses))).all()
-
-        if interfaces_to_delete:
-            mac_addresses = ' '.join(
-                map(lambda i: i.mac, interfaces_to_delete))
-
-            node_name = node.name or node.mac
-            logger.info("Interfaces %s removed from node %s" % (
-                mac_addresses, node_name))
-
-            map(db().delete, interfaces_to_delete)
+        attrs = {
+            'name': interface_attrs["name"],
+            'mac': interface_attrs["mac"],
+            'current_speed': interface_attrs.get("current_speed"),
+            'max_speed': interface_attrs.get("max_speed")
+        }
+        changed = False
+        for key, value in attrs.iteritems():
+            if getattr(interface, key) != value:
+                setattr(interface, key, value)
+                changed = True
+        return changed
+
+    def __delete_not_found_interfaces(self, node, interfaces_to_delete):
+        if not interfaces_to_delete:
+            return False
+
+        mac_addresses = ' '.join(
+            map(lambda i: i.mac, interfaces_to_delete))
+
+        node_name = node.name or node.mac
+        logger.info("Interfaces %s removed from node %s" % (
+            mac_addresses, node_name))
+
+        map(db().delete, interfaces_to_delete)
+        return True
 
     def get_default_nic_networkgroups(self, node_id, nic_id):
         main_nic_id = self.get_main_nic(node_id)
@@ -766,6 +965,40 @@ class NetworkManager(object):
 
         raise errors.CanNotFindInterface()
 
+    def get_nodes_interfaces_by_network_name(self, nodes_ids, network_name):
+        """
+        Bulk version of _get_interface_by_network_name
+        which returns only interface names.
+
+        :param nodes_ids: List of nodes database IDs.
+        :type  nodes_ids: list
+        :param network_name: Name of network group.
+        :type  network_name: str
+        :returns: Dict with interface name for every node id.
+        :raises: errors.CanNotFindInterface
+        """
+        nodes_ids = list(nodes_ids)
+        if not nodes_ids:
+            return {}
+        interfaces = {}
+        query = db().query(
+            NodeNICInterface.node_id,
+            NodeNICInterface.name
+        ).join(
+            (NetworkAssignment,
+             NetworkAssignment.interface_id == NodeNICInterface.id),
+            (NetworkGroup, NetworkAssignment.network_id == NetworkGroup.id)
+        ).filter(
+            NodeNICInterface.node_id.in_(nodes_ids)
+        ).filter(
+            NetworkGroup.name == network_name
+        ).order_by(NodeNICInterface.id)
+        for node_id, nic_name in query:
+            interfaces.setdefault(node_id, nic_name)
+        if set(nodes_ids) - set(interfaces):
+            raise errors.CanNotFindInterface()
+        return interfaces
+
     def get_end_point_ip(self, cluster_id):
         cluster_db = db().query(Cluster).get(cluster_id)
         ip = None
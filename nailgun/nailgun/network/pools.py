@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+from bisect import insort
+
+from netaddr import IPSet, IPNetwork, IPRange
+from sqlalchemy import cast, or_
+from sqlalchemy.dialects.postgresql import INET
+
+from nailgun.db import db
+from nailgun.errors import errors
+from nailgun.logger import logger
+from nailgun.settings import settings
+from nailgun.api.models import Network, Vlan
+
+
+class NetworkPoolsIndex(object):
+    """
+    Process-wide index of free VLAN IDs and free CIDR blocks
+    of every access pool from settings.NETWORK_POOLS.
+
+    Index is loaded from database on first use and then updated
+    incrementally when networks are created or deleted, so
+    allocation of networks for a new cluster doesn't depend on
+    the total number of networks in installation. Database may
+    be changed behind the index, that's why every candidate is
+    checked against database in the allocating transaction and
+    index is reloaded once before reporting that pool is empty.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._free_vlans = None
+        self._free_nets = None
+
+    def reset(self):
+        """
+        Drops index, it will be loaded from database on next use.
+        """
+        with self._lock:
+            self._free_vlans = None
+            self._free_nets = None
+
+    @property
+    def loaded(self):
+        return self._free_vlans is not None
+
+    def _excluded_nets(self):
+        return IPSet(settings.NET_EXCLUDE) | IPSet(
+            IPRange(
+                settings.ADMIN_NETWORK["first"],
+                settings.ADMIN_NETWORK["last"]
+            )
+        )
+
+    def _load(self):
+        logger.debug("Loading free VLANs and CIDRs index")
+        used_vlans = set(v for (v,) in db().query(Vlan.id))
+        self._free_vlans = [
+            v for v in xrange(
+                int(settings.VLANS_RANGE_START),
+                int(settings.VLANS_RANGE_END)
+            ) if v not in used_vlans
+        ]
+        excluded = self._excluded_nets() | IPSet(
+            [cidr for (cidr,) in db().query(Network.cidr)]
+        )
+        self._free_nets = dict(
+            (access, IPSet(pool) - excluded)
+            for access, pool in settings.NETWORK_POOLS.iteritems()
+            if pool
+        )
+
+    def _with_reload(self, func, *args):
+        with self._lock:
+            if not self.loaded:
+                self._load()
+                return func(*args)
+            try:
+                return func(*args)
+            except (errors.OutOfVLANs, errors.OutOfIPs,
+                    errors.NoSuitableCIDR):
+                # index might be stale, let's give it another chance
+                self._load()
+                return func(*args)
+
+    def reserve_vlans(self, count):
+        """
+        Reserves a number of the lowest free VLAN IDs.
+
+        :param count: Number of VLAN IDs.
+        :type  count: int
+        :returns: Sorted list of VLAN IDs.
+        :raises: errors.OutOfVLANs
+        """
+        return self._with_reload(self._reserve_vlans, count)
+
+    def _reserve_vlans(self, count):
+        while len(self._free_vlans) >= count:
+            candidates = self._free_vlans[:count]
+            used = set(v for (v,) in db().query(Vlan.id).filter(
+                Vlan.id.in_(candidates)
+            ))
+            if not used:
+                del self._free_vlans[:count]
+                return candidates
+            self._free_vlans = [
+                v for v in self._free_vlans if v not in used
+            ]
+        raise errors.OutOfVLANs()
+
+    def reserve_cidr(self, access, prefixlen=24):
+        """
+        Reserves the lowest free CIDR block of given size
+        from access pool.
+
+        :param access: Access pool name from settings.NETWORK_POOLS.
+        :type  access: str
+        :param prefixlen: Prefix length of CIDR block.
+        :type  prefixlen: int
+        :returns: IPNetwork
+        :raises: errors.InvalidNetworkAccess, errors.OutOfIPs,
+        errors.NoSuitableCIDR
+        """
+        if not settings.NETWORK_POOLS.get(access):
+            raise errors.InvalidNetworkAccess(
+                u"Invalid access '{0}'".format(access)
+            )
+        return self._with_reload(self._reserve_cidr, access, prefixlen)
+
+    def _reserve_cidr(self, access, prefixlen):
+        free_nets = self._free_nets[access]
+        while True:
+            if not free_nets:
+                raise errors.OutOfIPs()
+            new_net = None
+            for free_cidr in sorted(free_nets.iter_cidrs()):
+                if free_cidr.prefixlen <= prefixlen:
+                    new_net = IPNetwork(
+                        "{0}/{1}".format(free_cidr.network, prefixlen)
+                    )
+                    break
+            if not new_net:
+                raise errors.NoSuitableCIDR()
+
+            inet = cast(Network.cidr, INET)
+            used = [cidr for (cidr,) in db().query(Network.cidr).filter(
+                or_(
+                    inet.op("<<=")(str(new_net)),
+                    inet.op(">>=")(str(new_net))
+                )
+            )]
+            if not used:
+                self._remove_nets([new_net])
+                return new_net
+            logger.debug("CIDRs %s are already used", used)
+            self._remove_nets(used)
+
+    def _remove_nets(self, cidrs):
+        for free_nets in self._free_nets.itervalues():
+            for cidr in cidrs:
+                free_nets.remove(cidr)
+
+    def mark_used(self, cidrs=(), vlans=()):
+        """
+        Removes CIDRs and VLAN IDs which were taken
+        by networks from index.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            self._remove_nets(cidrs)
+            vlans = set(vlans)
+            self._free_vlans = [
+                v for v in self._free_vlans if v not in vlans
+            ]
+
+    def release(self, cidrs=(), vlans=()):
+        """
+        Returns CIDRs and VLAN IDs of deleted networks to index.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            if cidrs:
+                released = IPSet(cidrs) - self._excluded_nets()
+                for access, free_nets in self._free_nets.iteritems():
+                    pool = IPSet(settings.NETWORK_POOLS[access])
+                    for cidr in (released & pool).iter_cidrs():
+                        free_nets.add(cidr)
+            for vlan in vlans:
+                if vlan is None or vlan in self._free_vlans:
+                    continue
+                if int(settings.VLANS_RANGE_START) <= vlan < \
+                        int(settings.VLANS_RANGE_END):
+                    insort(self._free_vlans, vlan)
+
+
+pools_index = NetworkPoolsIndex()
@@ -25,31 +25,77 @@ from nailgun.api.models import Notification, Task
 
 def notify(topic, message,
            cluster_id=None, node_id=None, task_uuid=None):
-    if topic == 'discover' and node_id is None:
-        raise Exception("No node id in discover notification")
-    task = None
-    if task_uuid:
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
-
-    exist = None
-    if node_id and task:
-        exist = db().query(Notification).filter_by(
-            node_id=node_id,
-            message=message,
-            task=task
-        ).first()
-
-    if not exist:
-        notification = Notification()
-        notification.topic = topic
-        notification.message = message
-        notification.cluster_id = cluster_id
-        notification.node_id = node_id
-        if task:
-            notification.task_id = task.id
-        notification.datetime = datetime.now()
-        db().add(notification)
+    notify_batch([{
+        'topic': topic,
+        'message': message,
+        'cluster_id': cluster_id,
+        'node_id': node_id,
+        'task_uuid': task_uuid
+    }])
+
+
+def notify_batch(notifications):
+    """
+    Creates several notifications with one statement and one
+    commit. Notification about node of task isn't created if
+    the same one already exists.
+
+    :param notifications: List of dicts with notify() arguments.
+    """
+    for n in notifications:
+        if n['topic'] == 'discover' and n.get('node_id') is None:
+            raise Exception("No node id in discover notification")
+
+    tasks = {}
+    tasks_uuids = set(
+        n['task_uuid'] for n in notifications if n.get('task_uuid')
+    )
+    if tasks_uuids:
+        tasks = dict(db().query(Task.uuid, Task.id).filter(
+            Task.uuid.in_(tasks_uuids)
+        ))
+
+    exist = set()
+    nodes_ids = set(
+        n['node_id'] for n in notifications
+        if n.get('node_id') and tasks.get(n.get('task_uuid'))
+    )
+    if nodes_ids:
+        exist = set(
+            tuple(row) for row in db().query(
+                Notification.node_id,
+                Notification.message,
+                Notification.task_id
+            ).filter(
+                Notification.node_id.in_(nodes_ids),
+                Notification.task_id.in_(tasks.values())
+            )
+        )
+
+    rows = []
+    now = datetime.now()
+    for n in notifications:
+        task_id = tasks.get(n.get('task_uuid'))
+        if n.get('node_id') and task_id:
+            key = (n['node_id'], n['message'], task_id)
+            if key in exist:
+                continue
+            exist.add(key)
+        rows.append({
+            'topic': n['topic'],
+            'message': n['message'],
+            'cluster_id': n.get('cluster_id'),
+            'node_id': n.get('node_id'),
+            'task_id': task_id,
+            'datetime': now
+        })
+
+    if rows:
+        db().execute(Notification.__table__.insert(), rows)
         db().commit()
+    for row in rows:
         logger.info(
-            "Notification: topic: %s message: %s" % (topic, message)
+            "Notification: topic: %s message: %s" % (
+                row['topic'], row['message']
+            )
         )
@@ -22,6 +22,7 @@ from Queue import Queue
 
 from nailgun.api.models import Task
 from nailgun.task.helpers import TaskHelper
+from nailgun.task.state import task_state
 from nailgun.logger import logger
 from nailgun.db import db
 
@@ -77,3 +78,4 @@ class PluginThread(threading.Thread):
             'progress': 100,
             'message': str(msg)})
         db().commit()
+        task_state.forget(task_uuid)
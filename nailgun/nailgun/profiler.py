@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Per-thread profiling of named phases.
+
+Profile is started for current thread with start() and phases are
+marked with phase() context manager or profiled() decorator. Every
+phase gets number of calls, wall time, SQL statements and bytes
+of serialized messages, including nested phases. Outside of started
+profile phases cost almost nothing.
+
+    profiler.start(cprofile=False)
+    with profiler.phase('DeploymentTaskManager.execute'):
+        ...
+    report = profiler.stop()
+"""
+
+import time
+import pstats
+import cProfile
+import threading
+from functools import wraps
+from StringIO import StringIO
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from nailgun.db import engine
+
+
+# number of functions in cProfile report
+CPROFILE_LINES = 40
+
+_local = threading.local()
+
+
+class Profile(object):
+
+    def __init__(self, cprofile=False):
+        self.started = time.time()
+        self.queries = 0
+        self.bytes = 0
+        self.phases = OrderedDict()
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+    def add(self, name, seconds, queries, bytes):
+        phase = self.phases.setdefault(name, {
+            'name': name,
+            'calls': 0,
+            'seconds': 0.0,
+            'queries': 0,
+            'bytes': 0
+        })
+        phase['calls'] += 1
+        phase['seconds'] += seconds
+        phase['queries'] += queries
+        phase['bytes'] += bytes
+
+    def report(self):
+        report = {
+            'seconds': time.time() - self.started,
+            'queries': self.queries,
+            'bytes': self.bytes,
+            'phases': self.phases.values()
+        }
+        if self.cprofile:
+            stream = StringIO()
+            stats = pstats.Stats(self.cprofile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(CPROFILE_LINES)
+            report['cprofile'] = stream.getvalue()
+        return report
+
+
+def current():
+    """
+    Returns profile of current thread or None.
+    """
+    return getattr(_local, 'profile', None)
+
+
+def start(cprofile=False):
+    """
+    Starts profile of current thread.
+
+    :param cprofile: Also capture cProfile stats of current thread.
+    """
+    profile = Profile(cprofile)
+    _local.profile = profile
+    if profile.cprofile:
+        profile.cprofile.enable()
+    return profile
+
+
+def stop():
+    """
+    Stops profile of current thread.
+
+    :returns: Report dict or None if profile isn't started.
+    """
+    profile = current()
+    if profile is None:
+        return None
+    if profile.cprofile:
+        profile.cprofile.disable()
+    _local.profile = None
+    return profile.report()
+
+
+@contextmanager
+def phase(name):
+    profile = current()
+    if profile is None:
+        yield
+        return
+    started, queries, bytes = time.time(), profile.queries, profile.bytes
+    try:
+        yield
+    finally:
+        profile.add(
+            name,
+            time.time() - started,
+            profile.queries - queries,
+            profile.bytes - bytes
+        )
+
+
+def profiled(name):
+    """
+    Decorator which marks every call of function as phase.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_bytes(count):
+    """
+    Counts bytes of serialized message in current profile.
+    """
+    profile = current()
+    if profile is not None:
+        profile.bytes += count
+
+
+def _count_statement(*args, **kwargs):
+    profile = current()
+    if profile is not None:
+        profile.queries += 1
+
+
+event.listen(engine, "before_cursor_execute", _count_statement)
@@ -14,9 +14,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from kombu import Connection, Exchange, Queue
+import types
 
+from kombu import Exchange, Queue
+
+from nailgun import profiler
 from nailgun.settings import settings
+from nailgun.rpc.producer import Publisher
 
 creds = (
     ("userid", "guest"),
@@ -54,9 +58,25 @@ nailgun_queue = Queue(
 )
 
 
+publisher = Publisher(conn_str)
+
+
 def cast(name, message):
-    with Connection(conn_str) as conn:
-        with conn.Producer(serializer='json') as producer:
-            producer.publish(message,
-                             exchange=naily_exchange, routing_key=name,
-                             declare=[naily_queue])
+    """
+    Sends message to orchestrator. If message is a generator,
+    every generated message is sent separately as soon as it
+    is generated.
+    """
+    messages = message if isinstance(message, types.GeneratorType) \
+        else [message]
+    cast_batch(name, messages)
+
+
+def cast_batch(name, messages):
+    """
+    Sends every message of iterable to orchestrator separately,
+    all of them are sent over one channel.
+    """
+    with profiler.phase('rpc.cast'):
+        publisher.publish(messages, naily_exchange, name,
+                          declare=[naily_queue])
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Chunked protocol for orchestrator messages with a lot of nodes.
+
+Instead of one message with all nodes, orchestrator receives
+a header message, which is the original message with empty
+'nodes' list and 'chunks' description in args, and then
+'<method>_chunk' messages with batches of nodes:
+
+    {'method': 'deploy', 'respond_to': 'deploy_resp',
+     'args': {'task_uuid': ..., 'attributes': ..., 'nodes': [],
+              'chunks': {'count': 2, 'size': 100, 'nodes': 150}}}
+    {'method': 'deploy_chunk',
+     'args': {'task_uuid': ..., 'chunk': 0, 'nodes': [...100 nodes...]}}
+    {'method': 'deploy_chunk',
+     'args': {'task_uuid': ..., 'chunk': 1, 'nodes': [...50 nodes...]}}
+
+Task is started only when all chunks announced in the header are
+received. If nailgun fails to build a chunk, it sets the task to
+error and doesn't send the rest, so the task is never started.
+"""
+
+import copy
+
+
+def _chunks_info(nodes_ids, chunk_size):
+    return {
+        'count': (len(nodes_ids) + chunk_size - 1) // chunk_size,
+        'size': chunk_size,
+        'nodes': len(nodes_ids)
+    }
+
+
+def split_message(message, nodes_ids, format_nodes, chunk_size):
+    """
+    Lazily generates header and chunk messages. Nodes of every
+    chunk are formatted only when the chunk is requested, so
+    only one chunk is kept in memory at once.
+
+    :param message: Message without nodes.
+    :type  message: dict
+    :param nodes_ids: Nodes database IDs.
+    :type  nodes_ids: list
+    :param format_nodes: Callable which returns message data
+        for list of nodes IDs.
+    :param chunk_size: Number of nodes in one chunk.
+    :type  chunk_size: int
+    :returns: Generator of messages.
+    """
+    header = copy.deepcopy(message)
+    header['args']['nodes'] = []
+    header['args']['chunks'] = _chunks_info(nodes_ids, chunk_size)
+    yield header
+
+    for n, start in enumerate(xrange(0, len(nodes_ids), chunk_size)):
+        yield {
+            'method': '{0}_chunk'.format(message['method']),
+            'args': {
+                'task_uuid': message['args']['task_uuid'],
+                'chunk': n,
+                'nodes': format_nodes(nodes_ids[start:start + chunk_size])
+            }
+        }
+
+
+def make_manifest(message, nodes_ids, chunk_size):
+    """
+    Returns compact description of chunked message to be
+    stored in task cache instead of the whole message.
+    Nodes are represented by their uids only.
+    """
+    manifest = copy.deepcopy(message)
+    manifest['args']['nodes'] = [{'uid': node_id} for node_id in nodes_ids]
+    manifest['args']['chunks'] = _chunks_info(nodes_ids, chunk_size)
+    return manifest
+
+
+def join_chunks(messages):
+    """
+    Assembles chunked messages back to ordinary messages,
+    messages which aren't chunked are returned as is. Message
+    which didn't get all nodes announced in its header is
+    incomplete and is dropped.
+
+    :param messages: Iterable of messages.
+    :returns: List of messages.
+    """
+    result = []
+    headers = {}
+    expected = {}
+    for message in messages:
+        args = message['args']
+        if message['method'].endswith('_chunk') and \
+                args.get('task_uuid') in headers:
+            headers[args['task_uuid']]['args']['nodes'].extend(args['nodes'])
+        elif 'chunks' in args:
+            message = copy.deepcopy(message)
+            expected[args['task_uuid']] = \
+                message['args'].pop('chunks')['nodes']
+            headers[args['task_uuid']] = message
+            result.append(message)
+        else:
+            result.append(message)
+    return [
+        message for message in result
+        if len(message['args'].get('nodes', ())) >= expected.get(
+            message['args'].get('task_uuid'), 0
+        )
+    ]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+from collections import OrderedDict
+
+from nailgun.logger import logger
+from nailgun.settings import settings
+from nailgun.stats import counters
+
+
+class ProgressCoalescer(object):
+    """
+    Stage in front of receiver which merges consecutive
+    progress-only deploy_resp messages.
+
+    Message is progress-only if it doesn't change status of task
+    and doesn't change anything but progress of its nodes. Such
+    messages are kept for settings.RPC_COALESCE_WINDOW seconds,
+    only the last progress of every node and task is left and
+    then they are applied as one deploy_progress_resp call.
+    Any other message flushes everything kept before it is
+    dispatched, so status transitions are applied immediately
+    and in order.
+
+    Coalesced messages are lost if process is stopped before
+    they are flushed, which is fine for progress: it's sent
+    over and over again by orchestrator.
+    """
+
+    # node fields which can't be changed by progress-only message
+    state_fields = ('status', 'online', 'error_type', 'error_msg')
+
+    def __init__(self, dispatch, window=None):
+        """
+        :param dispatch: Callable which takes receiver method
+            name and its keyword arguments.
+        :param window: Seconds to keep progress-only messages,
+            settings.RPC_COALESCE_WINDOW by default, 0 - disabled.
+        """
+        self.dispatch = dispatch
+        if window is None:
+            window = settings.RPC_COALESCE_WINDOW
+        self.window = float(window or 0)
+        self._pending = OrderedDict()
+        self._pending_since = None
+        # last known state of nodes for every task
+        self._nodes_state = {}
+
+    def handle(self, method, args):
+        if self.window and self._is_progress_only(method, args):
+            self._add(args)
+            self.flush_expired()
+            return
+        self.flush()
+        self._remember(method, args)
+        self.dispatch(method, args)
+
+    def flush_expired(self):
+        """
+        Flushes kept messages if they are kept longer than window.
+        Should be called periodically by consumer.
+        """
+        if self._pending and \
+                time.time() - self._pending_since >= self.window:
+            self.flush()
+
+    def flush(self):
+        pending = self._pending
+        self._pending = OrderedDict()
+        self._pending_since = None
+        for task_uuid, update in pending.iteritems():
+            logger.debug(
+                u"Applying %s coalesced progress messages of task %s",
+                update['messages'], task_uuid
+            )
+            counters.incr('deploy_resp_coalesced', update['messages'] - 1)
+            self.dispatch('deploy_progress_resp', {
+                'task_uuid': task_uuid,
+                'status': update['status'],
+                'progress': update['progress'],
+                'nodes': [
+                    {'uid': uid, 'progress': progress}
+                    for uid, progress in update['nodes'].iteritems()
+                ]
+            })
+
+    def _is_progress_only(self, method, args):
+        if method != 'deploy_resp' or args.get('error') or \
+                args.get('status') not in (None, 'running'):
+            return False
+        nodes_state = self._nodes_state.get(args.get('task_uuid'), {})
+        for node in args.get('nodes') or []:
+            state = nodes_state.get(str(node.get('uid')))
+            if state is None or node.get('online') is False or \
+                    node.get('status') == 'error':
+                return False
+            for field in self.state_fields:
+                if field in node and node[field] != state.get(field):
+                    return False
+        return True
+
+    def _add(self, args):
+        task_uuid = args['task_uuid']
+        if task_uuid not in self._pending:
+            self._pending[task_uuid] = {
+                'messages': 0,
+                'nodes': OrderedDict()
+            }
+        update = self._pending[task_uuid]
+        update['messages'] += 1
+        update['status'] = args.get('status')
+        update['progress'] = args.get('progress')
+        for node in args.get('nodes') or []:
+            if 'progress' in node:
+                update['nodes'][node['uid']] = node['progress']
+        if self._pending_since is None:
+            self._pending_since = time.time()
+
+    def _remember(self, method, args):
+        if method != 'deploy_resp':
+            return
+        task_uuid = args.get('task_uuid')
+        if args.get('status') in ('ready', 'error'):
+            self._nodes_state.pop(task_uuid, None)
+            return
+        nodes_state = self._nodes_state.setdefault(task_uuid, {})
+        for node in args.get('nodes') or []:
+            state = nodes_state.setdefault(str(node.get('uid')), {})
+            for field in self.state_fields:
+                if field in node:
+                    state[field] = node[field]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import threading
+
+from kombu import Connection
+from kombu.pools import ProducerPool
+
+from nailgun import profiler
+from nailgun.logger import logger
+from nailgun.settings import settings
+
+
+class Publisher(object):
+    """
+    Process-wide pool of AMQP connections and producers.
+
+    Connections are opened on first use and kept open, so
+    messages don't pay for AMQP handshake every time. Every
+    pooled connection remembers entities it has declared,
+    so queue and exchange are declared only once per connection.
+    Producers reconnect and republish on connection errors
+    according to retry policy, and with publisher confirms
+    publish returns only when broker has accepted the message.
+    """
+
+    def __init__(self, url, limit=None, confirm=None, max_retries=None):
+        """
+        :param url: Broker URL.
+        :param limit: Maximum number of connections,
+            settings.RPC_PRODUCER_POOL_LIMIT by default.
+        :param confirm: Wait for publisher confirms,
+            settings.RPC_PRODUCER_CONFIRM by default.
+        :param max_retries: Number of reconnection attempts,
+            settings.RPC_PRODUCER_MAX_RETRIES by default.
+        """
+        self.url = url
+        if limit is None:
+            limit = settings.RPC_PRODUCER_POOL_LIMIT
+        if confirm is None:
+            confirm = settings.RPC_PRODUCER_CONFIRM
+        if max_retries is None:
+            max_retries = settings.RPC_PRODUCER_MAX_RETRIES
+        self.limit = int(limit or 1)
+        self.confirm = bool(confirm)
+        self.retry_policy = {
+            'max_retries': max_retries,
+            'interval_start': 0,
+            'interval_step': 1,
+            'interval_max': 5
+        }
+        self._lock = threading.Lock()
+        self._connection = None
+        self._producers = None
+
+    @property
+    def producers(self):
+        with self._lock:
+            if self._producers is None:
+                self._connection = Connection(
+                    self.url,
+                    transport_options={'confirm_publish': self.confirm}
+                )
+                self._producers = ProducerPool(
+                    self._connection.Pool(limit=self.limit),
+                    limit=self.limit
+                )
+            return self._producers
+
+    def publish(self, messages, exchange, routing_key, declare=None):
+        """
+        Sends messages one after another over one channel.
+
+        :param messages: Iterable of messages, they are sent
+            as soon as they are generated.
+        :param exchange: Exchange to publish to.
+        :param routing_key: Routing key of messages.
+        :param declare: Entities to declare before publishing.
+        :returns: Number of sent messages.
+        """
+        sent = 0
+        with self.producers.acquire(block=True) as producer:
+            for message in messages:
+                # message is serialized here to count its size
+                body = json.dumps(message)
+                profiler.add_bytes(len(body))
+                producer.publish(
+                    body,
+                    content_type='application/json',
+                    content_encoding='utf-8',
+                    exchange=exchange,
+                    routing_key=routing_key,
+                    declare=declare or [],
+                    retry=True,
+                    retry_policy=self.retry_policy
+                )
+                sent += 1
+        return sent
+
+    def close(self):
+        """
+        Closes all pooled connections, they are opened
+        again on next publish.
+        """
+        with self._lock:
+            if self._producers is not None:
+                logger.debug("Closing AMQP producers of %s", self.url)
+                self._producers.force_close_all()
+                self._producers.connections.force_close_all()
+                self._connection.release()
+            self._producers = None
+            self._connection = None
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from sqlalchemy import event
+
+from nailgun.db import db
+from nailgun.logger import logger
+from nailgun.settings import settings
+from nailgun.api.models import Node
+
+
+class DeployProgressAccumulator(object):
+    """
+    Process-wide accumulator of deployment progress of tasks.
+
+    Every node of task cluster contributes base + weight * progress
+    to the task progress, where base and weight depend on node
+    status. Contributions and their running sum are kept for every
+    task, so progress message costs O(reported nodes) instead of
+    evaluating all nodes of cluster. Contributions of all nodes are
+    calculated from database when task is seen for the first time
+    or when message reports a node which isn't known yet. Nodes
+    which are changed in other ways (go offline, leave cluster or
+    are deleted) are marked as stale and only they are reloaded
+    on next update.
+
+    Contributions are kept as integer millionths of percent,
+    so running sum doesn't drift after a lot of updates.
+    """
+
+    scale = 1000000
+
+    def __init__(self):
+        # nodes can be marked as stale by flush inside of update
+        self._lock = threading.RLock()
+        self._tasks = {}
+
+    def reset(self):
+        with self._lock:
+            self._tasks.clear()
+
+    def forget(self, task_uuid):
+        with self._lock:
+            self._tasks.pop(task_uuid, None)
+
+    def nodes_changed(self, nodes_ids, clusters_ids=()):
+        """
+        Marks nodes as stale in tasks of their clusters, so they
+        are reloaded from database on next update of these tasks.
+
+        :param nodes_ids: IDs of changed nodes.
+        :param clusters_ids: IDs of clusters which nodes
+            are added to, if any.
+        """
+        with self._lock:
+            for state in self._tasks.itervalues():
+                for node_id in nodes_ids:
+                    if node_id in state['nodes'] or \
+                            state['cluster_id'] in clusters_ids:
+                        state['stale'].add(node_id)
+
+    @classmethod
+    def node_weights(cls, node):
+        """
+        Returns (base, weight) tuple of node contribution or None
+        if node shouldn't be taken into account.
+        """
+        coeff = settings.PROVISIONING_PROGRESS_COEFF or 0.3
+        if node.status == "discover":
+            return (0.0, 0.0)
+        elif not node.online:
+            return (100.0, 0.0)
+        elif node.status in ['provisioning', 'provisioned'] or \
+                node.needs_reprovision:
+            return (0.0, coeff)
+        elif node.status in ['deploying', 'ready'] or \
+                node.needs_redeploy:
+            return (100.0 * coeff, 1.0 - coeff)
+
+    def update(self, task, nodes, default=None):
+        """
+        Updates contributions of nodes reported for task.
+
+        :param task: Task object.
+        :param nodes: Reported Node objects.
+        :param default: Value to return if there are no nodes
+            to take into account.
+        :returns: Task progress.
+        """
+        with self._lock:
+            state = self._tasks.get(task.uuid)
+            if state is None or \
+                    any(n.id not in state['nodes'] for n in nodes):
+                state = self._load(task)
+            else:
+                self._refresh(state, set(n.id for n in nodes))
+                for node in nodes:
+                    self._set(state, node.id,
+                              self.node_weights(node), node.progress)
+            return self._progress(state, default)
+
+    def update_progress(self, task, nodes_progress, default=None):
+        """
+        Updates only progress of nodes reported for task,
+        their statuses should be the same as before.
+
+        :param task: Task object.
+        :param nodes_progress: Dict with progress of every node id.
+        :param default: Value to return if there are no nodes
+            to take into account.
+        :returns: Task progress.
+        """
+        with self._lock:
+            state = self._tasks.get(task.uuid)
+            if state is None or \
+                    any(n not in state['nodes'] for n in nodes_progress):
+                state = self._load(task)
+            else:
+                self._refresh(state)
+                for node_id, progress in nodes_progress.iteritems():
+                    if node_id not in state['nodes']:
+                        # node has left cluster
+                        continue
+                    base, weight, _ = state['nodes'][node_id]
+                    self._set(state, node_id, (base, weight), progress)
+            return self._progress(state, default)
+
+    def _load(self, task):
+        logger.debug("Loading deployment progress of task %s", task.uuid)
+        state = {
+            'cluster_id': task.cluster_id,
+            'nodes': {},
+            'stale': set(),
+            'sum': 0,
+            'count': 0
+        }
+        for node in db().query(Node).filter_by(cluster_id=task.cluster_id):
+            self._set(state, node.id, self.node_weights(node), node.progress)
+        self._tasks[task.uuid] = state
+        return state
+
+    def _refresh(self, state, skip=()):
+        """
+        Reloads stale nodes of task except of given ones.
+        """
+        stale = state['stale'] - set(skip)
+        state['stale'] = set()
+        if not stale:
+            return
+        found = set()
+        for node in db().query(Node).filter(Node.id.in_(stale)):
+            found.add(node.id)
+            if node.cluster_id == state['cluster_id']:
+                self._set(state, node.id,
+                          self.node_weights(node), node.progress)
+            else:
+                self._remove(state, node.id)
+        for node_id in stale - found:
+            self._remove(state, node_id)
+
+    def _remove(self, state, node_id):
+        old = state['nodes'].pop(node_id, None)
+        if old and old[0] is not None:
+            state['sum'] -= self._contribution(*old)
+            state['count'] -= 1
+
+    def _set(self, state, node_id, weights, progress):
+        self._remove(state, node_id)
+        base, weight = weights or (None, None)
+        state['nodes'][node_id] = (base, weight, progress)
+        if base is not None:
+            state['sum'] += self._contribution(base, weight, progress)
+            state['count'] += 1
+
+    def _contribution(self, base, weight, progress):
+        return int(round(
+            (base + weight * float(progress or 0)) * self.scale
+        ))
+
+    def _progress(self, state, default):
+        if not state['count']:
+            return default
+        return int(state['sum'] // (state['count'] * self.scale))
+
+
+deploy_progress = DeployProgressAccumulator()
+
+
+@event.listens_for(Node, 'after_insert')
+@event.listens_for(Node, 'after_update')
+@event.listens_for(Node, 'after_delete')
+def _node_changed(mapper, connection, target):
+    deploy_progress.nodes_changed([target.id], [target.cluster_id])
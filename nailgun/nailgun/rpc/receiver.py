@@ -22,12 +22,15 @@ import itertools
 
 from web.utils import ThreadedDict
 from sqlalchemy import or_
+from sqlalchemy.sql import bindparam
 
 import nailgun.rpc as rpc
 from nailgun.logger import logger
 from nailgun.db import db
 from nailgun.network.manager import NetworkManager
-from nailgun.settings import settings
+from nailgun.network.pools import pools_index
+from nailgun.network.allocator import IPRangeIndex
+from nailgun.rpc.progress import deploy_progress
 from nailgun.task.helpers import TaskHelper
 from nailgun.api.models import Node, Network, NetworkGroup
 from nailgun.api.models import IPAddr, Task
@@ -52,46 +55,67 @@ class NailgunReceiver(object):
         status = kwargs.get('status')
         progress = kwargs.get('progress')
 
+        uids = set(
+            int(node['uid'])
+            for node in itertools.chain(nodes, inaccessible_nodes, error_nodes)
+        )
+        nodes_db = {}
+        if uids:
+            nodes_db = dict(
+                (node_id, (name, mac)) for node_id, name, mac in
+                db().query(Node.id, Node.name, Node.mac).filter(
+                    Node.id.in_(uids)
+                )
+            )
+
+        nodes_to_delete = []
         for node in nodes:
-            node_db = db().query(Node).get(node['uid'])
-            if not node_db:
+            if int(node['uid']) not in nodes_db:
                 logger.error(
                     u"Failed to delete node '%s': node doesn't exist",
                     str(node)
                 )
                 break
-            db().delete(node_db)
+            nodes_to_delete.append(int(node['uid']))
 
         for node in inaccessible_nodes:
             # Nodes which not answered by rpc just removed from db
-            node_db = db().query(Node).get(node['uid'])
-            if node_db:
+            if int(node['uid']) in nodes_db:
+                name, mac = nodes_db[int(node['uid'])]
                 logger.warn(
                     u'Node %s not answered by RPC, removing from db',
-                    node_db.human_readable_name)
-                db().delete(node_db)
+                    name or mac)
+                nodes_to_delete.append(int(node['uid']))
 
+        error_nodes_ids = []
         for node in error_nodes:
-            node_db = db().query(Node).get(node['uid'])
-            if not node_db:
+            if int(node['uid']) not in nodes_db:
                 logger.error(
                     u"Failed to delete node '%s' marked as error from Naily:"
                     " node doesn't exist", str(node)
                 )
                 break
-            node_db.pending_deletion = False
-            node_db.status = 'error'
-            db().add(node_db)
-            node['name'] = node_db.name
+            error_nodes_ids.append(int(node['uid']))
+            node['name'] = nodes_db[int(node['uid'])][0]
+
+        TaskHelper.delete_nodes(nodes_to_delete)
+        if error_nodes_ids:
+            db().query(Node).filter(
+                Node.id.in_(error_nodes_ids)
+            ).update({
+                'pending_deletion': False,
+                'status': 'error'
+            }, synchronize_session=False)
         db().commit()
 
         success_msg = u"No nodes were removed"
         err_msg = u"No errors occurred"
+        notifications = []
         if nodes:
             success_msg = u"Successfully removed {0} node(s)".format(
                 len(nodes)
             )
-            notifier.notify("done", success_msg)
+            notifications.append({'topic': 'done', 'message': success_msg})
         if error_nodes:
             err_msg = u"Failed to remove {0} node(s): {1}".format(
                 len(error_nodes),
@@ -99,7 +123,8 @@ class NailgunReceiver(object):
                     [n.get('name') or "ID: {0}".format(n['uid'])
                         for n in error_nodes])
             )
-            notifier.notify("error", err_msg)
+            notifications.append({'topic': 'error', 'message': err_msg})
+        notifier.notify_batch(notifications)
         if not error_msg:
             error_msg = ". ".join([success_msg, err_msg])
 
@@ -120,9 +145,11 @@ class NailgunReceiver(object):
             logger.debug("Removing environment itself")
             cluster_name = cluster.name
 
-            nws = itertools.chain(
+            nws = list(itertools.chain(
                 *[n.networks for n in cluster.network_groups]
-            )
+            ))
+            cidrs = [n.cidr for n in nws]
+            network_groups_ids = [ng.id for ng in cluster.network_groups]
             ips = db().query(IPAddr).filter(
                 IPAddr.network.in_([n.id for n in nws])
             )
@@ -131,6 +158,8 @@ class NailgunReceiver(object):
 
             db().delete(cluster)
             db().commit()
+            pools_index.release(cidrs=cidrs)
+            IPRangeIndex.invalidate(*network_groups_ids)
 
             # Dmitry's hack for clearing VLANs without networks
             network_manager.clear_vlans()
@@ -181,9 +210,17 @@ class NailgunReceiver(object):
             status = task.status
 
         error_nodes = []
+        nodes_db = {}
+        if nodes:
+            nodes_db = dict(
+                (str(n.id), n) for n in db().query(Node).filter(
+                    Node.id.in_([node['uid'] for node in nodes])
+                )
+            )
+        reported_ids = [int(node_id) for node_id in nodes_db]
         # First of all, let's update nodes in database
         for node in nodes:
-            node_db = db().query(Node).get(node['uid'])
+            node_db = nodes_db.get(str(node['uid']))
 
             if not node_db:
                 logger.warning(
@@ -233,33 +270,21 @@ class NailgunReceiver(object):
                         )
 
             db().add(node_db)
-            db().commit()
+        db().commit()
 
         # We should calculate task progress by nodes info
         task = db().query(Task).filter_by(uuid=task_uuid).first()
-        coeff = settings.PROVISIONING_PROGRESS_COEFF or 0.3
         if nodes and not progress:
-            nodes_progress = []
-            nodes_db = db().query(Node).filter_by(
-                cluster_id=task.cluster_id).all()
-            for node in nodes_db:
-                if node.status == "discover":
-                    nodes_progress.append(0)
-                elif not node.online:
-                    nodes_progress.append(100)
-                elif node.status in ['provisioning', 'provisioned'] or \
-                        node.needs_reprovision:
-                    nodes_progress.append(float(node.progress) * coeff)
-                elif node.status in ['deploying', 'ready'] or \
-                        node.needs_redeploy:
-                    nodes_progress.append(
-                        100.0 * coeff + float(node.progress) * (1.0 - coeff)
-                    )
-            if nodes_progress:
-                progress = int(
-                    float(sum(nodes_progress)) / len(nodes_progress)
-                )
+            reported_nodes = []
+            if nodes_db:
+                # reload reported nodes expired by commit at once
+                reported_nodes = db().query(Node).filter(
+                    Node.id.in_(reported_ids)
+                ).all()
+            progress = deploy_progress.update(task, reported_nodes, progress)
 
+        if status in ('error', 'ready'):
+            deploy_progress.forget(task.uuid)
         # Let's check the whole task status
         if status in ('error',):
             cls._error_action(task, status, progress, message)
@@ -268,6 +293,51 @@ class NailgunReceiver(object):
         else:
             TaskHelper.update_task_status(task.uuid, status, progress, message)
 
+    @classmethod
+    def deploy_progress_resp(cls, **kwargs):
+        """
+        Applies a number of coalesced progress-only deploy_resp
+        messages (see nailgun.rpc.coalescer) at once: progress
+        of all reported nodes is stored with one statement and
+        task progress is calculated only once.
+        """
+        logger.info("RPC method deploy_progress_resp received: %s" % kwargs)
+        task_uuid = kwargs.get('task_uuid')
+        nodes = kwargs.get('nodes') or []
+        status = kwargs.get('status')
+        progress = kwargs.get('progress')
+
+        task = db().query(Task).filter_by(uuid=task_uuid).first()
+        if not task:
+            logger.warning(
+                u"No task with uuid '{0}'' found - nothing changed".format(
+                    task_uuid
+                )
+            )
+            return
+        if not status:
+            status = task.status
+
+        if nodes:
+            db().execute(
+                Node.__table__.update().where(
+                    Node.id == bindparam('node_id')
+                ).values(progress=bindparam('node_progress')),
+                [
+                    {'node_id': n['uid'], 'node_progress': n['progress']}
+                    for n in nodes
+                ]
+            )
+            db().commit()
+            if not progress:
+                progress = deploy_progress.update_progress(
+                    task,
+                    dict((int(n['uid']), n['progress']) for n in nodes),
+                    progress
+                )
+
+        TaskHelper.update_task_status(task.uuid, status, progress)
+
     @classmethod
     def provision_resp(cls, **kwargs):
         # For now provision task is nothing more than just adding
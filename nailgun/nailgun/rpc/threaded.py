@@ -15,8 +15,10 @@
 #    under the License.
 
 import time
+import zlib
 import traceback
 import threading
+from Queue import Queue as WorkQueue, Empty
 
 from kombu import Connection, Exchange, Queue
 from kombu.mixins import ConsumerMixin
@@ -24,31 +26,202 @@ from kombu.mixins import ConsumerMixin
 import nailgun.rpc as rpc
 from nailgun.settings import settings
 from nailgun.logger import logger
+from nailgun.stats import counters, gauges
 from nailgun.rpc.receiver import NailgunReceiver
+from nailgun.rpc.coalescer import ProgressCoalescer
+from nailgun.task.state import task_state
+from nailgun.api.models import Task
 from nailgun.db import db
 
 
+class RPCWorker(threading.Thread):
+    """
+    Worker of RPCConsumer pool. It handles messages of its shard
+    one after another, so messages of one cluster are handled in
+    order they are received. Database session is thread-local,
+    so every worker has its own session.
+    """
+
+    # maximum number of waiting messages handled in one batch
+    batch_size = 50
+
+    def __init__(self, consumer, number):
+        super(RPCWorker, self).__init__(name="RPCWorker-%s" % number)
+        self.daemon = True
+        self.consumer = consumer
+        self.queue = WorkQueue()
+        self.coalescer = ProgressCoalescer(consumer.dispatch)
+
+    def stop(self):
+        self.queue.put(None)
+
+    def run(self):
+        try:
+            stop = False
+            while not stop:
+                try:
+                    items = [self.queue.get(timeout=0.1)]
+                except Empty:
+                    with task_state.batch():
+                        self.coalescer.flush_expired()
+                    continue
+                # messages which are already waiting are handled
+                # in one batch, so their tasks are propagated once
+                while items[-1] is not None and \
+                        len(items) < self.batch_size:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+                with task_state.batch():
+                    for item in items:
+                        if item is None:
+                            self.coalescer.flush()
+                            stop = True
+                            break
+                        self.handle(*item)
+        finally:
+            db.remove()
+
+    def handle(self, body, msg, received):
+        counters.incr('rpc_queue_wait_seconds', time.time() - received)
+        self.coalescer.handle(body["method"], body["args"])
+        self.consumer.processed(msg)
+
+
 class RPCConsumer(ConsumerMixin):
+    """
+    Consumer of nailgun queue. If settings.RPC_CONSUMER_WORKERS
+    is more than 1, messages are handled by a pool of RPCWorker
+    threads. Messages are sharded by cluster of their task, so
+    different clusters are handled in parallel. Messages are
+    acknowledged by consumer thread, because channel can't be
+    shared between threads, and no more than
+    settings.RPC_CONSUMER_PREFETCH_COUNT of them are handled
+    at once.
+    """
 
-    def __init__(self, connection, receiver):
+    def __init__(self, connection, receiver, workers=None,
+                 prefetch_count=None):
         self.connection = connection
         self.receiver = receiver
+        self.coalescer = ProgressCoalescer(self.dispatch)
+        if workers is None:
+            workers = settings.RPC_CONSUMER_WORKERS
+        if prefetch_count is None:
+            prefetch_count = settings.RPC_CONSUMER_PREFETCH_COUNT
+        self.prefetch_count = int(prefetch_count or 0)
+        self.workers = []
+        if int(workers or 1) > 1:
+            self.workers = [
+                RPCWorker(self, n) for n in xrange(int(workers))
+            ]
+        self._processed = WorkQueue()
+        self._clusters = {}
 
     def get_consumers(self, Consumer, channel):
-        return [Consumer(queues=[rpc.nailgun_queue],
-                         callbacks=[self.consume_msg])]
+        consumer = Consumer(queues=[rpc.nailgun_queue],
+                            callbacks=[self.consume_msg])
+        if self.prefetch_count:
+            consumer.qos(prefetch_count=self.prefetch_count)
+        return [consumer]
+
+    def run(self, *args, **kwargs):
+        self.start_workers()
+        return super(RPCConsumer, self).run(*args, **kwargs)
+
+    def consume(self, *args, **kwargs):
+        if self.workers:
+            # processed messages are acknowledged between iterations
+            kwargs.setdefault('safety_interval', 0.1)
+        return super(RPCConsumer, self).consume(*args, **kwargs)
+
+    def on_iteration(self):
+        if not self.workers:
+            with task_state.batch():
+                self.coalescer.flush_expired()
+            return
+        while True:
+            try:
+                self._processed.get_nowait().ack()
+            except Empty:
+                break
 
     def consume_msg(self, body, msg):
-        callback = getattr(self.receiver, body["method"])
-        try:
-            callback(**body["args"])
-        except Exception as exc:
-            logger.error(traceback.format_exc())
-            db().rollback()
-        finally:
+        counters.incr('rpc_messages_received')
+        if not self.workers:
+            with task_state.batch():
+                self.coalescer.handle(body["method"], body["args"])
+            msg.ack()
+            return
+        worker = self.workers[
+            zlib.crc32(self.shard_key(body)) % len(self.workers)
+        ]
+        worker.queue.put((body, msg, time.time()))
+
+    def processed(self, msg):
+        self._processed.put(msg)
+
+    def shard_key(self, body):
+        """
+        Returns key of shard for message, it's cluster
+        of message task if task has one.
+        """
+        task_uuid = body["args"].get("task_uuid")
+        if not task_uuid:
+            return body["method"]
+        if task_uuid not in self._clusters:
+            if len(self._clusters) > 10000:
+                self._clusters.clear()
+            task = db().query(Task.cluster_id).filter_by(
+                uuid=task_uuid
+            ).first()
             db().commit()
-            db().expire_all()
-        msg.ack()
+            self._clusters[task_uuid] = task.cluster_id if task else None
+        cluster_id = self._clusters[task_uuid]
+        if cluster_id is None:
+            return str(task_uuid)
+        return "cluster-%s" % cluster_id
+
+    def start_workers(self):
+        # metrics are served by stats API while consumer works
+        gauges.register('rpc_consumer', self.metrics)
+        for worker in self.workers:
+            if not worker.is_alive():
+                worker.start()
+
+    def stop_workers(self):
+        gauges.unregister('rpc_consumer')
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.stop()
+                worker.join()
+
+    def metrics(self):
+        """
+        Returns number of messages waiting for workers and
+        handler counters collected so far.
+        """
+        stats = counters.snapshot()
+        return {
+            'queue_depth': sum(w.queue.qsize() for w in self.workers),
+            'messages_received': stats.get('rpc_messages_received', 0),
+            'handler_calls': stats.get('rpc_handler_calls', 0),
+            'handler_seconds': stats.get('rpc_handler_seconds', 0),
+            'queue_wait_seconds': stats.get('rpc_queue_wait_seconds', 0)
+        }
+
+    def dispatch(self, method, args):
+        callback = getattr(self.receiver, method)
+        with counters.timer('rpc_handler'):
+            try:
+                callback(**args)
+            except Exception as exc:
+                logger.error(traceback.format_exc())
+                db().rollback()
+            finally:
+                db().commit()
+                db().expire_all()
 
 
 class RPCKombuThread(threading.Thread):
@@ -69,4 +242,7 @@ class RPCKombuThread(threading.Thread):
     def run(self):
         with Connection(rpc.conn_str) as conn:
             self.consumer = RPCConsumer(conn, self.receiver)
-            self.consumer.run()
+            try:
+                self.consumer.run()
+            finally:
+                self.consumer.stop_workers()
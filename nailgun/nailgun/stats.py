@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Counters(object):
+    """
+    Thread-safe named counters of the current process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def get(self, name):
+        return self._values.get(name, 0)
+
+    def snapshot(self):
+        """
+        Returns copy of all counters as dict.
+        """
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Counts calls and total wall time of the block
+        as '<name>_calls' and '<name>_seconds'.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.incr(name + '_calls')
+            self.incr(name + '_seconds', time.time() - started)
+
+
+class Gauges(object):
+    """
+    Named callables which return current values, like length
+    of a queue. Unlike counters, values are taken on request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources = {}
+
+    def register(self, name, source):
+        with self._lock:
+            self._sources[name] = source
+
+    def unregister(self, name):
+        with self._lock:
+            self._sources.pop(name, None)
+
+    def collect(self):
+        """
+        Returns dict of current values of all gauges.
+        """
+        with self._lock:
+            sources = self._sources.items()
+        return dict((name, source()) for name, source in sources)
+
+
+counters = Counters()
+gauges = Gauges()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Version counters of database tables.
+
+Every INSERT, UPDATE, DELETE and TRUNCATE sent through the engine
+marks its table as changed on its connection, including bulk
+statements which bypass ORM events. Deleting also marks tables
+which database changes through ON DELETE CASCADE and SET NULL
+foreign keys. UPDATE which sets only columns that API never
+renders, like timestamp of node which agent refreshes on every
+check-in, doesn't change the table. Versions of changed tables are
+increased after transaction is committed and changes are forgotten
+when it's rolled back, so a version never runs ahead of committed
+data.
+
+Versions are kept in memory of current process, so only changes
+made by this process are seen. Every process gets its own random
+epoch, so versions of different processes never look the same.
+"""
+
+import re
+import uuid
+import threading
+
+from sqlalchemy import event
+
+from nailgun.db import engine
+
+
+_statement_table = re.compile(
+    r'^\s*(INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?)'
+    r'\s+"?(\w+)',
+    re.IGNORECASE
+)
+_update_columns = re.compile(
+    r'\bSET\s+(.*?)(?:\s+WHERE\b|$)',
+    re.IGNORECASE | re.DOTALL
+)
+_assigned_column = re.compile(r'"?(\w+)"?\s*=')
+
+# columns which aren't rendered by API, so changing them alone
+# doesn't change any response
+unversioned_columns = {
+    'nodes': frozenset(['timestamp'])
+}
+
+# tables changed by database itself when rows of table are deleted
+_deleted_with = None
+
+
+def deleted_with(table):
+    """
+    Returns names of tables which rows are deleted or updated by
+    ON DELETE CASCADE and ON DELETE SET NULL foreign keys when rows
+    of given table are deleted, including the table itself.
+    """
+    global _deleted_with
+    if _deleted_with is None:
+        from nailgun.api.models import Base
+        references = {}
+        for dependent in Base.metadata.tables.values():
+            for fk in dependent.foreign_keys:
+                ondelete = (fk.ondelete or '').upper()
+                if ondelete in ('CASCADE', 'SET NULL'):
+                    references.setdefault(fk.column.table.name, []).append(
+                        (dependent.name, ondelete == 'CASCADE')
+                    )
+
+        def collect(name, tables):
+            tables.add(name)
+            for dependent, cascade in references.get(name, ()):
+                if dependent in tables:
+                    continue
+                if cascade:
+                    # deleted rows can have dependent rows too
+                    collect(dependent, tables)
+                else:
+                    tables.add(dependent)
+            return tables
+
+        _deleted_with = dict(
+            (name, frozenset(collect(name, set())))
+            for name in Base.metadata.tables
+        )
+    return _deleted_with.get(table, frozenset([table]))
+
+
+def _sets_only_unversioned(table, statement):
+    columns = unversioned_columns.get(table)
+    if not columns:
+        return False
+    match = _update_columns.search(statement)
+    if not match:
+        return False
+    assigned = _assigned_column.findall(match.group(1))
+    return bool(assigned) and set(c.lower() for c in assigned) <= columns
+
+
+class TableVersions(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def get(self, table):
+        return self._versions.get(table, 0)
+
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def tag(self, tables, *extra):
+        """
+        Returns string which changes whenever any of tables is changed.
+
+        :param tables: Names of tables.
+        :param extra: Other values which tag depends on.
+        """
+        parts = [self.epoch]
+        parts.extend(str(self.get(table)) for table in tables)
+        parts.extend(extra)
+        return '-'.join(parts)
+
+
+table_versions = TableVersions()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _mark_changed_table(conn, cursor, statement, *args):
+    match = _statement_table.match(statement)
+    if match:
+        verb, table = match.group(1).upper(), match.group(2).lower()
+        changed = conn.info.setdefault('changed_tables', set())
+        if verb.startswith(('DELETE', 'TRUNCATE')):
+            changed.update(deleted_with(table))
+        elif verb == 'UPDATE' and _sets_only_unversioned(table, statement):
+            return
+        else:
+            changed.add(table)
+
+
+@event.listens_for(engine, "commit")
+def _commit_changed_tables(conn):
+    # this event comes before COMMIT is sent, so versions are
+    # increased only when connection is used or released after it
+    changed = conn.info.pop('changed_tables', None)
+    if changed:
+        conn.info.setdefault('committed_tables', set()).update(changed)
+
+
+@event.listens_for(engine, "rollback")
+def _forget_changed_tables(conn):
+    conn.info.pop('changed_tables', None)
+
+
+def _bump_committed_tables(info):
+    committed = info.pop('committed_tables', None)
+    if committed:
+        table_versions.bump(committed)
+
+
+@event.listens_for(engine, "begin")
+def _begin(conn):
+    _bump_committed_tables(conn.info)
+
+
+@event.listens_for(engine.pool, "checkin")
+def _checkin(dbapi_connection, connection_record):
+    if connection_record is not None:
+        _bump_committed_tables(connection_record.info)
@@ -17,14 +17,25 @@
 import os
 import shutil
 import logging
+import itertools
+from multiprocessing.pool import ThreadPool
 
 from nailgun.db import db
 from nailgun.logger import logger
 from nailgun.api.models import Task
 from nailgun.api.models import IPAddr
 from nailgun.api.models import Node
+from nailgun.api.models import NodeAttributes
+from nailgun.api.models import NodeNICInterface
+from nailgun.api.models import NetworkAssignment
+from nailgun.api.models import AllowedNetworks
+from nailgun.api.models import L2Connection
+from nailgun.api.models import ClusterChanges
+from nailgun.api.models import Notification
 from nailgun.settings import settings
 from nailgun.network.manager import NetworkManager
+from nailgun.task.state import task_state
+from nailgun.rpc.progress import deploy_progress
 
 
 class TaskHelper(object):
@@ -46,6 +57,39 @@ class TaskHelper(object):
                 logger.debug("Updating node fqdn: %s %s", n.id, n.fqdn)
                 db().commit()
 
+    @classmethod
+    def render_in_batches(cls, render, items):
+        """
+        Applies render to batches of settings.MESSAGE_RENDER_BATCH_SIZE
+        items on a pool of settings.MESSAGE_RENDER_WORKERS threads.
+        Database session is thread-local, so render should work
+        only with prefetched data.
+
+        :param render: Callable which takes list of items and
+            returns list of results.
+        :param items: List of items.
+        :type  items: list
+        :returns: List of results in order of items.
+        """
+        batch_size = int(settings.MESSAGE_RENDER_BATCH_SIZE or 0) or \
+            max(len(items), 1)
+        batches = [
+            items[i:i + batch_size]
+            for i in xrange(0, len(items), batch_size)
+        ]
+        workers = min(int(settings.MESSAGE_RENDER_WORKERS or 1),
+                      len(batches))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                rendered = pool.map(render, batches)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            rendered = map(render, batches)
+        return list(itertools.chain(*rendered))
+
     @classmethod
     def prepare_syslog_dir(cls, node, prefix=None):
         logger.debug("Preparing syslog directories for node: %s", node.fqdn)
@@ -115,58 +159,38 @@ class TaskHelper(object):
     @classmethod
     def update_task_status(cls, uuid, status, progress, msg="", result=None):
         logger.debug("Updating task: %s", uuid)
-        task = db().query(Task).filter_by(uuid=uuid).first()
-        if not task:
+        state = task_state.update(uuid, status, progress, msg, result)
+        if state is None:
             logger.error("Can't set status='%s', message='%s':no task \
                     with UUID %s found!", status, msg, uuid)
-            return
-        previous_status = task.status
-        data = {'status': status, 'progress': progress,
-                'message': msg, 'result': result}
-        for key, value in data.iteritems():
-            if value is not None:
-                setattr(task, key, value)
-                logger.info(
-                    u"Task {0} {1} is set to {2}".format(
-                        task.uuid,
-                        key,
-                        value
-                    )
-                )
-        db().add(task)
-        db().commit()
-
-        if previous_status != status and task.cluster_id:
-            logger.debug("Updating cluster status: "
-                         "cluster_id: %s status: %s",
-                         task.cluster_id, status)
-            cls.update_cluster_status(uuid)
-        if task.parent:
-            logger.debug("Updating parent task: %s", task.parent.uuid)
-            cls.update_parent_task(task.parent.uuid)
 
     @classmethod
     def update_parent_task(cls, uuid):
-        task = db().query(Task).filter_by(uuid=uuid).first()
-        subtasks = task.subtasks
+        logger.debug("Updating parent task: %s", uuid)
+        task = task_state.get(uuid)
+        if task is None:
+            return
+        subtasks = db().query(
+            Task.status, Task.progress, Task.message, Task.weight
+        ).filter_by(parent_id=task['id']).order_by(Task.id).all()
         if len(subtasks):
             if all(map(lambda s: s.status == 'ready', subtasks)):
-                task.status = 'ready'
-                task.progress = 100
-                task.message = '; '.join(map(
-                    lambda s: s.message, filter(
-                        lambda s: s.message is not None, subtasks)))
-                db().add(task)
-                db().commit()
+                task_state.write(uuid, task, {
+                    'status': 'ready',
+                    'progress': 100,
+                    'message': '; '.join(map(
+                        lambda s: s.message, filter(
+                            lambda s: s.message is not None, subtasks)))
+                })
                 cls.update_cluster_status(uuid)
             elif all(map(lambda s: s.status in ('ready', 'error'), subtasks)):
-                task.status = 'error'
-                task.progress = 100
-                task.message = '; '.join(map(
-                    lambda s: s.message, filter(
-                        lambda s: s.status == 'error', subtasks)))
-                db().add(task)
-                db().commit()
+                task_state.write(uuid, task, {
+                    'status': 'error',
+                    'progress': 100,
+                    'message': '; '.join(map(
+                        lambda s: s.message, filter(
+                            lambda s: s.status == 'error', subtasks)))
+                })
                 cls.update_cluster_status(uuid)
             else:
                 subtasks_with_progress = filter(
@@ -174,7 +198,7 @@ class TaskHelper(object):
                     subtasks
                 )
                 if subtasks_with_progress:
-                    task.progress = int(
+                    progress = int(
                         round(
                             sum(
                                 [s.weight * s.progress for s
@@ -186,9 +210,9 @@ class TaskHelper(object):
                             ), 0)
                     )
                 else:
-                    task.progress = 0
-                db().add(task)
-                db().commit()
+                    progress = 0
+                if progress != task['progress']:
+                    task_state.write(uuid, task, {'progress': progress})
 
     @classmethod
     def update_cluster_status(cls, uuid):
@@ -219,6 +243,54 @@ class TaskHelper(object):
             cluster.full_name, cluster.status, new_state)
         cluster.status = new_state
 
+    @classmethod
+    def delete_nodes(cls, nodes_ids):
+        """
+        Deletes nodes with their IPs, NIC interfaces, network
+        assignments, attributes and pending changes. Every table
+        is cleaned by one statement for all nodes, so it doesn't
+        depend on number of nodes. Notifications about nodes are
+        kept and detached from them. Changes are not committed,
+        so it's up to caller to commit them with other changes.
+
+        :param nodes_ids: IDs of nodes to delete.
+        :returns: Number of deleted nodes.
+        """
+        nodes_ids = list(set(nodes_ids))
+        if not nodes_ids:
+            return 0
+        # pending changes of session shouldn't refer to deleted rows
+        db().flush()
+
+        interfaces = db().query(NodeNICInterface.id).filter(
+            NodeNICInterface.node_id.in_(nodes_ids)
+        ).subquery()
+        for model in (NetworkAssignment, AllowedNetworks, L2Connection):
+            db().query(model).filter(
+                model.interface_id.in_(interfaces)
+            ).delete(synchronize_session=False)
+        db().query(IPAddr).filter(
+            IPAddr.node.in_(nodes_ids)
+        ).delete(synchronize_session=False)
+        for model in (NodeNICInterface, NodeAttributes, ClusterChanges):
+            db().query(model).filter(
+                model.node_id.in_(nodes_ids)
+            ).delete(synchronize_session=False)
+        db().query(Notification).filter(
+            Notification.node_id.in_(nodes_ids)
+        ).update({'node_id': None}, synchronize_session=False)
+        deleted = db().query(Node).filter(
+            Node.id.in_(nodes_ids)
+        ).delete(synchronize_session=False)
+
+        for node_id in nodes_ids:
+            node = db().identity_map.get((Node, (node_id,)))
+            if node is not None:
+                db().expunge(node)
+        deploy_progress.nodes_changed(nodes_ids)
+        logger.debug("Deleted %s nodes", deleted)
+        return deleted
+
     @classmethod
     def nodes_to_delete(cls, cluster):
         return filter(
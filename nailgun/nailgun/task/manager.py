@@ -23,8 +23,11 @@ import web
 
 from nailgun.db import db
 import nailgun.rpc as rpc
+from nailgun.rpc.chunks import split_message, make_manifest
 from nailgun.logger import logger
+from nailgun import profiler
 from nailgun.errors import errors
+from nailgun.settings import settings
 from nailgun.api.models import Cluster
 from nailgun.api.models import Task
 from nailgun.api.models import Network
@@ -46,23 +49,47 @@ class TaskManager(object):
         try:
             return method(task, *args, **kwargs)
         except Exception as exc:
-            err = str(exc)
-            if any([
-                not hasattr(exc, "log_traceback"),
-                hasattr(exc, "log_traceback") and exc.log_traceback
-            ]):
-                logger.error(traceback.format_exc())
-            TaskHelper.update_task_status(
-                task.uuid,
-                status="error",
-                progress=100,
-                msg=err
-            )
+            self._set_error(task, exc)
+
+    def _set_error(self, task, exc):
+        err = str(exc)
+        if any([
+            not hasattr(exc, "log_traceback"),
+            hasattr(exc, "log_traceback") and exc.log_traceback
+        ]):
+            logger.error(traceback.format_exc())
+        TaskHelper.update_task_status(
+            task.uuid,
+            status="error",
+            progress=100,
+            msg=err
+        )
 
 
 class DeploymentTaskManager(TaskManager):
 
-    def execute(self):
+    def execute(self, cprofile=False):
+        """
+        Starts deployment of cluster changes. If
+        settings.DEPLOY_PROFILING is on or cprofile is requested,
+        timing of deployment phases is stored in supertask profile.
+
+        :param cprofile: Also capture cProfile stats.
+        :returns: Supertask.
+        """
+        if not (settings.DEPLOY_PROFILING or cprofile):
+            return self._execute()
+        profiler.start(cprofile=cprofile)
+        try:
+            with profiler.phase('DeploymentTaskManager.execute'):
+                supertask = self._execute()
+        finally:
+            report = profiler.stop()
+        supertask.profile = report
+        db().commit()
+        return supertask
+
+    def _execute(self):
         logger.info(
             u"Trying to start deployment at cluster '{0}'".format(
                 self.cluster.name or self.cluster.id,
@@ -108,6 +135,7 @@ class DeploymentTaskManager(TaskManager):
                 tasks.DeletionTask
             )
 
+        chunk_size = int(settings.DEPLOY_MESSAGE_CHUNK_SIZE or 0)
         task_messages = []
         if nodes_to_provision:
             TaskHelper.update_slave_nodes_fqdn(nodes_to_provision)
@@ -117,33 +145,32 @@ class DeploymentTaskManager(TaskManager):
             # we assume here that task_provision just adds system to
             # cobbler and reboots it, so it has extremely small weight
             task_provision.weight = 0.05
-            provision_message = self._call_silently(
+            task_messages.append(self._build_messages(
                 task_provision,
                 tasks.ProvisionTask,
-                method_name='message'
-            )
-            task_provision.cache = provision_message
-            db().add(task_provision)
-            db().commit()
-            task_messages.append(provision_message)
+                chunk_size
+            ))
 
         if nodes_to_deploy:
             TaskHelper.update_slave_nodes_fqdn(nodes_to_deploy)
             logger.debug("There are nodes to deploy: %s",
                          " ".join([n.fqdn for n in nodes_to_deploy]))
             task_deployment = supertask.create_subtask("deployment")
-            deployment_message = self._call_silently(
+            task_messages.append(self._build_messages(
                 task_deployment,
                 tasks.DeploymentTask,
-                method_name='message'
-            )
-            task_deployment.cache = deployment_message
-            db().add(task_deployment)
-            db().commit()
-            task_messages.append(deployment_message)
+                chunk_size
+            ))
 
         if task_messages:
-            rpc.cast('naily', task_messages)
+            if chunk_size:
+                # messages are sent one by one as they are generated
+                rpc.cast('naily', (
+                    message for messages in task_messages
+                    for message in messages
+                ))
+            else:
+                rpc.cast('naily', sum(task_messages, []))
 
         logger.debug(
             u"Deployment: task to deploy cluster '{0}' is {1}".format(
@@ -153,6 +180,65 @@ class DeploymentTaskManager(TaskManager):
         )
         return supertask
 
+    def _build_messages(self, task, instance, chunk_size):
+        """
+        Builds orchestrator messages for task and stores them
+        in task cache. If chunk_size is set, nodes are sent
+        in chunks (see nailgun.rpc.chunks) which are generated
+        lazily and only compact manifest is stored in cache.
+
+        :returns: List or generator of messages.
+        """
+        if not chunk_size:
+            message = self._call_silently(
+                task,
+                instance,
+                method_name='message'
+            )
+            task.cache = message
+            db().add(task)
+            db().commit()
+            return [message]
+
+        prepared = self._call_silently(
+            task,
+            instance,
+            method_name='prepare_message'
+        )
+        if not prepared:
+            return []
+        message, nodes_ids, context = prepared
+        task.cache = make_manifest(message, nodes_ids, chunk_size)
+        db().add(task)
+        db().commit()
+        return self._abort_on_error(task, split_message(
+            message,
+            nodes_ids,
+            lambda batch: instance.format_nodes(task, batch, **context),
+            chunk_size
+        ))
+
+    def _abort_on_error(self, task, messages):
+        """
+        Passes chunked messages of task through. Chunks are formatted
+        while they are sent, so if formatting of a chunk fails, the
+        header and previous chunks are already sent. Then the rest
+        of chunks isn't sent and task is set to error like in
+        _call_silently; orchestrator never gets all chunks announced
+        in the header, so it doesn't start the incomplete task.
+        """
+        sent = 0
+        try:
+            for message in messages:
+                yield message
+                sent += 1
+        except Exception as exc:
+            logger.error(
+                u"Sending of task %s is aborted after %s messages",
+                task.uuid, sent
+            )
+            self._set_error(task, exc)
+
 
 class CheckBeforeDeploymentTaskManager(TaskManager):
 
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import traceback
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import aliased
+
+from nailgun.db import db
+from nailgun.logger import logger
+from nailgun.api.models import Task
+
+
+class TaskStateCache(object):
+    """
+    Process-wide write-through cache of running tasks.
+
+    Status, progress and message of task are kept by uuid, so
+    updating task doesn't load it, and only fields which have
+    changed are written with one UPDATE statement. Task is
+    dropped from cache when it's finished, deleted or changed
+    through ORM.
+
+    Inside of batch() propagation of changes to parent tasks
+    and clusters is deferred until the end of batch, where
+    it's done once for every parent task and changed task.
+    """
+
+    fields = ('status', 'progress', 'message')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._local = threading.local()
+
+    def reset(self):
+        with self._lock:
+            self._tasks.clear()
+
+    def forget(self, uuid):
+        with self._lock:
+            self._tasks.pop(uuid, None)
+
+    def get(self, uuid):
+        """
+        Returns dict with cached fields of task, its id, name,
+        cluster_id and parent_uuid, or None if there is no such task.
+        """
+        with self._lock:
+            state = self._tasks.get(uuid)
+        if state is not None:
+            return dict(state)
+
+        parent = aliased(Task)
+        row = db().query(
+            Task.id, Task.name, Task.cluster_id,
+            Task.status, Task.progress, Task.message,
+            parent.uuid
+        ).outerjoin(
+            parent, Task.parent_id == parent.id
+        ).filter(Task.uuid == uuid).first()
+        if row is None:
+            return None
+        state = dict(zip(
+            ('id', 'name', 'cluster_id') + self.fields + ('parent_uuid',),
+            row
+        ))
+        self._remember(uuid, state)
+        return dict(state)
+
+    def update(self, uuid, status=None, progress=None,
+               message=None, result=None):
+        """
+        Writes changed fields of task, commits them and propagates
+        them to its cluster and parent task.
+
+        :returns: Task state before update or None if task isn't found.
+        """
+        state = self.get(uuid)
+        if state is None:
+            return None
+        changes = {}
+        data = {'status': status, 'progress': progress, 'message': message}
+        for key, value in data.iteritems():
+            if value is not None and value != state[key]:
+                changes[key] = value
+        if result is not None:
+            changes['result'] = result
+        self.write(uuid, state, changes)
+
+        if 'status' in changes and state['cluster_id']:
+            self.propagate_to_cluster(uuid)
+        if state['parent_uuid']:
+            self.propagate_to_parent(state['parent_uuid'])
+        return state
+
+    def write(self, uuid, state, changes):
+        """
+        Writes changes of task fields and commits them.
+
+        :param state: Task state returned by get().
+        :param changes: Dict with new values of fields.
+        """
+        for key, value in changes.iteritems():
+            logger.info(u"Task {0} {1} is set to {2}".format(uuid, key, value))
+        if changes:
+            db().query(Task).filter_by(id=state['id']).update(
+                changes, synchronize_session='evaluate'
+            )
+        db().commit()
+
+        new_state = dict(state)
+        new_state.update(
+            (key, value) for key, value in changes.iteritems()
+            if key in self.fields
+        )
+        self._remember(uuid, new_state)
+
+    def propagate_to_cluster(self, uuid):
+        if self._in_batch():
+            self._local.clusters[uuid] = True
+        else:
+            self._update_cluster_status(uuid)
+
+    def propagate_to_parent(self, uuid):
+        if self._in_batch():
+            self._local.parents[uuid] = True
+        else:
+            self._update_parent_task(uuid)
+
+    @contextmanager
+    def batch(self):
+        """
+        Defers propagation of task changes made by current thread
+        in the block. Nested blocks are propagated by the outer one.
+        """
+        if self._in_batch():
+            yield
+            return
+        self._local.clusters = {}
+        self._local.parents = {}
+        try:
+            yield
+        finally:
+            clusters, parents = self._local.clusters, self._local.parents
+            self._local.clusters = self._local.parents = None
+            for uuid in clusters:
+                self._propagate(self._update_cluster_status, uuid)
+            for uuid in parents:
+                self._propagate(self._update_parent_task, uuid)
+
+    def _propagate(self, update, uuid):
+        try:
+            update(uuid)
+        except Exception:
+            logger.error(traceback.format_exc())
+            db().rollback()
+
+    def _in_batch(self):
+        return getattr(self._local, 'parents', None) is not None
+
+    def _update_cluster_status(self, uuid):
+        from nailgun.task.helpers import TaskHelper
+        TaskHelper.update_cluster_status(uuid)
+
+    def _update_parent_task(self, uuid):
+        from nailgun.task.helpers import TaskHelper
+        TaskHelper.update_parent_task(uuid)
+
+    def _remember(self, uuid, state):
+        with self._lock:
+            if state['status'] in ('ready', 'error'):
+                self._tasks.pop(uuid, None)
+            else:
+                self._tasks[uuid] = state
+
+
+task_state = TaskStateCache()
+
+
+@event.listens_for(Task, 'after_update')
+@event.listens_for(Task, 'after_delete')
+def _forget_task(mapper, connection, target):
+    task_state.forget(target.uuid)
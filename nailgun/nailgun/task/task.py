@@ -20,6 +20,8 @@ import traceback
 import subprocess
 import shlex
 import json
+import types
+from functools import partial
 
 import web
 import netaddr
@@ -27,17 +29,19 @@ from sqlalchemy.orm import object_mapper, ColumnProperty
 from sqlalchemy import or_
 
 import nailgun.rpc as rpc
+from nailgun.rpc.chunks import join_chunks
 from nailgun.db import db
 from nailgun.logger import logger
 from nailgun.settings import settings
 from nailgun import notifier
+from nailgun import profiler
 from nailgun.network.manager import NetworkManager
+from nailgun.network.allocator import compact_ranges, expand_ranges
 from nailgun.api.models import Base
-from nailgun.api.models import Network
 from nailgun.api.models import NetworkGroup
 from nailgun.api.models import Node
+from nailgun.api.models import NodeAttributes
 from nailgun.api.models import Cluster
-from nailgun.api.models import IPAddr
 from nailgun.api.models import Release
 from nailgun.task.fake import FAKE_THREADS
 from nailgun.errors import errors
@@ -57,6 +61,8 @@ def fake_cast(queue, messages, **kwargs):
         thread.name = message['method'].upper()
         return thread
 
+    if isinstance(messages, types.GeneratorType):
+        messages = join_chunks(messages)
     if isinstance(messages, (list,)):
         thread = None
         for m in messages:
@@ -104,9 +110,24 @@ class DeploymentTask(object):
 #   those which are prepared for removal.
 
     @classmethod
+    @profiler.profiled('DeploymentTask.message')
     def message(cls, task):
         logger.debug("DeploymentTask.message(task=%s)" % task.uuid)
-        task_uuid = task.uuid
+        message, nodes_ids, context = cls.prepare_message(task)
+        message['args']['nodes'] = cls.format_nodes(
+            task, nodes_ids, **context)
+        return message
+
+    @classmethod
+    @profiler.profiled('DeploymentTask.prepare_message')
+    def prepare_message(cls, task):
+        """
+        Makes all database changes required for deployment
+        and builds message without nodes.
+
+        :returns: Tuple of message, list of IDs of nodes to deploy
+            and dict of keyword arguments for format_nodes.
+        """
         cluster_id = task.cluster.id
         netmanager = NetworkManager()
 
@@ -118,26 +139,28 @@ class DeploymentTask(object):
         nodes_ids = [n.id for n in nodes]
         if nodes_ids:
             logger.info("Assigning IP addresses to nodes..")
-            netmanager.assign_ips(nodes_ids, "management")
-            netmanager.assign_ips(nodes_ids, "public")
-            netmanager.assign_ips(nodes_ids, "storage")
-
-        nodes_with_attrs = []
-        for n in nodes:
-            n.pending_addition = False
-            if n.status in ('ready', 'deploying'):
-                n.status = 'provisioned'
-            n.progress = 0
-            db().add(n)
+            netmanager.bulk_assign_ips(
+                nodes_ids,
+                ["management", "public", "storage"]
+            )
+
+        if nodes_ids:
+            db().query(Node).filter(
+                Node.id.in_(nodes_ids)
+            ).filter(
+                Node.status.in_(('ready', 'deploying'))
+            ).update({'status': 'provisioned'}, synchronize_session=False)
+            db().query(Node).filter(
+                Node.id.in_(nodes_ids)
+            ).update(
+                {'pending_addition': False, 'progress': 0},
+                synchronize_session=False
+            )
             db().commit()
-            nodes_with_attrs.append(cls.__format_node_for_naily(n))
 
         cluster_attrs = task.cluster.attributes.merged_attrs_values()
         cluster_attrs['controller_nodes'] = cls.__controller_nodes(cluster_id)
 
-        nets_db = db().query(Network).join(NetworkGroup).\
-            filter(NetworkGroup.cluster_id == cluster_id).all()
-
         ng_db = db().query(NetworkGroup).filter_by(
             cluster_id=cluster_id).all()
         for net in ng_db:
@@ -161,7 +184,6 @@ class DeploymentTask(object):
         if cluster_attrs['network_manager'] == 'VlanManager':
             cluster_attrs['num_networks'] = fixed_net.amount
             cluster_attrs['vlan_start'] = fixed_net.vlan_start
-            cls.__add_vlan_interfaces(nodes_with_attrs)
 
         if task.cluster.mode == 'ha':
             logger.info("HA mode chosen, creating VIP addresses for it..")
@@ -178,12 +200,28 @@ class DeploymentTask(object):
             'respond_to': 'deploy_resp',
             'args': {
                 'task_uuid': task.uuid,
-                'nodes': nodes_with_attrs,
+                'nodes': [],
                 'attributes': cluster_attrs
             }
         }
 
-        return message
+        return message, nodes_ids, {}
+
+    @classmethod
+    @profiler.profiled('DeploymentTask.format_nodes')
+    def format_nodes(cls, task, nodes_ids):
+        """
+        Formats nodes for deployment message.
+
+        :param nodes_ids: List of nodes IDs returned by
+            prepare_message or a batch of them.
+        :returns: List of nodes data.
+        """
+        nodes_data = cls.__fetch_nodes_data(
+            nodes_ids,
+            vlan_interfaces=task.cluster.net_manager == 'VlanManager'
+        )
+        return TaskHelper.render_in_batches(cls.__render_nodes, nodes_data)
 
     @classmethod
     def execute(cls, task):
@@ -195,60 +233,98 @@ class DeploymentTask(object):
         rpc.cast('naily', message)
 
     @classmethod
-    def __format_node_for_naily(cls, n):
-        netmanager = NetworkManager()
-        return {
-            'id': n.id, 'status': n.status, 'error_type': n.error_type,
-            'uid': n.id, 'ip': n.ip, 'mac': n.mac, 'role': n.role,
-            'fqdn': n.fqdn, 'progress': n.progress, 'meta': n.meta,
-            'network_data': netmanager.get_node_networks(n.id),
-            'online': n.online
-        }
-
-    @classmethod
-    def __add_vlan_interfaces(cls, nodes):
+    def __fetch_nodes_data(cls, nodes_ids, vlan_interfaces=False):
         """
+        Loads everything required for nodes formatting with
+        fixed number of queries.
+
         We shouldn't pass to orchetrator fixed network
         when network manager is VlanManager, but we should specify
         fixed_interface (private_interface in terms of fuel) as result
         we just pass vlan_interface as node attribute.
+
+        :param nodes_ids: List of nodes database IDs.
+        :param vlan_interfaces: Whether to add vlan_interface.
+        :returns: List of plain dicts in order of nodes_ids.
         """
+        if not nodes_ids:
+            return []
         netmanager = NetworkManager()
-        for node in nodes:
-            node_db = db().query(Node).get(node['id'])
+        nodes_networks = netmanager.get_nodes_networks(nodes_ids)
+        fixed_interfaces = {}
+        if vlan_interfaces:
+            fixed_interfaces = \
+                netmanager.get_nodes_interfaces_by_network_name(
+                    nodes_ids, 'fixed'
+                )
 
-            fixed_interface = netmanager._get_interface_by_network_name(
-                node_db.id, 'fixed')
+        fields = ('id', 'status', 'error_type', 'ip', 'mac', 'role',
+                  'fqdn', 'progress', 'meta', 'online')
+        rows = db().query(
+            *[getattr(Node, field) for field in fields]
+        ).filter(Node.id.in_(nodes_ids))
+        nodes = dict((row[0], dict(zip(fields, row))) for row in rows)
+
+        nodes_data = []
+        for node_id in nodes_ids:
+            node_data = nodes[node_id]
+            node_data['network_data'] = nodes_networks[node_id]
+            if vlan_interfaces:
+                node_data['vlan_interface'] = fixed_interfaces[node_id]
+            nodes_data.append(node_data)
+        return nodes_data
 
-            node['vlan_interface'] = fixed_interface.name
+    @classmethod
+    def __render_nodes(cls, nodes_data):
+        nodes = []
+        for node_data in nodes_data:
+            node = dict(node_data)
+            node['uid'] = node['id']
+            nodes.append(node)
+        return nodes
 
     @classmethod
     def __controller_nodes(cls, cluster_id):
-        nodes = db().query(Node).filter_by(
+        nodes_ids = [n.id for n in db().query(Node.id).filter_by(
             cluster_id=cluster_id,
             role='controller',
-            pending_deletion=False).order_by(Node.id)
+            pending_deletion=False).order_by(Node.id)]
 
-        return map(cls.__format_node_for_naily, nodes)
+        return cls.__render_nodes(cls.__fetch_nodes_data(nodes_ids))
 
     @classmethod
     def __get_ip_addresses_in_ranges(cls, network_group):
         """
         Get array of all possibale ip addresses in all ranges
+        or merged ranges if settings.COMPACT_FLOATING_RANGES is set
         """
-        ranges = []
-        for ip_range in network_group.ip_ranges:
-            ranges += map(lambda ip: str(ip),
-                          list(netaddr.IPRange(ip_range.first, ip_range.last)))
-
+        ranges = [(r.first, r.last) for r in network_group.ip_ranges]
+        if settings.COMPACT_FLOATING_RANGES:
+            return compact_ranges(ranges)
         # Return only uniq ip addresses
-        return sorted(list(set(ranges)))
+        return sorted(expand_ranges(ranges))
 
 
 class ProvisionTask(object):
     @classmethod
+    @profiler.profiled('ProvisionTask.message')
     def message(cls, task):
         logger.debug("ProvisionTask.message(task=%s)" % task.uuid)
+        message, nodes_ids, context = cls.prepare_message(task)
+        message['args']['nodes'] = cls.format_nodes(
+            task, nodes_ids, **context)
+        return message
+
+    @classmethod
+    @profiler.profiled('ProvisionTask.prepare_message')
+    def prepare_message(cls, task):
+        """
+        Makes all database changes required for provisioning
+        and builds message without nodes.
+
+        :returns: Tuple of message, list of IDs of nodes to provision
+            and dict of keyword arguments for format_nodes.
+        """
         # this variable is used to set 'auth_key' in cobbler ks_meta
         cluster_attrs = task.cluster.attributes.merged_attrs_values()
         nodes = TaskHelper.nodes_to_provision(task.cluster)
@@ -258,7 +334,6 @@ class ProvisionTask(object):
         # TODO: For now we send nodes data to orchestrator
         # which is cobbler oriented. But for future we
         # need to use more abstract data structure.
-        nodes_data = []
         for node in nodes:
             if not node.online:
                 if not USE_FAKE:
@@ -274,15 +349,107 @@ class ProvisionTask(object):
                         (node.name, node.id)
                     )
 
+        # nodes which are booted with bootstrap image, it should
+        # be known before their status is changed to provisioning
+        bootstrapped = set(n.id for n in nodes if n.status == "discover")
+        nodes_ids = [n.id for n in nodes]
+
+        # here we assign admin network IPs for nodes
+        # one IP for every node interface
+        nodes_admin_ips = netmanager.bulk_assign_admin_ips(
+            dict(
+                (node.id, len(node.meta.get('interfaces', [])))
+                for node in nodes
+            )
+        )
+
+        # FIXME: move this code (updating) into receiver.provision_resp
+        if not USE_FAKE and nodes_ids:
+            db().query(Node).filter(
+                Node.id.in_(nodes_ids)
+            ).update({'status': 'provisioning'}, synchronize_session=False)
+            db().commit()
+            for node in db().query(Node).filter(
+                Node.id.in_(nodes_ids)
+            ).order_by(Node.id):
+                TaskHelper.prepare_syslog_dir(node)
+
+        message = {
+            'method': 'provision',
+            'respond_to': 'provision_resp',
+            'args': {
+                'task_uuid': task.uuid,
+                'engine': {
+                    'url': settings.COBBLER_URL,
+                    'username': settings.COBBLER_USER,
+                    'password': settings.COBBLER_PASSWORD,
+                },
+                'nodes': []
+            }
+        }
+        context = {
+            'cluster_attrs': cluster_attrs,
+            'nodes_admin_ips': nodes_admin_ips,
+            'bootstrapped': bootstrapped
+        }
+        return message, nodes_ids, context
+
+    @classmethod
+    @profiler.profiled('ProvisionTask.format_nodes')
+    def format_nodes(cls, task, nodes_ids, cluster_attrs,
+                     nodes_admin_ips, bootstrapped):
+        """
+        Formats nodes for provisioning message.
+
+        :param nodes_ids: List of nodes IDs returned by
+            prepare_message or a batch of them.
+        :returns: List of nodes data.
+        """
+        return TaskHelper.render_in_batches(
+            partial(
+                cls.__render_nodes,
+                cluster_attrs=cluster_attrs,
+                nodes_admin_ips=nodes_admin_ips,
+                bootstrapped=bootstrapped
+            ),
+            cls.__fetch_nodes_data(nodes_ids)
+        )
+
+    @classmethod
+    def __fetch_nodes_data(cls, nodes_ids):
+        """
+        Loads everything required for nodes formatting with
+        one query.
+
+        :param nodes_ids: List of nodes database IDs.
+        :returns: List of plain dicts in order of nodes_ids.
+        """
+        if not nodes_ids:
+            return []
+        fields = ('id', 'role', 'ip', 'mac', 'fqdn', 'meta', 'volumes')
+        rows = db().query(
+            Node.id, Node.role, Node.ip, Node.mac, Node.fqdn, Node.meta,
+            NodeAttributes.volumes
+        ).outerjoin(
+            (NodeAttributes, NodeAttributes.node_id == Node.id)
+        ).filter(Node.id.in_(nodes_ids))
+        nodes = dict((row[0], dict(zip(fields, row))) for row in rows)
+        return [nodes[node_id] for node_id in nodes_ids]
+
+    @classmethod
+    def __render_nodes(cls, nodes, cluster_attrs, nodes_admin_ips,
+                       bootstrapped):
+        nodes_data = []
+        for node in nodes:
             cobbler_profile = cluster_attrs['cobbler']['profile']
 
             node_data = {
                 'profile': cobbler_profile,
                 'power_type': 'ssh',
                 'power_user': 'root',
-                'power_address': node.ip,
-                'name': TaskHelper.make_slave_name(node.id, node.role),
-                'hostname': node.fqdn,
+                'power_address': node['ip'],
+                'name': TaskHelper.make_slave_name(node['id'], node['role']),
+                'hostname': node['fqdn'],
                 'name_servers': '\"%s\"' % settings.DNS_SERVERS,
                 'name_servers_search': '\"%s\"' % settings.DNS_SEARCH,
                 'netboot_enabled': '1',
@@ -302,14 +469,14 @@ class ProvisionTask(object):
                     'mco_enable': 1,
                     'auth_key': "\"%s\"" % cluster_attrs.get('auth_key', ''),
                     'ks_spaces': "\"%s\"" % json.dumps(
-                        node.attributes.volumes).replace("\"", "\\\"")
+                        node['volumes']).replace("\"", "\\\"")
                 }
             }
 
-            if node.status == "discover":
+            if node['id'] in bootstrapped:
                 logger.info(
                     "Node %s seems booted with bootstrap image",
-                    node.id
+                    node['id']
                 )
                 node_data['power_pass'] = settings.PATH_TO_BOOTSTRAP_SSH_KEY
             else:
@@ -318,27 +485,12 @@ class ProvisionTask(object):
                 # TODO: Get rid of expectations!
                 logger.info(
                     "Node %s seems booted with real system",
-                    node.id
+                    node['id']
                 )
                 node_data['power_pass'] = settings.PATH_TO_SSH_KEY
 
-            # FIXME: move this code (updating) into receiver.provision_resp
-            if not USE_FAKE:
-                node.status = "provisioning"
-                db().add(node)
-                db().commit()
-
-            # here we assign admin network IPs for node
-            # one IP for every node interface
-            netmanager.assign_admin_ips(
-                node.id,
-                len(node.meta.get('interfaces', []))
-            )
-            admin_net_id = netmanager.get_admin_network_id()
-            admin_ips = set([i.ip_addr for i in db().query(IPAddr).
-                            filter_by(node=node.id).
-                            filter_by(network=admin_net_id)])
-            for i in node.meta.get('interfaces', []):
+            admin_ips = set(nodes_admin_ips[node['id']])
+            for i in node['meta'].get('interfaces', []):
                 if 'interfaces' not in node_data:
                     node_data['interfaces'] = {}
                 node_data['interfaces'][i['name']] = {
@@ -367,28 +519,13 @@ class ProvisionTask(object):
                 # assignted fqdn to be resolved into one IP address
                 # because we don't completely support multiinterface
                 # configuration yet.
-                if i['mac'] == node.mac:
-                    node_data['interfaces'][i['name']]['dns_name'] = node.fqdn
+                if i['mac'] == node['mac']:
+                    node_data['interfaces'][i['name']]['dns_name'] = \
+                        node['fqdn']
                     node_data['interfaces_extra'][i['name']]['onboot'] = 'yes'
 
             nodes_data.append(node_data)
-            if not USE_FAKE:
-                TaskHelper.prepare_syslog_dir(node)
-
-        message = {
-            'method': 'provision',
-            'respond_to': 'provision_resp',
-            'args': {
-                'task_uuid': task.uuid,
-                'engine': {
-                    'url': settings.COBBLER_URL,
-                    'username': settings.COBBLER_USER,
-                    'password': settings.COBBLER_PASSWORD,
-                },
-                'nodes': nodes_data
-            }
-        }
-        return message
+        return nodes_data
 
     @classmethod
     def execute(cls, task):
@@ -424,6 +561,8 @@ class DeletionTask(object):
             )
             return
 
+        offline_nodes_ids = []
+        nodes_fqdns = {}
         for node in task.cluster.nodes:
             if node.pending_deletion:
                 nodes_to_delete.append({
@@ -431,6 +570,9 @@ class DeletionTask(object):
                     'uid': node.id,
                     'role': node.role
                 })
+                nodes_fqdns[node.id] = node.fqdn
+                if not node.online:
+                    offline_nodes_ids.append(node.id)
 
                 if USE_FAKE:
                     # only fake tasks
@@ -455,20 +597,18 @@ class DeletionTask(object):
         nodes_to_delete_constant = list(nodes_to_delete)
 
         for node in nodes_to_delete_constant:
-            node_db = db().query(Node).get(node['id'])
-
             slave_name = TaskHelper.make_slave_name(
                 node['id'], node['role']
             )
             logger.debug("Removing node from database and pending it "
                          "to clean its MBR: %s", slave_name)
-            if not node_db.online:
+            if node['id'] in offline_nodes_ids:
                 logger.info(
                     "Node is offline, can't MBR clean: %s", slave_name)
-                db().delete(node_db)
-                db().commit()
-
                 nodes_to_delete.remove(node)
+        if offline_nodes_ids:
+            TaskHelper.delete_nodes(offline_nodes_ids)
+            db().commit()
 
         # only real tasks
         engine_nodes = []
@@ -481,9 +621,8 @@ class DeletionTask(object):
                              slave_name)
                 engine_nodes.append(slave_name)
                 try:
-                    node_db = db().query(Node).get(node['id'])
-                    if node_db and node_db.fqdn:
-                        node_hostname = node_db.fqdn
+                    if nodes_fqdns.get(node['id']):
+                        node_hostname = nodes_fqdns[node['id']]
                     else:
                         node_hostname = TaskHelper.make_slave_fqdn(
                             node['id'], node['role'])
@@ -51,6 +51,10 @@ from nailgun.wsgi import build_app
 from nailgun.db import dropdb, syncdb, flush, db
 from nailgun.fixtures.fixman import upload_fixture
 from nailgun.network.manager import NetworkManager
+from nailgun.network.pools import pools_index
+from nailgun.network.allocator import IPRangeIndex
+from nailgun.rpc.progress import deploy_progress
+from nailgun.task.state import task_state
 from nailgun.network.topology import TopoChecker
 
 
@@ -666,6 +670,10 @@ class BaseHandlers(TestCase):
             "Content-Type": "application/json"
         }
         flush()
+        pools_index.reset()
+        IPRangeIndex.invalidate()
+        deploy_progress.reset()
+        task_state.reset()
         self.env = Environment(app=self.app)
         self.env.upload_fixtures(self.fixtures)
 
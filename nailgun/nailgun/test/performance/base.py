@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import resource
+
+from sqlalchemy import event
+
+from nailgun.db import engine
+
+
+_active_counters = []
+
+
+def _count_statement(*args, **kwargs):
+    for counter in _active_counters:
+        counter.queries += 1
+
+
+event.listen(engine, "before_cursor_execute", _count_statement)
+
+
+class Measure(object):
+    """
+    Context manager which measures wall time and number
+    of SQL statements sent to database inside its block.
+    Peak RSS of the process (in kilobytes) is taken when
+    the block is left.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.peak_rss = 0
+        self._started = None
+
+    def __enter__(self):
+        _active_counters.append(self)
+        self._started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.seconds = time.time() - self._started
+        self.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        _active_counters.remove(self)
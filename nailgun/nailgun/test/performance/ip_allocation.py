@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of free IP address allocation in a mostly used network.
+
+It fills /20 management range with IP addresses of 3000 nodes and
+reports number of queries and wall time per allocation both for
+IPAllocator and for the old approach with a query per candidate IP.
+
+Usage:
+    python -m nailgun.test.performance.ip_allocation [--nodes 3000]
+
+WARNING: it wipes all data in configured database, just like tests do.
+"""
+
+import json
+import argparse
+from datetime import datetime
+from itertools import islice
+
+from netaddr import IPNetwork, IPRange
+
+from nailgun.db import db, flush, syncdb
+from nailgun.api.models import Release, Node, Network, NetworkGroup
+from nailgun.api.models import IPAddr, IPAddrRange
+from nailgun.network.manager import NetworkManager
+from nailgun.test.performance.base import Measure
+
+
+def fill_network(cidr, nodes_count):
+    syncdb()
+    flush()
+    net = IPNetwork(cidr)
+    release = Release(
+        name=u"benchmark",
+        version="1",
+        operating_system="CentOS"
+    )
+    db().add(release)
+    db().commit()
+    ng = NetworkGroup(
+        release=release.id,
+        name="management",
+        access="private192",
+        cidr=str(net),
+        netmask=str(net.netmask),
+        gateway=str(net[1])
+    )
+    db().add(ng)
+    db().commit()
+    db().add(IPAddrRange(
+        network_group_id=ng.id,
+        first=str(net[2]),
+        last=str(net[-2])
+    ))
+    network = Network(
+        release=release.id,
+        name="management",
+        access="private192",
+        cidr=str(net),
+        network_group_id=ng.id
+    )
+    db().add(network)
+    db().commit()
+
+    db().execute(Node.__table__.insert(), [
+        {
+            "mac": "00:00:%02x:%02x:%02x:%02x" % (
+                (i >> 24) & 0xff, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff
+            ),
+            "timestamp": datetime.now()
+        } for i in xrange(nodes_count)
+    ])
+    nodes_ids = [n for (n,) in db().query(Node.id).order_by(Node.id)]
+    db().execute(IPAddr.__table__.insert(), [
+        {
+            "node": node_id,
+            "network": network.id,
+            "ip_addr": str(ip)
+        } for node_id, ip in zip(nodes_ids, islice(net, 2, None))
+    ])
+    db().commit()
+    return ng
+
+
+def per_ip_scan(network_group):
+    """
+    Old approach to find free IP: one query for every candidate.
+    """
+    for ip_range in network_group.ip_ranges:
+        for ip in IPRange(ip_range.first, ip_range.last):
+            if ip == network_group.gateway:
+                continue
+            if db().query(IPAddr).filter_by(ip_addr=str(ip)).first() is None:
+                return str(ip)
+
+
+def measure(name, func, iterations):
+    with Measure() as m:
+        for _ in xrange(iterations):
+            func()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "queries_per_allocation": float(m.queries) / iterations,
+        "seconds_per_allocation": m.seconds / iterations
+    }
+
+
+def run(nodes_count=3000, cidr="10.100.0.0/20"):
+    ng = fill_network(cidr, nodes_count)
+    netmanager = NetworkManager()
+    results = [
+        measure(
+            "get_free_ips",
+            lambda: netmanager.get_free_ips(ng.id),
+            20
+        ),
+        measure(
+            "per_ip_scan",
+            lambda: per_ip_scan(ng),
+            3
+        )
+    ]
+    flush()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--nodes", dest="nodes", type=int, default=3000,
+        help="number of nodes with IP addresses in /20 range"
+    )
+    params = parser.parse_args()
+    print json.dumps(run(params.nodes), indent=4)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of provisioning and deployment messages building.
+
+For every given number of fake nodes it creates a cluster with
+VlanManager and reports number of SQL statements, wall time and
+peak RSS of ProvisionTask.message and DeploymentTask.message.
+
+Usage:
+    python -m nailgun.test.performance.messages \\
+        [--nodes 50 200 1000] [--output results.json]
+
+WARNING: it wipes all data in configured database, just like tests do.
+"""
+
+import json
+import argparse
+
+from netaddr import IPNetwork
+
+from nailgun.db import db, flush
+from nailgun.settings import settings
+from nailgun.api.models import Cluster, Attributes, Node, NodeAttributes
+from nailgun.api.models import Task
+from nailgun.network.manager import NetworkManager
+from nailgun.network.pools import pools_index
+from nailgun.network.allocator import IPRangeIndex
+from nailgun.task.helpers import TaskHelper
+from nailgun.task.task import ProvisionTask, DeploymentTask
+from nailgun.test.performance.base import Measure
+from nailgun.test.performance.network_manager import prepare_installation
+from nailgun.test.performance.network_manager import create_nodes
+
+
+VOLUMES = [
+    {
+        "type": "disk", "id": "sda", "size": 1000204886016,
+        "volumes": [
+            {"type": "partition", "mount": "/boot", "size": 209715200},
+            {"type": "mbr"},
+            {"type": "pv", "vg": "os", "size": 999984685056}
+        ]
+    },
+    {
+        "type": "vg", "id": "os",
+        "volumes": [
+            {"type": "lv", "name": "root", "mount": "/",
+             "size": 995689717760},
+            {"type": "lv", "name": "swap", "mount": "swap",
+             "size": 4294967296}
+        ]
+    }
+]
+
+
+def prepare_cluster(nodes_count, nics_count):
+    """
+    Creates cluster with networks which are big enough
+    for all nodes and returns it.
+    """
+    release = prepare_installation(nodes_count * nics_count + 10)
+    netmanager = NetworkManager()
+    cluster = Cluster(
+        name=u"benchmark",
+        release_id=release.id,
+        net_manager="VlanManager"
+    )
+    db().add(cluster)
+    db().commit()
+    attributes = Attributes(
+        editable=release.attributes_metadata.get("editable"),
+        generated=release.attributes_metadata.get("generated"),
+        cluster=cluster
+    )
+    attributes.generate_fields()
+    db().add(attributes)
+    db().commit()
+    netmanager.create_network_groups(cluster.id)
+
+    for n, name in enumerate(("management", "public", "storage")):
+        ng = filter(lambda ng: ng.name == name, cluster.network_groups)[0]
+        cidr = IPNetwork("10.{0}.0.0/20".format(100 + n))
+        ng.cidr = str(cidr)
+        ng.netmask = str(cidr.netmask)
+        ng.network_size = cidr.size
+        db().commit()
+        netmanager.update_ranges_from_cidr(ng, cidr)
+        netmanager.create_networks(ng)
+
+    nodes_ids = create_nodes(cluster, nodes_count, nics_count, 0)
+    db().add_all([
+        NodeAttributes(node_id=node_id, volumes=VOLUMES)
+        for node_id in nodes_ids
+    ])
+    db().commit()
+    nodes = db().query(Node).filter(Node.id.in_(nodes_ids)).all()
+    for i, node in enumerate(nodes):
+        if i < 3:
+            node.role = "controller"
+    db().commit()
+    TaskHelper.update_slave_nodes_fqdn(nodes)
+    return cluster
+
+
+def measure(results, nodes_count, name, call):
+    with Measure() as m:
+        message = call()
+    results.append({
+        "operation": name,
+        "nodes": nodes_count,
+        "queries": m.queries,
+        "seconds": m.seconds,
+        "peak_rss_kb": m.peak_rss,
+        "message_size": len(json.dumps(message))
+    })
+
+
+def run(nodes_counts=(50, 200, 1000), nics_count=2):
+    # nodes are fake, so nothing should be done outside of database
+    settings.update({"FAKE_TASKS": True})
+    results = []
+    for nodes_count in nodes_counts:
+        cluster = prepare_cluster(nodes_count, nics_count)
+        for name, task_class in (("provision", ProvisionTask),
+                                 ("deployment", DeploymentTask)):
+            task = Task(name=name, cluster=cluster)
+            db().add(task)
+            db().commit()
+            measure(
+                results,
+                nodes_count,
+                "{0}.message".format(task_class.__name__),
+                lambda: task_class.message(task)
+            )
+    flush()
+    pools_index.reset()
+    IPRangeIndex.invalidate()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--nodes", dest="nodes", type=int, nargs="+",
+        default=[50, 200, 1000], help="numbers of nodes in cluster"
+    )
+    parser.add_argument(
+        "--output", dest="output", default=None,
+        help="file for JSON results instead of stdout (which gets logs)"
+    )
+    params = parser.parse_args()
+    results = json.dumps(run(params.nodes), indent=4)
+    if params.output:
+        with open(params.output, "w") as output:
+            output.write(results)
+    else:
+        print results
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of NetworkManager on a synthetic installation.
+
+It creates given number of clusters with nodes and NICs and reports
+number of SQL statements, wall time and peak RSS of the process
+for every operation of network allocation hot path.
+
+Usage:
+    python -m nailgun.test.performance.network_manager \\
+        [--clusters 5] [--nodes 50] [--nics 4] [--admin-range-size 1000] \\
+        [--output results.json]
+
+Management network of every cluster is /24, so there can't be
+more than 250 nodes in a cluster.
+
+WARNING: it wipes all data in configured database, just like tests do.
+"""
+
+import os
+import json
+import argparse
+from datetime import datetime
+
+from netaddr import IPNetwork, IPAddress
+
+from nailgun.db import db, flush, syncdb
+from nailgun.api.models import Release, Cluster, Node, NodeNICInterface
+from nailgun.api.models import Network, NetworkGroup, NetworkAssignment
+from nailgun.api.models import IPAddrRange
+from nailgun.fixtures.fixman import upload_fixture
+from nailgun.network.manager import NetworkManager
+from nailgun.network.pools import pools_index
+from nailgun.network.allocator import IPRangeIndex
+from nailgun.test.performance.base import Measure
+
+
+FIXTURES_DIR = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'fixtures'
+)
+
+
+def _mac(i):
+    return "00:%02x:%02x:%02x:%02x:%02x" % tuple(
+        (i >> shift) & 0xff for shift in (32, 24, 16, 8, 0)
+    )
+
+
+def prepare_installation(admin_range_size):
+    syncdb()
+    flush()
+    pools_index.reset()
+    IPRangeIndex.invalidate()
+    for fixture in ('admin_network.json', 'openstack.json'):
+        with open(os.path.join(FIXTURES_DIR, fixture)) as fxtr_file:
+            upload_fixture(fxtr_file)
+
+    # admin range from settings is too small for big installations
+    admin_ng = db().query(NetworkGroup).filter_by(
+        name="fuelweb_admin"
+    ).first()
+    admin_cidr = IPNetwork(admin_ng.cidr)
+    admin_cidr.prefixlen = 16
+    admin_ng.cidr = str(admin_cidr)
+    admin_ng.netmask = str(admin_cidr.netmask)
+    first = IPAddress(admin_cidr.first + 2)
+    db().query(IPAddrRange).filter_by(network_group_id=admin_ng.id).delete()
+    db().add(IPAddrRange(
+        network_group_id=admin_ng.id,
+        first=str(first),
+        last=str(first + admin_range_size - 1)
+    ))
+    db().commit()
+    IPRangeIndex.invalidate(admin_ng.id)
+    return db().query(Release).first()
+
+
+def create_nodes(cluster, nodes_count, nics_count, start):
+    """
+    Creates nodes with NICs in cluster, all cluster networks
+    are assigned to the first NIC of every node.
+    """
+    networks_ids = [ng.id for ng in cluster.network_groups]
+    nodes = []
+    for i in xrange(start, start + nodes_count):
+        interfaces = [
+            {
+                'name': 'eth{0}'.format(n),
+                'mac': _mac(i * nics_count + n),
+                'current_speed': 1000,
+                'max_speed': 1000
+            } for n in xrange(nics_count)
+        ]
+        nodes.append(Node(
+            cluster_id=cluster.id,
+            mac=interfaces[0]['mac'],
+            timestamp=datetime.now(),
+            meta={'interfaces': interfaces},
+            role='compute',
+            pending_addition=True
+        ))
+    db().add_all(nodes)
+    db().commit()
+
+    nics = []
+    for node in nodes:
+        for interface in node.meta['interfaces']:
+            nics.append(NodeNICInterface(node_id=node.id, **interface))
+    db().add_all(nics)
+    db().commit()
+    db().add_all([
+        NetworkAssignment(network_id=ng_id, interface_id=nic.id)
+        for nic in nics if nic.name == 'eth0'
+        for ng_id in networks_ids
+    ])
+    db().commit()
+    return [n.id for n in nodes]
+
+
+def measure(results, name, calls):
+    """
+    Runs calls under Measure and appends result to results.
+
+    :param calls: List of callables, every one of them is one call
+        of measured operation.
+    """
+    with Measure() as m:
+        for call in calls:
+            call()
+    results.append({
+        "operation": name,
+        "calls": len(calls),
+        "queries": m.queries,
+        "seconds": m.seconds,
+        "queries_per_call": float(m.queries) / len(calls) if calls else 0,
+        "seconds_per_call": m.seconds / len(calls) if calls else 0,
+        "peak_rss_kb": m.peak_rss
+    })
+
+
+def run(clusters_count=5, nodes_count=50, nics_count=4,
+        admin_range_size=1000):
+    release = prepare_installation(admin_range_size)
+    netmanager = NetworkManager()
+    results = []
+
+    clusters = [
+        Cluster(name=u"benchmark-{0}".format(i), release_id=release.id)
+        for i in xrange(clusters_count)
+    ]
+    db().add_all(clusters)
+    db().commit()
+    clusters_ids = [c.id for c in clusters]
+
+    measure(results, "create_network_groups", [
+        lambda cluster_id=cluster_id: netmanager.create_network_groups(
+            cluster_id
+        ) for cluster_id in clusters_ids
+    ])
+
+    nodes = {}
+    for n, cluster_id in enumerate(clusters_ids):
+        nodes[cluster_id] = create_nodes(
+            db().query(Cluster).get(cluster_id),
+            nodes_count,
+            nics_count,
+            n * nodes_count
+        )
+    all_nodes = sum(nodes.values(), [])
+
+    measure(results, "assign_admin_ips", [
+        lambda node_id=node_id: netmanager.assign_admin_ips(node_id)
+        for node_id in all_nodes
+    ])
+    measure(results, "assign_ips", [
+        lambda nodes_ids=nodes_ids, name=name: netmanager.assign_ips(
+            nodes_ids, name
+        )
+        for nodes_ids in nodes.itervalues()
+        for name in ("management", "public", "storage")
+    ])
+    measure(results, "assign_vip", [
+        lambda cluster_id=cluster_id, name=name: netmanager.assign_vip(
+            cluster_id, name
+        )
+        for cluster_id in clusters_ids
+        for name in ("management", "public")
+    ])
+    measure(results, "get_node_networks", [
+        lambda node_id=node_id: netmanager.get_node_networks(node_id)
+        for node_id in all_nodes
+    ])
+
+    # leave VLANs of half of clusters without networks
+    db().query(Network).filter(
+        Network.network_group_id.in_(
+            db().query(NetworkGroup.id).filter(
+                NetworkGroup.cluster_id.in_(clusters_ids[::2])
+            ).subquery()
+        )
+    ).delete(synchronize_session=False)
+    db().commit()
+    measure(results, "clear_vlans", [netmanager.clear_vlans])
+
+    flush()
+    pools_index.reset()
+    IPRangeIndex.invalidate()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--clusters", dest="clusters", type=int, default=5,
+        help="number of clusters"
+    )
+    parser.add_argument(
+        "--nodes", dest="nodes", type=int, default=50,
+        help="number of nodes in every cluster"
+    )
+    parser.add_argument(
+        "--nics", dest="nics", type=int, default=4,
+        help="number of NICs of every node"
+    )
+    parser.add_argument(
+        "--admin-range-size", dest="admin_range_size", type=int,
+        default=1000, help="number of IP addresses in admin range"
+    )
+    parser.add_argument(
+        "--output", dest="output", default=None,
+        help="file for JSON results instead of stdout (which gets logs)"
+    )
+    params = parser.parse_args()
+    results = json.dumps(
+        run(params.clusters, params.nodes, params.nics,
+            params.admin_range_size),
+        indent=4
+    )
+    if params.output:
+        with open(params.output, "w") as output:
+            output.write(results)
+    else:
+        print results
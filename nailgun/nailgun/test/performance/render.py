@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of rendering objects by handlers fields.
+
+Compares rows per second of reflective rendering (how
+JSONHandler.render worked before, looking up kind of every field
+for every row) and of precompiled serializers. Objects aren't
+stored in database, so only serialization itself is measured;
+network data of nodes isn't rendered.
+
+Usage:
+    python -m nailgun.test.performance.render \\
+        [--rows 10000] [--output results.json]
+"""
+
+import json
+import argparse
+from datetime import datetime
+
+from nailgun.api.models import Cluster, Node, Notification
+from nailgun.api.handlers.base import handlers, JSONHandler
+from nailgun.api.handlers.node import NodeHandler
+from nailgun.api.handlers.notifications import NotificationHandler
+from nailgun.test.performance.base import Measure
+
+
+def render_reflective(instance, fields):
+    json_data = {}
+    for field in fields:
+        if isinstance(field, (tuple,)):
+            subfields = None if field[1] == '*' else field[1:]
+            value = getattr(instance, field[0])
+            rel = getattr(
+                instance.__class__, field[0]).impl.__class__.__name__
+            if value is None:
+                pass
+            elif rel == 'ScalarObjectAttributeImpl':
+                handler = handlers[value.__class__.__name__]
+                json_data[field[0]] = handler.render(value, fields=subfields)
+            elif rel == 'CollectionAttributeImpl':
+                json_data[field[0]] = [
+                    handlers[v.__class__.__name__].render(
+                        v, fields=subfields
+                    ) for v in value
+                ]
+        else:
+            value = getattr(instance, field)
+            if value is None:
+                json_data[field] = value
+            else:
+                f = getattr(instance.__class__, field)
+                rel = f.impl.__class__.__name__ \
+                    if hasattr(f, "impl") else None
+                if rel == 'ScalarObjectAttributeImpl':
+                    json_data[field] = value.id
+                elif rel == 'CollectionAttributeImpl':
+                    json_data[field] = [v.id for v in value]
+                else:
+                    json_data[field] = value
+    return json_data
+
+
+def create_objects(rows):
+    cluster = Cluster(id=1, name=u"benchmark")
+    nodes = [
+        Node(id=n, name=u"node-{0}".format(n), meta={}, role="compute",
+             progress=0, status="discover", mac="00:00:00:00:00:00",
+             fqdn="node-{0}.domain.tld".format(n), ip="10.20.0.3",
+             manufacturer="KVM", platform_name="x86_64",
+             pending_addition=False, pending_deletion=False,
+             online=True, cluster=cluster)
+        for n in xrange(rows)
+    ]
+    notifications = [
+        Notification(id=n, cluster=cluster, topic="discover",
+                     message=u"New node is discovered", status="unread",
+                     datetime=datetime.now())
+        for n in xrange(rows)
+    ]
+    return nodes, notifications
+
+
+def measure(results, name, objects, render):
+    with Measure() as m:
+        for instance in objects:
+            render(instance)
+    results.append({
+        "operation": name,
+        "rows": len(objects),
+        "seconds": m.seconds,
+        "rows_per_second": len(objects) / m.seconds if m.seconds else None
+    })
+
+
+def run(rows=10000):
+    results = []
+    nodes, notifications = create_objects(rows)
+    for name, objects, handler in (
+            ("node", nodes, NodeHandler),
+            ("notification", notifications, NotificationHandler)):
+        measure(
+            results, "{0}.reflective".format(name), objects,
+            lambda instance: render_reflective(instance, handler.fields)
+        )
+        measure(
+            results, "{0}.compiled".format(name), objects,
+            lambda instance: JSONHandler.render(instance, handler.fields)
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rows", dest="rows", type=int, default=10000,
+        help="number of nodes and notifications to render"
+    )
+    parser.add_argument(
+        "--output", dest="output", default=None,
+        help="file for JSON results instead of stdout (which gets logs)"
+    )
+    params = parser.parse_args()
+    results = json.dumps(run(params.rows), indent=4)
+    if params.output:
+        with open(params.output, "w") as output:
+            output.write(results)
+    else:
+        print results
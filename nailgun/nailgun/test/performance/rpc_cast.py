@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of sending messages to orchestrator.
+
+Compares casts per second of a new connection for every message
+(how rpc.cast worked before), pooled producers and batch publishing
+of all messages over one channel. In-memory kombu transport is used
+as a broker, so only client side overhead is measured; with real
+broker every new connection also costs network round trips.
+
+Usage:
+    python -m nailgun.test.performance.rpc_cast \\
+        [--casts 1000] [--url memory://] [--output results.json]
+"""
+
+import json
+import argparse
+
+from kombu import Connection
+
+import nailgun.rpc as rpc
+from nailgun.rpc.producer import Publisher
+from nailgun.test.performance.base import Measure
+
+
+MESSAGE = {
+    'method': 'verify_networks',
+    'respond_to': 'verify_networks_resp',
+    'args': {
+        'task_uuid': '00000000-0000-0000-0000-000000000000',
+        'nodes': [
+            {'uid': n, 'networks': [{'iface': 'eth0', 'vlans': [100, 101]}]}
+            for n in xrange(10)
+        ]
+    }
+}
+
+
+def cast_with_new_connection(url, message):
+    with Connection(url) as conn:
+        with conn.Producer(serializer='json') as producer:
+            producer.publish(message,
+                             exchange=rpc.naily_exchange,
+                             routing_key='naily',
+                             declare=[rpc.naily_queue])
+
+
+def drain(url):
+    with Connection(url) as conn:
+        conn.SimpleQueue(rpc.naily_queue).clear()
+
+
+def measure(results, name, casts, call):
+    with Measure() as m:
+        call()
+    results.append({
+        "operation": name,
+        "casts": casts,
+        "seconds": m.seconds,
+        "casts_per_second": casts / m.seconds if m.seconds else None
+    })
+
+
+def run(casts=1000, url='memory://'):
+    results = []
+    publisher = Publisher(url)
+
+    def new_connections():
+        for _ in xrange(casts):
+            cast_with_new_connection(url, MESSAGE)
+
+    def pooled():
+        for _ in xrange(casts):
+            publisher.publish([MESSAGE], rpc.naily_exchange, 'naily',
+                              declare=[rpc.naily_queue])
+
+    def batch():
+        publisher.publish((MESSAGE for _ in xrange(casts)),
+                          rpc.naily_exchange, 'naily',
+                          declare=[rpc.naily_queue])
+
+    for name, call in (("new_connection", new_connections),
+                       ("pooled", pooled),
+                       ("batch", batch)):
+        drain(url)
+        measure(results, name, casts, call)
+    drain(url)
+    publisher.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--casts", dest="casts", type=int, default=1000,
+        help="number of messages to send"
+    )
+    parser.add_argument(
+        "--url", dest="url", default="memory://",
+        help="broker URL"
+    )
+    parser.add_argument(
+        "--output", dest="output", default=None,
+        help="file for JSON results instead of stdout (which gets logs)"
+    )
+    params = parser.parse_args()
+    results = json.dumps(run(params.casts, params.url), indent=4)
+    if params.output:
+        with open(params.output, "w") as output:
+            output.write(results)
+    else:
+        print results
@@ -32,6 +32,7 @@ from nailgun.api.models import Cluster, Attributes, IPAddr, Task
 from nailgun.api.models import Network, NetworkGroup, IPAddrRange
 from nailgun.network.manager import NetworkManager
 from nailgun.task import task as tasks
+from nailgun.rpc.chunks import join_chunks
 
 
 class TestHandlers(BaseHandlers):
@@ -326,6 +327,138 @@ class TestHandlers(BaseHandlers):
         nailgun.task.manager.rpc.cast.assert_called_with(
             'naily', VlanMatcher())
 
+    @fake_tasks(fake_rpc=False, mock_rpc=False)
+    @patch('nailgun.rpc.cast')
+    @patch('nailgun.task.task.settings.COMPACT_FLOATING_RANGES', True)
+    def test_deploy_cast_with_compact_floating_ranges(self, mocked_rpc):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"role": "controller", "pending_addition": True},
+            ]
+        )
+        floating_network_group = self.db.query(NetworkGroup).filter(
+            NetworkGroup.name == 'floating').filter(
+                NetworkGroup.cluster_id == self.env.clusters[0].id).first()
+        self.db.query(IPAddrRange).filter(
+            IPAddrRange.network_group_id == floating_network_group.id).delete()
+        for first, last in (('240.0.0.2', '240.0.0.4'),
+                            ('240.0.0.3', '240.0.0.5'),
+                            ('240.0.0.10', '240.0.0.12'),
+                            ('240.0.1.0', '240.0.255.255')):
+            self.db.add(IPAddrRange(
+                first=first,
+                last=last,
+                network_group_id=floating_network_group.id))
+        self.db.commit()
+
+        self.env.launch_deployment()
+
+        messages = nailgun.task.manager.rpc.cast.call_args[0][1]
+        message = filter(lambda m: m['method'] == 'deploy', messages)[0]
+        self.assertEquals(
+            message['args']['attributes']['floating_network_range'],
+            [
+                {'first': '240.0.0.2', 'last': '240.0.0.5', 'count': 4},
+                {'first': '240.0.0.10', 'last': '240.0.0.12', 'count': 3},
+                {'first': '240.0.1.0', 'last': '240.0.255.255',
+                 'count': 65280}
+            ]
+        )
+
+    @fake_tasks(fake_rpc=False, mock_rpc=False)
+    @patch('nailgun.rpc.cast')
+    @patch('nailgun.task.manager.settings.DEPLOY_MESSAGE_CHUNK_SIZE', 2)
+    def test_deploy_cast_with_chunked_messages(self, mocked_rpc):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"role": "controller", "pending_addition": True},
+                {"role": "compute", "pending_addition": True},
+                {"role": "compute", "pending_addition": True},
+            ]
+        )
+        nodes_ids = sorted(n.id for n in self.env.nodes)
+
+        supertask = self.env.launch_deployment()
+
+        messages = list(nailgun.task.manager.rpc.cast.call_args[0][1])
+        self.assertEquals(
+            [m['method'] for m in messages],
+            ['provision', 'provision_chunk', 'provision_chunk',
+             'deploy', 'deploy_chunk', 'deploy_chunk']
+        )
+        for message in messages:
+            if 'chunks' in message['args']:
+                self.assertEquals(message['args']['nodes'], [])
+                self.assertEquals(
+                    message['args']['chunks'],
+                    {'count': 2, 'size': 2, 'nodes': 3}
+                )
+
+        joined = join_chunks(messages)
+        self.assertEquals(
+            [m['method'] for m in joined], ['provision', 'deploy']
+        )
+        self.assertEquals(
+            sorted(n['uid'] for n in joined[1]['args']['nodes']),
+            nodes_ids
+        )
+        self.assertEquals(
+            sorted(n['name'] for n in joined[0]['args']['nodes']),
+            sorted(
+                TaskHelper.make_slave_name(n.id, n.role)
+                for n in self.env.nodes
+            )
+        )
+
+        deploy_task = filter(
+            lambda t: t.name == 'deployment', supertask.subtasks
+        )[0]
+        self.assertEquals(
+            sorted(n['uid'] for n in deploy_task.cache['args']['nodes']),
+            nodes_ids
+        )
+
+    @fake_tasks(fake_rpc=False, mock_rpc=False)
+    @patch('nailgun.rpc.cast')
+    @patch('nailgun.task.helpers.settings.MESSAGE_RENDER_BATCH_SIZE', 1)
+    @patch('nailgun.task.helpers.settings.MESSAGE_RENDER_WORKERS', 3)
+    def test_deploy_cast_with_nodes_rendered_in_batches(self, mocked_rpc):
+        self.env.create(
+            cluster_kwargs={
+                'net_manager': 'VlanManager',
+            },
+            nodes_kwargs=[
+                {"role": "controller", "pending_addition": True},
+                {"role": "compute", "pending_addition": True},
+                {"role": "compute", "pending_addition": True},
+                {"role": "cinder", "pending_addition": True},
+            ]
+        )
+        supertask = self.env.launch_deployment()
+
+        messages = nailgun.task.manager.rpc.cast.call_args[0][1]
+        provision_message, deploy_message = messages
+        self.assertEquals(
+            [n['name'] for n in provision_message['args']['nodes']],
+            [
+                TaskHelper.make_slave_name(n.id, n.role)
+                for n in sorted(self.env.nodes, key=lambda n: n.id)
+            ]
+        )
+
+        deploy_task = filter(
+            lambda t: t.name == 'deployment', supertask.subtasks
+        )[0]
+        nodes_ids = [n['uid'] for n in deploy_message['args']['nodes']]
+        with patch('nailgun.task.helpers.settings.'
+                   'MESSAGE_RENDER_WORKERS', 1):
+            self.assertEquals(
+                tasks.DeploymentTask.format_nodes(deploy_task, nodes_ids),
+                deploy_message['args']['nodes']
+            )
+
     @fake_tasks(fake_rpc=False, mock_rpc=False)
     @patch('nailgun.rpc.cast')
     def test_deploy_and_remove_correct_nodes_and_statuses(self, mocked_rpc):
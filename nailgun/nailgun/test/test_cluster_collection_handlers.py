@@ -24,6 +24,7 @@ from sqlalchemy.sql import not_
 from nailgun.api.models import Cluster, Release
 from nailgun.api.models import Network, NetworkGroup
 from nailgun.api.models import Network, NetworkGroup, NetworkConfiguration
+from nailgun import profiler
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 
@@ -38,6 +39,27 @@ class TestHandlers(BaseHandlers):
         response = json.loads(resp.body)
         self.assertEquals([], response)
 
+    def test_cluster_list_queries_dont_depend_on_clusters_number(self):
+        def get_clusters():
+            profiler.start()
+            try:
+                resp = self.app.get(
+                    reverse('ClusterCollectionHandler'),
+                    headers=self.default_headers
+                )
+            finally:
+                report = profiler.stop()
+            return len(json.loads(resp.body)), report['queries']
+
+        self.env.create_cluster(api=True)
+        clusters, queries = get_clusters()
+        self.assertEquals(clusters, 1)
+
+        for _ in xrange(3):
+            self.env.create_cluster(api=True)
+        self.db.expunge_all()
+        self.assertEquals(get_clusters(), (4, queries))
+
     def test_cluster_create(self):
         release_id = self.env.create_release(api=False).id
         resp = self.app.post(
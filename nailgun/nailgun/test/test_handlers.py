@@ -16,7 +16,16 @@
 
 import unittest
 import json
+from gzip import GzipFile
+from StringIO import StringIO
 
+from mock import patch
+
+from nailgun.stats import counters
+from nailgun.settings import settings
+from nailgun.api.models import Cluster
+from nailgun.api.models import Task
+from nailgun.api.handlers.base import JSONHandler
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 
@@ -38,3 +47,59 @@ class TestHandlers(BaseHandlers):
             self.assertTrue(resp.status in [404, 405])
             resp = self.app.post(test_url, expect_errors=True)
             self.assertTrue(resp.status in [404, 405])
+
+    def test_render_fields(self):
+        task = Task(id=2, name='deploy', cluster=Cluster(id=1))
+        subtask = Task(id=3, name='deployment', parent=task)
+        self.assertEquals(
+            JSONHandler.render(
+                task, fields=('id', 'name', 'cluster', 'subtasks', 'parent')
+            ),
+            {'id': 2, 'name': 'deploy', 'cluster': 1,
+             'subtasks': [3], 'parent': None}
+        )
+        self.assertEquals(
+            JSONHandler.render(
+                task, fields=(('subtasks', 'id', 'name'), ('parent', '*'))
+            ),
+            {'subtasks': [{'id': 3, 'name': 'deployment'}]}
+        )
+        self.assertEquals(
+            JSONHandler.render(subtask, fields=(('parent', 'id'),)),
+            {'parent': {'id': 2}}
+        )
+
+    def test_json_is_compact_unless_pretty_requested(self):
+        self.env.create_release(api=False)
+        url = reverse('ReleaseCollectionHandler')
+        compact = self.app.get(url, headers=self.default_headers)
+        pretty = self.app.get(url + '?pretty=1', headers=self.default_headers)
+        self.assertNotIn('\n', compact.body)
+        self.assertIn('\n    ', pretty.body)
+        self.assertEquals(json.loads(compact.body), json.loads(pretty.body))
+
+    def test_large_responses_are_gzipped(self):
+        self.env.create_release(api=False)
+        url = reverse('ReleaseCollectionHandler')
+        counters.reset()
+        with patch.dict(settings.config, {'API_GZIP_MIN_SIZE': 1}):
+            plain = self.app.get(url, headers=self.default_headers)
+            headers = dict(self.default_headers)
+            headers['Accept-Encoding'] = 'deflate, gzip;q=0.5'
+            gzipped = self.app.get(url, headers=headers)
+            headers['Accept-Encoding'] = 'gzip;q=0'
+            refused = self.app.get(url, headers=headers)
+
+        self.assertNotIn('content-encoding', plain.header_dict)
+        self.assertNotIn('content-encoding', refused.header_dict)
+        self.assertEquals(gzipped.header_dict['content-encoding'], 'gzip')
+        body = GzipFile(fileobj=StringIO(gzipped.body)).read()
+        self.assertEquals(body, plain.body)
+
+        name = 'api_ReleaseCollectionHandler.GET'
+        self.assertEquals(counters.get(name + '_encode_calls'), 3)
+        self.assertEquals(counters.get(name + '_bytes'), len(body) * 3)
+        self.assertEquals(
+            counters.get(name + '_sent_bytes'),
+            len(body) * 2 + len(gzipped.body)
+        )
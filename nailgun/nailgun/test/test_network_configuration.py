@@ -18,10 +18,11 @@ import json
 
 from sqlalchemy.sql import not_
 
-from nailgun.api.models import Network, NetworkGroup
+from nailgun.api.models import Network, NetworkGroup, Vlan
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 from nailgun.settings import settings
+from nailgun.stats import counters
 from nailgun.api.models import Cluster
 
 
@@ -142,3 +143,32 @@ class TestNetworkConfigurationHandler(BaseHandlers):
             task['message'],
             'Invalid network ID: 500'
         )
+
+    def test_fixed_networks_regeneration_for_vlan_manager(self):
+        fixed = self.db.query(NetworkGroup).filter_by(
+            cluster_id=self.cluster.id, name="fixed"
+        ).first()
+        old_vlan = fixed.vlan_start
+        calls = counters.get('create_networks_calls')
+
+        resp = self.put(self.cluster.id, {
+            'net_manager': 'VlanManager',
+            'networks': [{
+                'id': fixed.id,
+                'name': 'fixed',
+                'cidr': '10.0.0.0/16',
+                'network_size': 256,
+                'amount': 100,
+                'vlan_start': 500
+            }]
+        })
+        self.assertEquals(resp.status, 202)
+        self.assertEquals(counters.get('create_networks_calls'), calls + 1)
+
+        self.db.refresh(fixed)
+        self.assertEquals(len(fixed.networks), 100)
+        networks = sorted(fixed.networks, key=lambda n: n.id)
+        self.assertEquals([n.vlan_id for n in networks], range(500, 600))
+        self.assertEquals(networks[99].cidr, '10.0.99.0/24')
+        # VLAN of old network is removed as it isn't used anymore
+        self.assertIsNone(self.db.query(Vlan).get(old_vlan))
@@ -18,15 +18,21 @@ import json
 import itertools
 
 from mock import Mock, patch
-from netaddr import IPNetwork, IPAddress, IPRange
+from netaddr import IPNetwork, IPAddress, IPRange, IPSet
 
 import nailgun
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 from nailgun.errors import errors
 from nailgun.api.models import Node, IPAddr, Vlan, IPAddrRange
-from nailgun.api.models import Network, NetworkGroup
+from nailgun.api.models import Network, NetworkGroup, NodeNICInterface
 from nailgun.settings import settings
+from nailgun.stats import counters
+from nailgun.network.allocator import IPAllocator, IPRangeIndex
+from nailgun.network.allocator import compact_ranges, expand_ranges
+from nailgun.network.manager import NetworkManager
+from nailgun.network.pools import pools_index
+from nailgun.test.performance.base import Measure
 from nailgun.test.base import fake_tasks
 
 
@@ -313,3 +319,303 @@ class TestNetworkManager(BaseHandlers):
             ),
             itertools.product((0, 1), ('eth0', 'eth1'))
         )
+
+    def test_get_free_ips_skips_used_ips_and_gateway(self):
+        cluster = self.env.create_cluster(api=True)
+        management_net = self.db.query(Network).join(NetworkGroup).\
+            filter(NetworkGroup.cluster_id == cluster['id']).filter_by(
+                name='management').first()
+        ng = management_net.network_group
+        ng.gateway = '192.168.0.2'
+        self.db.add(IPAddr(network=management_net.id, ip_addr='192.168.0.3'))
+        self.db.commit()
+
+        free_ips = self.env.network_manager.get_free_ips(ng.id, num=2)
+        self.assertEquals(free_ips, ['192.168.0.4', '192.168.0.5'])
+
+    def test_get_free_ips_out_of_ips(self):
+        admin_net_id = self.env.network_manager.get_admin_network_id()
+        admin_ng = self.db.query(Network).get(admin_net_id).network_group
+        self.assertRaises(
+            errors.OutOfIPs,
+            self.env.network_manager.get_free_ips,
+            admin_ng.id,
+            num=1000
+        )
+
+    def test_ip_allocator_merges_ranges(self):
+        allocator = IPAllocator(
+            [('10.0.0.5', '10.0.0.7'), ('10.0.0.1', '10.0.0.5')],
+            used=['10.0.0.2', '10.0.0.100'],
+            exclude=['10.0.0.1']
+        )
+        self.assertEquals(allocator.free_count(), 5)
+        self.assertEquals(allocator.allocate(2), ['10.0.0.3', '10.0.0.4'])
+        self.assertEquals(allocator.allocate(), ['10.0.0.5'])
+        self.assertEquals(allocator.free_count(), 2)
+        self.assertRaises(errors.OutOfIPs, allocator.allocate, 3)
+
+    def test_bulk_assign_ips_is_idempotent(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True},
+                {"pending_addition": True},
+                {"pending_addition": True}
+            ]
+        )
+        nodes_ids = [n.id for n in self.env.nodes]
+        networks = ["management", "public", "storage"]
+        self.env.network_manager.bulk_assign_ips(nodes_ids, networks)
+
+        def get_ips():
+            return sorted(
+                (ip.node, ip.network, ip.ip_addr)
+                for ip in self.db.query(IPAddr).filter(
+                    IPAddr.node.in_(nodes_ids)
+                )
+            )
+
+        ips = get_ips()
+        self.assertEquals(len(ips), len(nodes_ids) * len(networks))
+        self.assertEquals(len(set(ip[2] for ip in ips)), len(ips))
+
+        self.env.network_manager.bulk_assign_ips(nodes_ids, networks)
+        self.env.network_manager.assign_ips(nodes_ids, "management")
+        self.assertEquals(get_ips(), ips)
+
+    def test_bulk_assign_ips_fails_for_nodes_from_different_clusters(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"pending_addition": True}]
+        )
+        node = self.env.create_node(api=False)
+        self.assertRaises(
+            Exception,
+            self.env.network_manager.bulk_assign_ips,
+            [self.env.nodes[0].id, node.id],
+            ["management"]
+        )
+        self.assertEquals(self.db.query(IPAddr).count(), 0)
+
+    def test_network_groups_skip_nets_used_behind_pools_index(self):
+        cluster1 = self.env.create_cluster(api=True)
+        nets1 = self.db.query(Network).join(NetworkGroup).filter(
+            NetworkGroup.cluster_id == cluster1['id']
+        ).all()
+        # make index stale: it considers used CIDRs and VLANs as free
+        pools_index.release(
+            cidrs=[n.cidr for n in nets1],
+            vlans=[n.vlan_id for n in nets1]
+        )
+
+        cluster2 = self.env.create_cluster(api=True)
+        nets2 = self.db.query(Network).join(NetworkGroup).filter(
+            NetworkGroup.cluster_id == cluster2['id']
+        ).all()
+
+        cidrs1 = IPSet([n.cidr for n in nets1])
+        for net in nets2:
+            self.assertFalse(IPSet([net.cidr]) & cidrs1)
+        self.assertFalse(
+            set(n.vlan_id for n in nets1) & set(n.vlan_id for n in nets2)
+        )
+
+    def test_failed_network_groups_creation_releases_reservations(self):
+        self.env.create_cluster(api=True)
+        free_vlans = list(pools_index._free_vlans)
+        free_nets = dict(
+            (access, nets.copy())
+            for access, nets in pools_index._free_nets.iteritems()
+        )
+
+        create_network_group = NetworkManager._create_network_group
+        calls = []
+
+        def fail_third_group(*args):
+            calls.append(args)
+            if len(calls) > 2:
+                raise errors.OutOfIPs()
+            return create_network_group(*args)
+
+        with patch.object(NetworkManager, '_create_network_group',
+                          autospec=True, side_effect=fail_third_group):
+            resp = self.app.post(
+                reverse('ClusterCollectionHandler'),
+                json.dumps({
+                    'name': 'cluster-without-ips',
+                    'release': self.env.create_release(api=False).id
+                }),
+                headers=self.default_headers,
+                expect_errors=True
+            )
+        self.assertEquals(resp.status, 400)
+        self.assertEquals(len(calls), 3)
+        self.assertEquals(pools_index._free_vlans, free_vlans)
+        self.assertEquals(pools_index._free_nets, free_nets)
+
+    def test_get_nodes_networks_fixed_number_of_queries(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"pending_addition": True} for _ in xrange(4)]
+        )
+        nodes_ids = [n.id for n in self.env.nodes]
+        self.env.network_manager.bulk_assign_ips(
+            nodes_ids,
+            ["management", "public", "storage"]
+        )
+
+        with Measure() as one_node:
+            self.env.network_manager.get_nodes_networks(nodes_ids[:1])
+        with Measure() as all_nodes:
+            nodes_networks = self.env.network_manager.get_nodes_networks(
+                nodes_ids
+            )
+        self.assertEquals(one_node.queries, all_nodes.queries)
+
+        self.assertEquals(sorted(nodes_networks.keys()), sorted(nodes_ids))
+        for node_id in nodes_ids:
+            network_data = nodes_networks[node_id]
+            self.assertEquals(
+                network_data,
+                self.env.network_manager.get_node_networks(node_id)
+            )
+            management = filter(
+                lambda net: net['name'] == 'management', network_data
+            )[0]
+            ip = IPNetwork(management['ip'])
+            self.assertEquals(management['netmask'], str(ip.netmask))
+            self.assertEquals(management['brd'], str(ip.broadcast))
+            self.assertEquals(network_data[-1]['name'], 'admin')
+
+    def test_compact_ranges_expand_to_the_same_ips(self):
+        ranges = [
+            ('192.168.0.10', '192.168.0.12'),
+            ('192.168.0.2', '192.168.0.4'),
+            ('192.168.0.3', '192.168.0.5')
+        ]
+        compact = compact_ranges(ranges)
+        self.assertEquals(
+            compact,
+            [
+                {'first': '192.168.0.2', 'last': '192.168.0.5', 'count': 4},
+                {'first': '192.168.0.10', 'last': '192.168.0.12', 'count': 3}
+            ]
+        )
+        expanded = set()
+        for first, last in ranges:
+            expanded.update(str(ip) for ip in IPRange(first, last))
+        self.assertEquals(list(expand_ranges(compact)),
+                          sorted(expanded, key=IPAddress))
+        self.assertEquals(list(expand_ranges(ranges)),
+                          list(expand_ranges(compact)))
+
+    def test_ip_range_index_is_invalidated_on_ranges_update(self):
+        cluster = self.env.create_cluster(api=True)
+        network = self.db.query(Network).join(NetworkGroup).filter(
+            NetworkGroup.cluster_id == cluster['id']
+        ).filter_by(name='floating').first()
+        network_group_id = network.network_group_id
+        netmanager = self.env.network_manager
+
+        self.assertTrue(netmanager.check_ip_belongs_to_net(
+            '240.0.0.130', network))
+        self.assertFalse(netmanager.check_ip_belongs_to_net(
+            '240.0.1.2', network))
+
+        resp = self.app.put(
+            reverse(
+                'NetworkConfigurationHandler',
+                kwargs={'cluster_id': cluster['id']}),
+            json.dumps({'networks': [{
+                'id': network_group_id,
+                'ip_ranges': [['240.0.0.10', '240.0.0.20'],
+                              ['240.0.0.21', '240.0.0.30']]
+            }]}),
+            headers=self.default_headers
+        )
+        self.assertEquals(resp.status, 202)
+
+        # networks of network group are recreated on update
+        network = self.db.query(Network).filter_by(
+            network_group_id=network_group_id
+        ).first()
+        self.assertTrue(netmanager.check_ip_belongs_to_net(
+            '240.0.0.25', network))
+        self.assertFalse(netmanager.check_ip_belongs_to_net(
+            '240.0.0.130', network))
+        self.assertEquals(
+            IPRangeIndex.for_network_group(network_group_id).ranges,
+            [(int(IPAddress('240.0.0.10')), int(IPAddress('240.0.0.30')))]
+        )
+
+    def test_update_interfaces_info_writes_only_changes(self):
+        meta = self.env.generate_interfaces_in_meta(3)
+        node = self.env.create_node(api=True, meta=meta)
+        node_db = self.db.query(Node).get(node['id'])
+        netmanager = self.env.network_manager
+
+        noop = counters.get('nics_check_ins_noop')
+        with Measure() as m:
+            self.assertFalse(netmanager.update_interfaces_info(node['id']))
+        self.assertEquals(counters.get('nics_check_ins_noop'), noop + 1)
+        # node and its NICs are fetched, nothing is written
+        self.assertEquals(m.queries, 2)
+
+        interfaces = meta['interfaces']
+        interfaces[0]['current_speed'] = 10
+        new_nic = self.env.generate_interfaces_in_meta(1)['interfaces'][0]
+        node_db.meta = dict(node_db.meta, interfaces=[
+            interfaces[0], interfaces[1], new_nic
+        ])
+        self.db.commit()
+
+        changed = counters.get('nics_check_ins_changed')
+        self.assertTrue(netmanager.update_interfaces_info(node['id']))
+        self.assertEquals(counters.get('nics_check_ins_changed'), changed + 1)
+
+        nics = dict(
+            (nic.mac, nic) for nic in self.db.query(
+                NodeNICInterface
+            ).filter_by(node_id=node['id'])
+        )
+        self.assertEquals(
+            sorted(nics.keys()),
+            sorted([interfaces[0]['mac'], interfaces[1]['mac'],
+                    new_nic['mac']])
+        )
+        self.assertEquals(nics[interfaces[0]['mac']].current_speed, 10)
+
+    def test_bulk_assign_admin_ips(self):
+        nodes = [self.env.create_node(api=False) for _ in xrange(3)]
+        netmanager = self.env.network_manager
+        netmanager.assign_admin_ips(nodes[0].id, 1)
+        ips_left = netmanager.get_admin_ips_left()
+
+        nodes_ips = netmanager.bulk_assign_admin_ips(
+            dict((node.id, 2) for node in nodes)
+        )
+        self.assertEquals(sorted(nodes_ips.keys()),
+                          sorted(n.id for n in nodes))
+        all_ips = sum(nodes_ips.values(), [])
+        self.assertEquals(len(all_ips), 6)
+        self.assertEquals(len(set(all_ips)), 6)
+        self.assertEquals(netmanager.get_admin_ips_left(), ips_left - 5)
+
+        admin_net_id = netmanager.get_admin_network_id()
+        for node in nodes:
+            self.assertEquals(
+                sorted(nodes_ips[node.id]),
+                sorted(ip.ip_addr for ip in self.db.query(IPAddr).filter_by(
+                    node=node.id, network=admin_net_id))
+            )
+
+        with Measure() as m:
+            self.assertEquals(
+                netmanager.bulk_assign_admin_ips(
+                    dict((node.id, 2) for node in nodes)
+                ),
+                nodes_ips
+            )
+        # nothing to assign: admin network and node IPs are fetched
+        self.assertEquals(m.queries, 2)
@@ -45,3 +45,12 @@ class TestHandlers(BaseHandlers):
         stats = self._get_allocation_stats()
         self.assertEquals(stats['total'], 2)
         self.assertEquals(stats['unallocated'], 1)
+
+    def test_allocation_stats_admin_ips_left(self):
+        ips_left = self._get_allocation_stats()['admin_ips_left']
+        self.assertTrue(ips_left > 0)
+
+        node = self.env.create_node(api=False)
+        self.env.network_manager.assign_admin_ips(node.id, 2)
+        stats = self._get_allocation_stats()
+        self.assertEquals(stats['admin_ips_left'], ips_left - 2)
@@ -18,12 +18,38 @@ import json
 
 from paste.fixture import TestApp
 
+from nailgun import profiler
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 from nailgun.api.models import Node, Notification
 
 
 class TestHandlers(BaseHandlers):
+
+    def count_queries(self, url, **kwargs):
+        profiler.start()
+        try:
+            resp = self.app.get(url, headers=self.default_headers, **kwargs)
+        finally:
+            report = profiler.stop()
+        self.assertEquals(200, resp.status)
+        return len(json.loads(resp.body)), report['queries']
+
+    def test_node_list_queries_dont_depend_on_nodes_number(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"api": True}, {"api": True}]
+        )
+        cluster_id = self.env.clusters[0].id
+        url = reverse('NodeCollectionHandler')
+        nodes, queries = self.count_queries(url)
+        self.assertEquals(nodes, 2)
+
+        for _ in xrange(3):
+            self.env.create_node(api=True, cluster_id=cluster_id)
+        self.db.expunge_all()
+        self.assertEquals(self.count_queries(url), (5, queries))
+
     def test_node_list_empty(self):
         resp = self.app.get(
             reverse('NodeCollectionHandler'),
@@ -33,6 +59,113 @@ class TestHandlers(BaseHandlers):
         response = json.loads(resp.body)
         self.assertEquals([], response)
 
+    def test_node_list_filters_fields_and_paging(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"role": "controller", "online": True},
+                {"role": "compute", "online": False},
+                {"role": "compute", "online": True,
+                 "pending_addition": True},
+                {"role": "cinder", "online": True},
+            ]
+        )
+        ids = sorted(n.id for n in self.env.nodes)
+        url = reverse('NodeCollectionHandler')
+
+        def get(query):
+            resp = self.app.get(url + '?' + query,
+                                headers=self.default_headers)
+            self.assertEquals(200, resp.status)
+            return resp, json.loads(resp.body)
+
+        resp, nodes = get('role=compute,cinder&online=1&fields=id,role')
+        self.assertEquals(
+            sorted(nodes),
+            sorted([{'id': ids[2], 'role': 'compute'},
+                    {'id': ids[3], 'role': 'cinder'}])
+        )
+        resp, nodes = get('pending_addition=true&fields=id,cluster')
+        self.assertEquals(
+            nodes, [{'id': ids[2], 'cluster': self.env.clusters[0].id}]
+        )
+
+        resp, nodes = get('limit=2&offset=1&fields=id')
+        self.assertEquals(nodes, [{'id': ids[1]}, {'id': ids[2]}])
+        self.assertEquals(resp.header_dict['x-total-count'], '4')
+        resp, nodes = get('after={0}&limit=2'.format(ids[2]))
+        self.assertEquals([n['id'] for n in nodes], [ids[3]])
+        self.assertIn('network_data', nodes[0])
+
+        for query in ('fields=id,interfaces', 'online=yes',
+                      'role=unknown', 'limit=-1'):
+            resp = self.app.get(url + '?' + query,
+                                headers=self.default_headers,
+                                expect_errors=True)
+            self.assertEquals(400, resp.status)
+
+    def test_node_list_is_not_modified_until_nodes_change(self):
+        self.env.create(cluster_kwargs={}, nodes_kwargs=[{"api": True}])
+        url = reverse('NodeCollectionHandler')
+        resp = self.app.get(url, headers=self.default_headers)
+        tag = resp.header_dict['etag']
+
+        headers = dict(self.default_headers)
+        headers['If-None-Match'] = tag
+        profiler.start()
+        try:
+            resp = self.app.get(url, headers=headers)
+        finally:
+            report = profiler.stop()
+        self.assertEquals(304, resp.status)
+        self.assertEquals(0, report['queries'])
+
+        resp = self.app.get(url + '?fields=id', headers=headers)
+        self.assertEquals(200, resp.status)
+
+        # bulk update bypasses ORM, but is seen after commit
+        self.db.query(Node).update({'progress': 50},
+                                   synchronize_session=False)
+        resp = self.app.get(url, headers=headers)
+        self.assertEquals(304, resp.status)
+        self.db.commit()
+        resp = self.app.get(url, headers=headers)
+        self.assertEquals(200, resp.status)
+        self.assertNotEquals(resp.header_dict['etag'], tag)
+        self.assertEquals(json.loads(resp.body)[0]['progress'], 50)
+
+    def test_node_list_is_not_modified_by_agent_check_in(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"api": True}, {"api": True}]
+        )
+        url = reverse('NodeCollectionHandler')
+
+        def check_in():
+            resp = self.app.put(
+                url,
+                json.dumps([
+                    {'mac': node.mac, 'is_agent': True}
+                    for node in self.env.nodes
+                ]),
+                headers=self.default_headers
+            )
+            self.assertEquals(200, resp.status)
+
+        check_in()
+        resp = self.app.get(url, headers=self.default_headers)
+        self.assertEquals(
+            [n['id'] for n in json.loads(resp.body)],
+            sorted(n.id for n in self.env.nodes)
+        )
+        headers = dict(self.default_headers)
+        headers['If-None-Match'] = resp.header_dict['etag']
+
+        # only timestamps of nodes are changed, they aren't rendered
+        check_in()
+        resp = self.app.get(url, headers=headers)
+        self.assertEquals(304, resp.status)
+
     def test_notification_node_id(self):
         node = self.env.create_node(
             api=True,
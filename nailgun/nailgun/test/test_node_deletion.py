@@ -23,6 +23,11 @@ from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 from nailgun.api.models import Node, IPAddr
 from nailgun.api.models import Network, NetworkGroup
+from nailgun.api.models import NodeAttributes, NodeNICInterface
+from nailgun.api.models import NetworkAssignment, ClusterChanges
+from nailgun.api.models import Notification
+from nailgun.network.manager import NetworkManager
+from nailgun.task.helpers import TaskHelper
 from nailgun.test.base import fake_tasks
 
 logger = logging.getLogger(__name__)
@@ -67,3 +72,56 @@ class TestNodeDeletion(BaseHandlers):
 
         self.assertEquals(list(management_net.nodes), [])
         self.assertEquals(list(ipaddrs), [])
+
+    def test_bulk_nodes_deletion(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": True, "pending_addition": True},
+                {"api": True, "pending_addition": True},
+                {"api": True, "pending_addition": True}
+            ]
+        )
+        cluster = self.env.clusters[0]
+        nodes_ids = [n.id for n in self.env.nodes]
+        NetworkManager().assign_ips(nodes_ids, "management")
+        for node_id in nodes_ids:
+            cluster.add_pending_changes("disks", node_id=node_id)
+            self.env.create_notification(node_id=node_id)
+        deleted_ids, kept_id = nodes_ids[:2], nodes_ids[2]
+
+        self.assertNotEqual(
+            self.db.query(NetworkAssignment).join(NodeNICInterface).filter(
+                NodeNICInterface.node_id.in_(deleted_ids)
+            ).count(), 0
+        )
+
+        self.assertEquals(TaskHelper.delete_nodes(deleted_ids), 2)
+        self.db.commit()
+
+        self.assertEquals(
+            [n.id for n in self.db.query(Node).all()], [kept_id]
+        )
+        for model, column in (
+            (IPAddr, IPAddr.node),
+            (NodeNICInterface, NodeNICInterface.node_id),
+            (NodeAttributes, NodeAttributes.node_id),
+            (ClusterChanges, ClusterChanges.node_id)
+        ):
+            query = self.db.query(model)
+            self.assertEquals(
+                query.filter(column.in_(deleted_ids)).count(), 0
+            )
+            self.assertNotEqual(query.filter(column == kept_id).count(), 0)
+        self.assertEquals(
+            self.db.query(NetworkAssignment).join(NodeNICInterface).filter(
+                NodeNICInterface.node_id.in_(deleted_ids)
+            ).count(), 0
+        )
+        # notifications about deleted nodes are kept
+        notifications = self.db.query(Notification).filter_by(
+            message="Test message"
+        ).all()
+        self.assertEquals(
+            sorted(n.node_id for n in notifications), [None, None, kept_id]
+        )
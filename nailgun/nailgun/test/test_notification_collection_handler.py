@@ -18,6 +18,7 @@ import unittest
 import json
 from paste.fixture import TestApp
 
+from nailgun.api.models import Node, NodeAttributes
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 
@@ -53,6 +54,24 @@ class TestHandlers(BaseHandlers):
         self.assertEquals(rn1['cluster'], n1.cluster_id)
         self.assertIsNone(rn0.get('cluster', None))
 
+    def test_etag_changes_when_node_is_deleted(self):
+        node = self.env.create_node(api=False)
+        self.env.create_notification(node_id=node.id)
+        url = reverse('NotificationCollectionHandler')
+        resp = self.app.get(url, headers=self.default_headers)
+        self.assertEquals(json.loads(resp.body)[0]['node_id'], node.id)
+
+        # notifications.node_id is set to NULL by database itself
+        self.db.execute(NodeAttributes.__table__.delete())
+        self.db.execute(Node.__table__.delete())
+        self.db.commit()
+
+        headers = dict(self.default_headers)
+        headers['If-None-Match'] = resp.header_dict['etag']
+        resp = self.app.get(url, headers=headers)
+        self.assertEquals(200, resp.status)
+        self.assertIsNone(json.loads(resp.body)[0]['node_id'])
+
     def test_update(self):
         c = self.env.create_cluster(api=False)
         n0 = self.env.create_notification()
@@ -17,11 +17,19 @@
 import json
 import time
 import uuid
+import threading
+from datetime import datetime, timedelta
 
 from mock import patch
+from kombu import Connection
 
 import nailgun.rpc as rpc
 from nailgun.rpc import receiver as rcvr
+from nailgun.keepalive.watcher import KeepAliveThread
+from nailgun.rpc.coalescer import ProgressCoalescer
+from nailgun.rpc.progress import deploy_progress
+from nailgun.rpc.threaded import RPCConsumer
+from nailgun.stats import counters, gauges
 from nailgun.task.task import VerifyNetworksTask
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
@@ -392,6 +400,174 @@ class TestConsumer(BaseHandlers):
         self.assertEqual(task.progress, 20)
         self.assertEqual(task.status, "running")
 
+    def test_deploy_progress_resp(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"}
+            ]
+        )
+        node1, node2 = self.env.nodes
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            status="running",
+            cluster_id=self.env.clusters[0].id
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        self.receiver.deploy_progress_resp(
+            task_uuid=task.uuid,
+            status='running',
+            nodes=[{'uid': node1.id, 'progress': 50},
+                   {'uid': node2.id, 'progress': 100}]
+        )
+        self.db.refresh(node1)
+        self.db.refresh(node2)
+        self.db.refresh(task)
+        self.assertEqual((node1.progress, node2.progress), (50, 100))
+        self.assertEqual((node1.status, node2.status),
+                         ("deploying", "deploying"))
+        # 30% for provisioning and 70% of nodes deployment progress
+        self.assertEqual(task.progress, 82)
+        self.assertEqual(task.status, "running")
+
+    def test_deploy_progress_is_accumulated(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"}
+            ]
+        )
+        node1, node2, node3 = self.env.nodes
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            status="running",
+            cluster_id=self.env.clusters[0].id
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        with patch.object(deploy_progress, '_load',
+                          wraps=deploy_progress._load) as load:
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': node1.id, 'progress': 50}]
+            )
+            self.db.refresh(task)
+            self.assertEqual(task.progress, 41)
+
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': node2.id, 'progress': 100}]
+            )
+            self.receiver.deploy_progress_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': node3.id, 'progress': 100}]
+            )
+            self.db.refresh(task)
+            self.assertEqual(task.progress, 88)
+            # only the first message loads all nodes of cluster
+            self.assertEqual(load.call_count, 1)
+
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                status='error',
+                nodes=[{'uid': node1.id, 'status': 'error'}]
+            )
+            self.assertNotIn(task.uuid, deploy_progress._tasks)
+
+    def test_deploy_progress_sees_nodes_changed_meanwhile(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"}
+            ]
+        )
+        node1, node2, node3 = self.env.nodes
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deployment",
+            status="running",
+            cluster_id=self.env.clusters[0].id
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        with patch.object(deploy_progress, '_load',
+                          wraps=deploy_progress._load) as load:
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': node1.id, 'progress': 50}]
+            )
+            self.db.refresh(task)
+            self.assertEqual(task.progress, 41)
+
+            # node3 goes offline by keepalive bulk update,
+            # node2 is removed from cluster through ORM
+            node3.timestamp = datetime.now() - timedelta(seconds=100)
+            node2.cluster_id = None
+            self.db.commit()
+            KeepAliveThread(timeout=10).update_status_nodes()
+
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': node1.id, 'progress': 60}]
+            )
+            self.db.refresh(task)
+            # node1: 30 + 0.7 * 60, offline node3: 100
+            self.assertEqual(task.progress, 86)
+            self.assertEqual(load.call_count, 1)
+
+    def test_progress_only_messages_are_coalesced(self):
+        dispatched = []
+        coalescer = ProgressCoalescer(
+            lambda method, args: dispatched.append((method, args)),
+            window=3600
+        )
+
+        def deploy_resp(**kwargs):
+            kwargs['task_uuid'] = 'uuid'
+            coalescer.handle('deploy_resp', kwargs)
+
+        deploy_resp(status='running',
+                    nodes=[{'uid': 1, 'status': 'deploying', 'progress': 0},
+                           {'uid': 2, 'status': 'deploying', 'progress': 0}])
+        deploy_resp(nodes=[{'uid': 1, 'status': 'deploying', 'progress': 10},
+                           {'uid': 2, 'progress': 20}])
+        deploy_resp(nodes=[{'uid': 1, 'progress': 30}])
+        self.assertEqual(len(dispatched), 1)
+
+        deploy_resp(nodes=[{'uid': 1, 'status': 'ready', 'progress': 100}])
+        self.assertEqual(
+            [method for method, args in dispatched],
+            ['deploy_resp', 'deploy_progress_resp', 'deploy_resp']
+        )
+        self.assertEqual(
+            dispatched[1][1]['nodes'],
+            [{'uid': 1, 'progress': 30}, {'uid': 2, 'progress': 20}]
+        )
+
+        # errors and unknown nodes are never delayed
+        deploy_resp(nodes=[{'uid': 3, 'progress': 10}])
+        deploy_resp(nodes=[{'uid': 2, 'progress': 50}], error='error')
+        self.assertEqual(len(dispatched), 5)
+
+        deploy_resp(nodes=[{'uid': 2, 'progress': 60}])
+        self.assertEqual(len(dispatched), 5)
+        coalescer.window = 0.000001
+        coalescer.flush_expired()
+        self.assertEqual(len(dispatched), 6)
+        self.assertEqual(dispatched[5][1]['nodes'],
+                         [{'uid': 2, 'progress': 60}])
+
     def test_error_node_progress(self):
         self.env.create(
             cluster_kwargs={},
@@ -609,3 +785,82 @@ class TestConsumer(BaseHandlers):
             .join(NetworkGroup).\
             filter(NetworkGroup.cluster_id == cluster_db.id).all()
         self.assertNotEqual(len(nets_db), 0)
+
+
+class TestConsumerPool(BaseHandlers):
+
+    def test_messages_are_handled_in_order_of_cluster(self):
+        cluster1 = self.env.create_cluster(api=False)
+        cluster2 = self.env.create_cluster(api=False)
+        tasks = [
+            Task(uuid=str(uuid.uuid4()), name="deploy", cluster_id=c.id)
+            for c in (cluster1, cluster1, cluster2)
+        ]
+        self.db.add_all(tasks)
+        self.db.commit()
+
+        handled = []
+        counters.reset()
+
+        class Receiver(object):
+            def deploy_resp(self, **kwargs):
+                handled.append(
+                    (threading.current_thread().name, kwargs['n'])
+                )
+
+        with Connection('memory://', transport_options={
+                'polling_interval': 0.01}) as conn:
+            consumer = RPCConsumer(conn, Receiver(), workers=4,
+                                   prefetch_count=10)
+            with conn.Producer(serializer='json') as producer:
+                for n in xrange(30):
+                    producer.publish(
+                        {'method': 'deploy_resp',
+                         'args': {'task_uuid': tasks[n % 3].uuid,
+                                  'status': 'error',
+                                  'n': n}},
+                        exchange=rpc.nailgun_exchange,
+                        routing_key='nailgun',
+                        declare=[rpc.nailgun_queue]
+                    )
+            consumer.start_workers()
+            for received, _ in enumerate(consumer.consume(limit=100), 1):
+                if received == 30:
+                    break
+            resp = self.app.get(
+                reverse('StatsHandler') + '?prefix=rpc_',
+                headers=self.default_headers
+            )
+            consumer.stop_workers()
+            consumer.on_iteration()
+
+        self.assertEqual(len(handled), 30)
+        # messages of the same cluster are handled by the same
+        # worker in order they were received
+        for cluster_tasks in ((0, 1), (2,)):
+            cluster_handled = [
+                (thread, n) for thread, n in handled
+                if n % 3 in cluster_tasks
+            ]
+            self.assertEqual(len(set(t for t, n in cluster_handled)), 1)
+            self.assertEqual(
+                [n for t, n in cluster_handled],
+                [n for n in xrange(30) if n % 3 in cluster_tasks]
+            )
+        self.assertEqual(
+            consumer.shard_key({'args': {'task_uuid': tasks[0].uuid}}),
+            consumer.shard_key({'args': {'task_uuid': tasks[1].uuid}})
+        )
+        metrics = consumer.metrics()
+        self.assertEqual(metrics['queue_depth'], 0)
+        # metrics of working consumer are served by stats API
+        stats = json.loads(resp.body)
+        self.assertEqual(
+            stats['gauges']['rpc_consumer']['messages_received'], 30
+        )
+        self.assertEqual(stats['counters']['rpc_messages_received'], 30)
+        self.assertNotIn('rpc_consumer', gauges.collect())
+        self.assertEqual(metrics['messages_received'], 30)
+        self.assertEqual(metrics['handler_calls'], 30)
+        # all handled messages are acknowledged
+        self.assertEqual(consumer._processed.qsize(), 0)
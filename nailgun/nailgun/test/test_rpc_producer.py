@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+from unittest import TestCase
+
+from kombu import Connection
+from kombu import Queue
+from mock import patch
+
+import nailgun.rpc as rpc
+from nailgun import profiler
+from nailgun.rpc.producer import Publisher
+
+
+class TestPublisher(TestCase):
+
+    def setUp(self):
+        self.publisher = Publisher('memory://', limit=2)
+        self.conn = Connection('memory://')
+        self.queue = self.conn.SimpleQueue(rpc.naily_queue)
+        self.queue.clear()
+
+    def tearDown(self):
+        self.publisher.close()
+        self.queue.close()
+        self.conn.release()
+
+    def received(self):
+        messages = []
+        while self.queue.qsize():
+            message = self.queue.get(timeout=1)
+            message.ack()
+            messages.append(message.payload)
+        return messages
+
+    def cast(self, name, message):
+        with patch.object(rpc, 'publisher', self.publisher):
+            rpc.cast(name, message)
+
+    def test_connection_is_reused_and_queue_declared_once(self):
+        with patch.object(Queue, 'declare') as declare:
+            for n in xrange(5):
+                self.cast('naily', {'method': 'deploy', 'n': n})
+        self.assertEqual(declare.call_count, 1)
+        self.assertEqual(
+            [m['n'] for m in self.received()],
+            range(5)
+        )
+
+    def test_generated_messages_are_sent_separately(self):
+        self.cast('naily', ({'n': n} for n in xrange(3)))
+        self.cast('naily', [{'n': 3}, {'n': 4}])
+        self.assertEqual(
+            self.received(),
+            [{'n': 0}, {'n': 1}, {'n': 2}, [{'n': 3}, {'n': 4}]]
+        )
+
+    def test_publish_after_close(self):
+        self.cast('naily', {'n': 0})
+        self.publisher.close()
+        self.cast('naily', {'n': 1})
+        self.assertEqual(self.received(), [{'n': 0}, {'n': 1}])
+
+    def test_cast_is_profiled(self):
+        message = {'method': 'deploy', 'args': {'nodes': []}}
+        profiler.start()
+        try:
+            self.cast('naily', message)
+        finally:
+            report = profiler.stop()
+        self.assertEqual(report['phases'][0]['name'], 'rpc.cast')
+        self.assertEqual(report['bytes'], len(json.dumps(message)))
+        self.assertEqual(self.received(), [message])
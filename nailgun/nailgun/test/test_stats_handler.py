@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+from mock import patch
+
+from nailgun.stats import counters
+from nailgun.test.base import BaseHandlers
+from nailgun.test.base import reverse
+
+
+class TestStatsHandler(BaseHandlers):
+
+    def get_counters(self, prefix):
+        resp = self.app.get(
+            reverse('StatsHandler') + '?prefix=' + prefix,
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        return json.loads(resp.body)['counters']
+
+    def test_nics_check_ins_are_counted(self):
+        node = self.env.create_node(
+            api=True,
+            meta=self.env.generate_interfaces_in_meta(2)
+        )
+        before = self.get_counters('nics_')
+        resp = self.app.put(
+            reverse('NodeCollectionHandler'),
+            json.dumps([{'mac': node['mac'], 'is_agent': True}]),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+
+        after = self.get_counters('nics_')
+        self.assertEquals(
+            after['nics_check_ins_noop'],
+            before.get('nics_check_ins_noop', 0) + 1
+        )
+        self.assertEquals(
+            after.get('nics_check_ins_changed', 0),
+            before.get('nics_check_ins_changed', 0)
+        )
+        self.assertTrue(all(name.startswith('nics_') for name in after))
+
+    @patch('nailgun.api.handlers.base.settings.API_GZIP_MIN_SIZE', 1)
+    def test_api_responses_are_measured_by_endpoint(self):
+        self.env.create_node(api=True)
+        counters.reset()
+        url = reverse('NodeCollectionHandler')
+        headers = dict(self.default_headers)
+        headers['Accept-Encoding'] = 'gzip'
+        resp = self.app.get(url, headers=headers)
+        headers['If-None-Match'] = resp.header_dict['etag']
+        resp = self.app.get(url, headers=headers)
+        self.assertEquals(304, resp.status)
+
+        resp = self.app.get(
+            reverse('StatsHandler') + '?prefix=api_responses',
+            headers=self.default_headers
+        )
+        stats = json.loads(resp.body)
+        self.assertEquals(stats['counters'], {})
+        nodes = stats['gauges']['api_responses'][
+            'NodeCollectionHandler.GET'
+        ]
+        self.assertEquals(nodes['encode_calls'], 1)
+        self.assertIn('encode_seconds', nodes)
+        self.assertEquals(nodes['not_modified'], 1)
+        # gzip savings
+        self.assertLess(nodes['sent_bytes'], nodes['bytes'])
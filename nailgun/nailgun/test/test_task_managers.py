@@ -24,7 +24,10 @@ from nailgun.settings import settings
 import nailgun
 import nailgun.rpc as rpc
 from nailgun.task.manager import DeploymentTaskManager
+from nailgun.task.task import DeploymentTask
 from nailgun.task.fake import FAKE_THREADS
+from nailgun.task.helpers import TaskHelper
+from nailgun.task.state import task_state
 from nailgun.errors import errors
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
@@ -74,6 +77,55 @@ class TestTaskManagers(BaseHandlers):
             self.assertEquals(n.status, 'ready')
             self.assertEquals(n.progress, 100)
 
+    @fake_tasks()
+    @patch('nailgun.task.manager.settings.DEPLOY_MESSAGE_CHUNK_SIZE', 1)
+    def test_deployment_with_chunked_messages(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True},
+                {"pending_addition": True},
+            ]
+        )
+        supertask = self.env.launch_deployment()
+        self.env.wait_ready(supertask, 60)
+        self.env.refresh_nodes()
+        for n in self.env.nodes:
+            self.assertEquals(n.status, 'ready')
+            self.assertEquals(n.progress, 100)
+
+    @fake_tasks()
+    @patch('nailgun.task.manager.settings.DEPLOY_MESSAGE_CHUNK_SIZE', 1)
+    def test_deployment_fails_if_chunk_formatting_fails(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True},
+                {"pending_addition": True},
+            ]
+        )
+        format_nodes = DeploymentTask.format_nodes
+        calls = []
+
+        def fail_second_chunk(task, nodes_ids):
+            calls.append(nodes_ids)
+            if len(calls) > 1:
+                raise Exception("Chunk formatting failed")
+            return format_nodes(task, nodes_ids)
+
+        with patch.object(DeploymentTask, 'format_nodes',
+                          side_effect=fail_second_chunk):
+            supertask = self.env.launch_deployment()
+        self.env.wait_error(supertask, 60)
+        deploy_task = self.db.query(Task).filter_by(
+            parent_id=supertask.id,
+            name='deployment'
+        ).first()
+        self.db.refresh(deploy_task)
+        self.assertEquals(deploy_task.status, 'error')
+        self.assertEquals(deploy_task.message, 'Chunk formatting failed')
+        self.assertEquals(len(calls), 2)
+
     @fake_tasks()
     def test_do_not_redeploy_nodes_in_ready_status(self):
         self.env.create(nodes_kwargs=[
@@ -625,3 +677,125 @@ class TestTaskManagers(BaseHandlers):
         self.env.wait_ready(task, timeout=5)
         release = self.db.query(Release).get(release.id)
         self.assertEquals(release.state, 'available')
+
+    def test_subtasks_updates_are_propagated_once_per_batch(self):
+        cluster = self.env.create_cluster(api=False)
+        supertask = Task(name='deploy', cluster_id=cluster.id)
+        self.db.add(supertask)
+        self.db.commit()
+        provision = supertask.create_subtask('provision')
+        deployment = supertask.create_subtask('deployment')
+        provision.weight = 0.4
+        deployment.weight = 0.6
+        self.db.commit()
+        supertask_uuid = supertask.uuid
+
+        update_parent_task = TaskHelper.update_parent_task
+        with patch.object(TaskHelper, 'update_parent_task',
+                          side_effect=update_parent_task) as update_parent:
+            with task_state.batch():
+                for progress in (10, 50, 100):
+                    TaskHelper.update_task_status(
+                        provision.uuid, 'running', progress
+                    )
+                TaskHelper.update_task_status(
+                    deployment.uuid, 'running', 50
+                )
+                self.assertEquals(update_parent.call_count, 0)
+            update_parent.assert_called_once_with(supertask_uuid)
+
+        supertask = self.db.query(Task).filter_by(uuid=supertask_uuid).one()
+        self.assertEquals(supertask.progress, 70)
+        self.assertEquals(supertask.status, 'running')
+        self.assertEquals(task_state.get(provision.uuid)['progress'], 100)
+
+        # task changed through ORM isn't taken from cache
+        provision.status = 'error'
+        self.db.commit()
+        TaskHelper.update_task_status(deployment.uuid, 'ready', 100)
+        self.db.refresh(supertask)
+        self.assertEquals(supertask.status, 'error')
+        self.assertEquals(
+            self.db.query(Cluster).get(cluster.id).status, 'error'
+        )
+
+    def test_task_cache_is_compressed_and_deferred(self):
+        cluster = self.env.create_cluster(api=False)
+        message = {
+            'method': 'deploy',
+            'args': {'nodes': [{'uid': n, 'role': 'compute'}
+                               for n in xrange(1000)]}
+        }
+        task = Task(name='deployment', cluster_id=cluster.id, cache=message)
+        self.db.add(task)
+        self.db.commit()
+        task_id = task.id
+        self.db.expunge_all()
+
+        stored = self.db.execute(
+            Task.__table__.select().where(Task.id == task_id)
+        ).first()['cache']
+        self.assertLess(len(stored), len(json.dumps(message)) / 10)
+
+        task = self.db.query(Task).get(task_id)
+        self.assertNotIn('cache', task.__dict__)
+        self.assertEquals(task.cache, message)
+
+        resp = self.app.get(
+            reverse('TaskCollectionHandler'),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertNotIn('cache', json.loads(resp.body)[0])
+
+    @fake_tasks()
+    def test_deployment_profile(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True},
+                {"pending_addition": True, "role": "controller"}
+            ]
+        )
+        resp = self.app.put(
+            reverse(
+                'ClusterChangesHandler',
+                kwargs={'cluster_id': self.env.clusters[0].id}
+            ) + '?cprofile=1',
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        supertask_id = json.loads(resp.body)['id']
+
+        resp = self.app.get(
+            reverse('TaskProfileHandler', kwargs={'task_id': supertask_id}),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        profile = json.loads(resp.body)
+        phases = dict((p['name'], p) for p in profile['phases'])
+        for name in ('DeploymentTaskManager.execute',
+                     'ProvisionTask.message',
+                     'DeploymentTask.message'):
+            self.assertEquals(phases[name]['calls'], 1)
+            self.assertGreater(phases[name]['queries'], 0)
+        self.assertTrue(
+            any(name.startswith('NetworkManager.assign') or
+                name.startswith('NetworkManager.bulk_assign')
+                for name in phases)
+        )
+        self.assertGreaterEqual(
+            profile['queries'],
+            phases['DeploymentTaskManager.execute']['queries']
+        )
+        self.assertIn('cumulative', profile['cprofile'])
+
+        subtask = self.db.query(Task).filter_by(
+            parent_id=supertask_id
+        ).first()
+        resp = self.app.get(
+            reverse('TaskProfileHandler', kwargs={'task_id': subtask.id}),
+            headers=self.default_headers,
+            expect_errors=True
+        )
+        self.assertEquals(404, resp.status)
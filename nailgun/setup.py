@@ -26,12 +26,12 @@ requires = [
     'Paste==1.7.5.1',
     'PyYAML==3.10',
     'SQLAlchemy==0.7.8',
-    'amqplib==1.0.2',
-    'anyjson==0.3.1',
+    'amqp==1.4.9',
+    'anyjson==0.3.3',
     'argparse==1.2.1',
     'eventlet==0.9.17',
     'greenlet==0.4.0',
-    'kombu==2.1.8',
+    'kombu==3.0.37',
     'netaddr==0.7.10',
     'nose2==0.4.1',
     'nose==1.1.2',